@@ -0,0 +1,312 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy
+import PIL
+
+from PIL import Image
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple
+from color_harmonization import batch
+from color_harmonization.engine import fitting, frames, harmonization, histogram, lut3d, pixels, \
+    ring, templates
+
+SIZES = [512, 2048]
+REPEAT = 5
+BATCH_IMAGES = 8
+# a case is reported as a regression when its best time grows by more than this
+THRESHOLD = 0.15
+
+# The wheel is drawn at widget size, not at image size.
+RING_SIZE = 512
+SEQUENCE_FRAMES = 24
+
+Case = NamedTuple ("Case", [
+    ("name", str),
+    # work done by one run, in `unit`, for the throughput column
+    ("work", Callable[[int], float]),
+    ("unit", str),
+    # returns the function to time for an image size, after any setup
+    ("prepare", Callable[[int], Callable[[], Any]])
+])
+
+def synthetic_image (size: int, mode: str = "RGB") -> Image.Image:
+    # smooth hue and value gradients with some noise, so the image compresses
+    # and its histogram looks more like a photograph than uniform noise does
+    rng = numpy.random.default_rng (size)
+    y, x = numpy.mgrid[0:size, 0:size].astype (numpy.float32) / size
+    hue = (x + 0.25 * numpy.sin (6 * y)) % 1
+    hsv = numpy.stack ((hue, 0.4 + 0.5 * y, 0.3 + 0.6 * (1 - x * y)), axis = -1)
+    rgb = harmonization.hsv_to_rgb (hsv) * 255 + rng.normal (0, 6, (size, size, 1))
+    image = Image.fromarray (numpy.clip (rgb, 0, 255).astype (numpy.uint8), "RGB")
+    return image if mode == "RGB" else image.convert (mode)
+
+def encoded (image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO ()
+    image.save (buffer, fmt)
+    return buffer.getvalue ()
+
+def pixel_count (size: int) -> float:
+    return size * size / 1e6
+
+def prepare_histogram (size: int) -> Callable[[], Any]:
+    image = synthetic_image (size)
+    histogram.hue_lookup_table ()
+    return lambda: histogram.hue_weights (image)
+
+def prepare_ring (size: int) -> Callable[[], Any]:
+    hist = histogram.compute_histogram (synthetic_image (size))
+    return lambda: ring.rasterize_ring (RING_SIZE, RING_SIZE / 2, RING_SIZE / 4, hist)
+
+def prepare_fitting (size: int) -> Callable[[], Any]:
+    image = synthetic_image (size)
+    weights = histogram.hue_weights (image) / (size * size)
+    return lambda: fitting.best_fit (weights)
+
+def prepare_harmonization (size: int) -> Callable[[], Any]:
+    data = numpy.asarray (synthetic_image (size))
+    sectors = templates.TEMPLATES["V-type"]
+    widths = templates.sector_widths (sectors)
+    centers = templates.sector_centers (sectors, 0.3)
+    return lambda: harmonization.harmonize (data, widths, centers)
+
+def prepare_lut (size: int) -> Callable[[], Any]:
+    data = numpy.asarray (synthetic_image (size))
+    lut = lut3d.sample_template ("V-type", 0.3)
+    lut_planes = lut3d.planes (lut)
+    return lambda: lut3d.apply (data, lut, lut_planes = lut_planes)
+
+class NullWriter:
+    def write (self: 'NullWriter', frame: frames.Frame, result: numpy.ndarray) -> None:
+        pass
+
+def prepare_sequence (size: int) -> Callable[[], Any]:
+    # a pan across the gradient, so the fit moves a little every frame
+    data = numpy.asarray (synthetic_image (size))
+    sequence = [
+        frames.Frame (index, Image.fromarray (numpy.roll (data, index * size // 64, axis = 1)),
+                      frames.DEFAULT_DURATION, None)
+        for index in range (SEQUENCE_FRAMES)
+    ]
+    return lambda: frames.harmonize_frames (sequence, NullWriter ())
+
+def prepare_decode (fmt: str) -> Callable[[int], Callable[[], Any]]:
+    def prepare (size: int) -> Callable[[], Any]:
+        data = encoded (synthetic_image (size), fmt)
+        return lambda: Image.open (io.BytesIO (data)).load ()
+    return prepare
+
+def prepare_texture_data (size: int) -> Callable[[], Any]:
+    image = synthetic_image (size, "RGBA")
+    return lambda: pixels.texture_data (image)
+
+@contextlib.contextmanager
+def batch_directory (size: int, count: int) -> Iterator[str]:
+    with tempfile.TemporaryDirectory (prefix = "color-harmonization-bench-") as directory:
+        image = synthetic_image (size)
+        os.makedirs (os.path.join (directory, "in"))
+        for idx in range (count):
+            image.save (os.path.join (directory, "in", "{:03}.jpg".format (idx)), quality = 90)
+        yield directory
+
+def run_batch (directory: str, jobs: int) -> None:
+    inputs = sorted (
+        os.path.join (directory, "in", name) for name in os.listdir (os.path.join (directory, "in"))
+    )
+    # without the analysis cache, every run analyses the images again
+    args = batch.parse_args (inputs + ["-o", os.path.join (directory, "out"), "-j", str (jobs),
+                                       "--no-cache"])
+
+    with contextlib.redirect_stdout (io.StringIO ()):
+        if batch.run (args) != 0:
+            raise RuntimeError ("batch run failed")
+
+CASES = [
+    Case ("histogram", pixel_count, "Mpx/s", prepare_histogram),
+    Case ("ring", lambda size: pixel_count (RING_SIZE), "Mpx/s", prepare_ring),
+    Case ("fitting", lambda size: 1, "fits/s", prepare_fitting),
+    Case ("harmonization", pixel_count, "Mpx/s", prepare_harmonization),
+    Case ("lut-apply", pixel_count, "Mpx/s", prepare_lut),
+    Case ("sequence", lambda size: SEQUENCE_FRAMES, "frames/s", prepare_sequence),
+    Case ("decode-jpeg", pixel_count, "Mpx/s", prepare_decode ("JPEG")),
+    Case ("decode-png", pixel_count, "Mpx/s", prepare_decode ("PNG")),
+    Case ("texture-data", pixel_count, "Mpx/s", prepare_texture_data),
+]
+
+def measure (function: Callable[[], Any], repeat: int) -> List[float]:
+    function () # warm up caches and lazily built tables
+    timings = []
+    for _ in range (repeat):
+        start = time.perf_counter ()
+        function ()
+        timings.append (time.perf_counter () - start)
+    return timings
+
+def result (name: str, size: int, timings: List[float], work: float, unit: str) -> Dict[str, Any]:
+    best = min (timings)
+    return {
+        "name": name,
+        "size": size,
+        "best": best,
+        "median": statistics.median (timings),
+        "repeat": len (timings),
+        "throughput": work / best if best > 0 else None,
+        "unit": unit
+    }
+
+def run (sizes: List[int] = SIZES, repeat: int = REPEAT, cases: List[str] = None,
+         batch_images: int = BATCH_IMAGES, jobs: int = None,
+         log: Callable[[str], None] = lambda line: None) -> List[Dict[str, Any]]:
+    results = []
+
+    for size in sizes:
+        for case in CASES:
+            if cases is not None and case.name not in cases:
+                continue
+
+            log ("{} at {}px".format (case.name, size))
+            timings = measure (case.prepare (size), repeat)
+            results.append (result (case.name, size, timings, case.work (size), case.unit))
+
+        if cases is None or "batch" in cases:
+            log ("batch at {}px".format (size))
+            with batch_directory (size, batch_images) as directory:
+                timings = measure (lambda: run_batch (directory, jobs or os.cpu_count () or 1),
+                                   max (1, repeat // 2))
+            results.append (result ("batch", size, timings, batch_images, "images/s"))
+
+    return results
+
+def environment () -> Dict[str, Any]:
+    return {
+        "python": platform.python_version (),
+        "numpy": numpy.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform (),
+        "cpus": os.cpu_count (),
+        "time": time.strftime ("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+def compare (baseline: Dict[str, Any], current: Dict[str, Any],
+             threshold: float = THRESHOLD) -> List[Dict[str, Any]]:
+    # returns one row per case both runs measured; only best times are compared,
+    # they are the least sensitive to other load on the machine
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+    rows = []
+
+    for r in current["results"]:
+        old = previous.get ((r["name"], r["size"]))
+        if old is None or old["best"] <= 0:
+            continue
+
+        change = r["best"] / old["best"] - 1
+        rows.append ({
+            "name": r["name"],
+            "size": r["size"],
+            "baseline": old["best"],
+            "current": r["best"],
+            "change": change,
+            "regression": change > threshold
+        })
+
+    return rows
+
+def print_results (results: List[Dict[str, Any]], stream: Any) -> None:
+    print ("{:<14} {:>6}  {:>10}  {:>10}  {:>14}".format (
+        "case", "size", "best", "median", "throughput"
+    ), file = stream)
+    for r in results:
+        print ("{:<14} {:>6}  {:>8.2f}ms  {:>8.2f}ms  {:>14}".format (
+            r["name"], r["size"], r["best"] * 1000, r["median"] * 1000,
+            "-" if r["throughput"] is None else "{:.1f} {}".format (r["throughput"], r["unit"])
+        ), file = stream)
+
+def print_comparison (rows: List[Dict[str, Any]], stream: Any) -> None:
+    print ("{:<14} {:>6}  {:>10}  {:>10}  {:>8}".format (
+        "case", "size", "baseline", "current", "change"
+    ), file = stream)
+    for row in rows:
+        print ("{:<14} {:>6}  {:>8.2f}ms  {:>8.2f}ms  {:>+7.1f}%{}".format (
+            row["name"], row["size"], row["baseline"] * 1000, row["current"] * 1000,
+            row["change"] * 100, "  REGRESSION" if row["regression"] else ""
+        ), file = stream)
+
+def main (argv: List[str]) -> int:
+    parser = argparse.ArgumentParser (
+        prog = "python3 -m benchmarks.suite",
+        description = "Time the image pipeline on synthetic images, without a display."
+    )
+    parser.add_argument ("--sizes", type = int, nargs = "+", default = SIZES,
+                         help = "edge lengths of the synthetic square images")
+    parser.add_argument ("--repeat", type = int, default = REPEAT)
+    parser.add_argument ("--cases", nargs = "+", metavar = "CASE",
+                         choices = [case.name for case in CASES] + ["batch"],
+                         help = "only run these cases")
+    parser.add_argument ("--batch-images", type = int, default = BATCH_IMAGES,
+                         help = "number of images per batch run")
+    parser.add_argument ("-j", "--jobs", type = int, default = None,
+                         help = "worker processes of the batch runs")
+    parser.add_argument ("-o", "--output", metavar = "FILE",
+                         help = "write the results as JSON to FILE instead of stdout")
+    parser.add_argument ("--results", metavar = "FILE",
+                         help = "compare saved results instead of running the suite")
+    parser.add_argument ("--baseline", metavar = "FILE",
+                         help = "flag cases that got slower than in these saved results")
+    parser.add_argument ("--threshold", type = float, default = THRESHOLD,
+                         help = "relative slowdown reported as a regression")
+    args = parser.parse_args (argv)
+
+    if args.results is not None:
+        with open (args.results) as f:
+            current = json.load (f)
+    else:
+        current = {
+            "environment": environment (),
+            "results": run (args.sizes, args.repeat, args.cases, args.batch_images, args.jobs,
+                            lambda line: print (line, file = sys.stderr))
+        }
+
+        if args.output is not None:
+            with open (args.output, "w") as f:
+                json.dump (current, f, indent = 2)
+            print_results (current["results"], sys.stderr)
+        else:
+            json.dump (current, sys.stdout, indent = 2)
+            print ()
+
+    if args.baseline is None:
+        return 0
+
+    with open (args.baseline) as f:
+        rows = compare (json.load (f), current, args.threshold)
+
+    print_comparison (rows, sys.stderr)
+    return 1 if any (row["regression"] for row in rows) else 0
+
+if __name__ == '__main__':
+    sys.exit (main (sys.argv[1:]))
@@ -0,0 +1,98 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import argparse
+import sys
+import time
+import warnings
+import numpy
+
+from PIL import Image
+from typing import Any, Callable, Dict, List
+from color_harmonization.engine import pixels
+
+SIZES = [512, 2048, 8192]
+
+# The per-pixel path needs several GiB and about a minute at 8192px, so it is
+# only measured up to this size unless asked for explicitly.
+LEGACY_MAX_SIZE = 2048
+
+def legacy_texture_data (image: Image.Image) -> numpy.ndarray:
+    with warnings.catch_warnings ():
+        warnings.simplefilter ('ignore')
+        return numpy.array (list (image.convert ("RGBA").getdata ()), numpy.uint8)
+
+def synthetic_image (size: int, mode: str = "RGBA") -> Image.Image:
+    rng = numpy.random.default_rng (size)
+    return Image.fromarray (
+        rng.integers (0, 256, (size, size, len (mode)), dtype = numpy.uint8), mode
+    )
+
+def best_time (function: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range (repeat):
+        start = time.perf_counter ()
+        function ()
+        timings.append (time.perf_counter () - start)
+    return min (timings)
+
+def run (sizes: List[int] = SIZES, repeat: int = 3,
+         legacy_max_size: int = LEGACY_MAX_SIZE) -> List[Dict[str, Any]]:
+    results = []
+
+    for size in sizes:
+        image = synthetic_image (size)
+        image.load ()
+        result = {
+            "size": size,
+            "buffer": best_time (lambda: pixels.texture_data (image), repeat),
+            "legacy": None
+        } # type: Dict[str, Any]
+
+        if size <= legacy_max_size:
+            result["legacy"] = best_time (lambda: legacy_texture_data (image), 1)
+
+        results.append (result)
+
+    return results
+
+def main (argv: List[str]) -> int:
+    parser = argparse.ArgumentParser (
+        prog = "python3 -m benchmarks.texture_data",
+        description = "Compare the texture data preparation of the image loader."
+    )
+    parser.add_argument ("--sizes", type = int, nargs = "+", default = SIZES)
+    parser.add_argument ("--repeat", type = int, default = 3)
+    parser.add_argument ("--legacy-max-size", type = int, default = LEGACY_MAX_SIZE,
+                         help = "largest size the per-pixel getdata path is timed at")
+    args = parser.parse_args (argv)
+
+    print ("{:>6}  {:>12}  {:>12}  {:>8}".format ("size", "getdata", "buffer", "speedup"))
+    for result in run (args.sizes, args.repeat, args.legacy_max_size):
+        legacy = result["legacy"]
+        print ("{:>6}  {:>12}  {:>10.2f}ms  {:>8}".format (
+            result["size"],
+            "skipped" if legacy is None else "{:.2f}ms".format (legacy * 1000),
+            result["buffer"] * 1000,
+            "-" if legacy is None else "{:.0f}x".format (legacy / result["buffer"])
+        ))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit (main (sys.argv[1:]))
@@ -19,15 +19,39 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 '''
 
 import sys
-import gi
-gi.require_version ('Gtk', '3.0')
 
 from typing import List
-from color_harmonization import global_variables
-from color_harmonization.application import Application
+from color_harmonization import global_variables, startup, tracing
 
 def main (argv: List[str]) -> int:
-    global_variables.App = Application ()
+    if "--trace" in argv[:-1]:
+        # writes a Chrome trace of the session to the given file on exit
+        idx = argv.index ("--trace")
+        tracing.enable (argv[idx + 1])
+        argv = argv[:idx] + argv[idx + 2:]
+
+    if len (argv) > 1 and argv[1] == "batch":
+        from color_harmonization import batch
+        return batch.main (argv[2:])
+
+    if len (argv) > 1 and argv[1] == "sequence":
+        from color_harmonization import sequence
+        return sequence.main (argv[2:])
+
+    if "--startup-profile" in argv:
+        # prints the time spent in each phase up to the first frame
+        startup.enabled = True
+        argv = [arg for arg in argv if arg != "--startup-profile"]
+
+    with startup.phase ("import application"):
+        # includes Gtk, which the application modules import first
+        import gi
+        gi.require_version ('Gtk', '3.0')
+        from color_harmonization.application import Application
+
+    with startup.phase ("create assistant"):
+        global_variables.App = Application ()
+
     return global_variables.App.run ()
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import argparse
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import analysis_cache, fitting, lut3d, templates, tiling
+
+# The GUI fits the template on a 512px preview of an image, the batch mode
+# uses a preview of the same size so both pick about the same template and
+# share the fits in the analysis cache.
+ANALYSIS_SIZE = analysis_cache.ANALYSIS_SIZE
+
+def parse_args (argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser (
+        prog = "python3 -m color_harmonization batch",
+        description = "Harmonize images without opening the assistant."
+    )
+    parser.add_argument ("inputs", nargs = "+", metavar = "IMAGE",
+                         help = "images to harmonize")
+    parser.add_argument ("-o", "--output", required = True, metavar = "DIR",
+                         help = "directory the harmonized images are written to")
+    parser.add_argument ("-t", "--template", default = "auto",
+                         choices = ["auto"] + templates.NAMES,
+                         help = "harmonic template, 'auto' picks the best fitting one")
+    parser.add_argument ("-j", "--jobs", type = int, default = os.cpu_count () or 1,
+                         help = "number of worker processes")
+    parser.add_argument ("--analysis-size", type = int, default = ANALYSIS_SIZE,
+                         help = "size of the preview the template is fitted on")
+    parser.add_argument ("-m", "--memory-limit", type = tiling.parse_size,
+                         default = tiling.DEFAULT_MEMORY_LIMIT, metavar = "SIZE",
+                         help = "memory a worker may use for image strips, e.g. 512M")
+    parser.add_argument ("--lut-size", type = int, default = 0, metavar = "N",
+                         help = "harmonize through an N×N×N 3D LUT instead of per pixel, "
+                                "e.g. {}".format (lut3d.DEFAULT_SIZE))
+    parser.add_argument ("--cube", action = "store_true",
+                         help = "also write the transform of every image as a .cube 3D LUT")
+    parser.add_argument ("--no-cache", action = "store_true",
+                         help = "neither read nor write the analysis cache")
+    args = parser.parse_args (argv)
+
+    if args.lut_size == 1 or args.lut_size < 0:
+        parser.error ("--lut-size must be 0 or at least 2")
+
+    return args
+
+def destinations (inputs: List[str], output: str) -> List[str]:
+    # Inputs keep their path below the deepest directory they all share, so
+    # images of the same name from different directories do not overwrite
+    # each other; inputs from a single directory keep just their name.
+    paths = [os.path.abspath (path) for path in inputs]
+    common = os.path.commonpath ([os.path.dirname (path) for path in paths])
+    return [os.path.join (output, os.path.relpath (path, common)) for path in paths]
+
+def cube_path (destination: str) -> str:
+    # the full image name is kept, img.jpg and img.png get distinct LUTs
+    return destination + ".cube"
+
+def check_destinations (inputs: List[str], outputs: List[str], cube: bool) -> List[str]:
+    # every problem found, before any image is written
+    errors = []
+    written = {} # type: Dict[str, str]
+
+    for path, destination in zip (inputs, outputs):
+        if os.path.exists (destination) and os.path.samefile (path, destination):
+            errors.append ("{}: the destination is the source image".format (path))
+
+        targets = [destination]
+        if cube:
+            targets.append (cube_path (destination))
+
+        for target in targets:
+            key = os.path.normcase (os.path.abspath (target))
+            if key in written:
+                errors.append ("{} and {} would both be written to {}".format (
+                    written[key], path, target
+                ))
+            else:
+                written[key] = path
+
+    return errors
+
+def process_image (path: str, destination: str, template: str, analysis_size: int,
+                   memory_limit: int, lut_size: int = 0, cube: bool = False,
+                   use_cache: bool = False, fits: Dict[str, fitting.Fit] = None
+                   ) -> Tuple[str, fitting.Fit, List[Dict[str, Any]]]:
+    # fits are passed in when the analysis cache already knew them
+    os.makedirs (os.path.dirname (destination), exist_ok = True)
+
+    with tracing.span ("image", path = path), tiling.StripReader (path) as reader:
+        with tracing.span ("analysis"):
+            if fits is None:
+                fits = analysis_cache.preview_fits (
+                    path, analysis_size, lambda: reader.preview (analysis_size, memory_limit),
+                    analysis_cache.default_cache if use_cache else None
+                )
+            fit = analysis_cache.choose_fit (fits, template)
+        sectors = templates.TEMPLATES[fit.template]
+        widths = templates.sector_widths (sectors)
+        centers = templates.sector_centers (sectors, fit.rotation)
+        lut = None
+
+        if lut_size > 0 or cube:
+            lut = lut3d.sample (widths, centers, lut_size or lut3d.DEFAULT_SIZE)
+
+        if cube:
+            lut3d.write_cube (cube_path (destination), lut,
+                              lut3d.cube_title (fit.template, fit.rotation))
+
+        tiling.harmonize_file (reader, destination, widths, centers, memory_limit,
+                               lut if lut_size > 0 else None)
+
+    # the events of the worker process travel back with its result
+    return destination, fit, tracing.drain () if tracing.enabled else []
+
+def run (args: argparse.Namespace) -> int:
+    outputs = destinations (args.inputs, args.output)
+    errors = check_destinations (args.inputs, outputs, args.cube)
+
+    if errors:
+        for error in errors:
+            print ("error: {}".format (error), file = sys.stderr)
+        return 1
+
+    os.makedirs (args.output, exist_ok = True)
+    jobs = max (1, args.jobs)
+    inputs = iter (zip (args.inputs, outputs)) # type: Iterator[Tuple[str, str]]
+    pending = {} # type: Dict[Future, str]
+    failures = 0
+    cache = None if args.no_cache else analysis_cache.default_cache
+    known = {} # type: Dict[str, Any]
+
+    # a single batched lookup of every input analysed in an earlier run; the
+    # files are not hashed here, workers hash the ones the cache missed
+    if cache is not None:
+        key = analysis_cache.fits_kind (analysis_cache.REDUCED, args.analysis_size)
+        known = cache.get_many (args.inputs, key, compute = False)
+
+    # keep at most two images per worker in flight, so thousands of input
+    # files do not pile up as queued work items
+    with ProcessPoolExecutor (jobs) as pool:
+        while True:
+            for path, destination in inputs:
+                future = pool.submit (process_image, path, destination, args.template,
+                                      args.analysis_size, args.memory_limit, args.lut_size,
+                                      args.cube, cache is not None,
+                                      analysis_cache.decode_fits (known[path])
+                                      if path in known else None)
+                pending[future] = path
+
+                if len (pending) >= 2 * jobs:
+                    break
+
+            if not pending:
+                break
+
+            done, _ = wait (pending, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                path = pending.pop (future)
+
+                try:
+                    destination, fit, events = future.result ()
+                except Exception as e:
+                    failures += 1
+                    print ("{}: error: {}".format (path, e), file = sys.stderr)
+                    continue
+
+                tracing.extend (events)
+                print ("{}: {} rotated by {:.1f}° (cost {:.4f}) -> {}".format (
+                    path, fit.template, fit.rotation * 360, fit.cost, destination
+                ))
+
+    if failures > 0:
+        print ("{} of {} images failed".format (failures, len (args.inputs)), file = sys.stderr)
+        return 1
+
+    return 0
+
+def main (argv: List[str]) -> int:
+    return run (parse_args (argv))
@@ -0,0 +1,285 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import numpy
+
+from PIL import Image
+from typing import Callable, Dict, Iterable, List, Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import fitting, histogram, templates
+
+# Results are stored per file content and per kind of analysis, e.g.
+# "histogram/512". Bump VERSION whenever the histogram, the fitting or the
+# sector assignment change their results; older rows are ignored then.
+VERSION = 2
+ENV_VARIABLE = "COLOR_HARMONIZATION_ANALYSIS_CACHE"
+
+# The assistant, the harmonization jobs and the batch mode fit templates on
+# the hue weights of a preview of this size.
+ANALYSIS_SIZE = 512
+
+# Strip readers reduce an image by an integer factor, the assistant thumbnails
+# a level of its pyramid. The weights of both previews differ slightly, so
+# their fits are stored apart.
+REDUCED = "reduced"
+THUMBNAIL = "thumbnail"
+
+HISTOGRAM = "histogram"
+WEIGHTS = "weights"
+FITS = "fits"
+SECTOR_MAP = "sector-map"
+
+# rows per query, below the SQLite limit of host parameters
+BATCH_SIZE = 500
+HASH_BLOCK_SIZE = 1024 * 1024
+# seconds a writer waits for a concurrent one, e.g. another batch worker
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analyses (
+    digest TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (digest, kind, version)
+) WITHOUT ROWID;
+"""
+
+def kind (name: str, *params: object) -> str:
+    return "/".join ([name] + [str (param) for param in params])
+
+def fits_kind (method: str, size: int) -> str:
+    return kind (FITS, method, size)
+
+def sector_map_kind (size: int, widths: numpy.ndarray, centers: numpy.ndarray) -> str:
+    return kind (SECTOR_MAP, size, *("{:.6f}".format (value)
+                                     for value in numpy.concatenate ((widths, centers))))
+
+def encode_fits (fits: Dict[str, fitting.Fit]) -> numpy.ndarray:
+    # (templates, 2) rotation and cost, in the order of templates.NAMES
+    return numpy.array ([[fits[name].rotation, fits[name].cost] for name in templates.NAMES])
+
+def decode_fits (value: numpy.ndarray) -> Dict[str, fitting.Fit]:
+    return {
+        name: fitting.Fit (name, float (rotation), float (cost))
+        for name, (rotation, cost) in zip (templates.NAMES, value)
+    }
+
+def choose_fit (fits: Dict[str, fitting.Fit], template: str = "auto") -> fitting.Fit:
+    # the same fit as fitting.best_fit, or fit_templates of the one template
+    return fitting.choose_fit (fits, templates.NAMES if template == "auto" else [template])
+
+def file_digest (path: str) -> str:
+    digest = hashlib.blake2b (digest_size = 20)
+
+    with tracing.span ("file digest", path = path), open (path, "rb") as f:
+        for block in iter (lambda: f.read (HASH_BLOCK_SIZE), b""):
+            digest.update (block)
+
+    return digest.hexdigest ()
+
+def _encode (value: numpy.ndarray) -> bytes:
+    buffer = io.BytesIO ()
+    numpy.save (buffer, numpy.asarray (value), allow_pickle = False)
+    return buffer.getvalue ()
+
+def _decode (value: bytes) -> numpy.ndarray:
+    return numpy.load (io.BytesIO (value), allow_pickle = False)
+
+def _chunks (items: List, size: int = BATCH_SIZE) -> Iterable[List]:
+    for start in range (0, len (items), size):
+        yield items[start:start + size]
+
+def _placeholders (count: int) -> str:
+    return ",".join ("?" * count)
+
+class AnalysisCache:
+    # Safe to share between threads and processes: every thread (and every
+    # forked process) opens a connection of its own, and the database runs in
+    # WAL mode, so readers never wait for a writer. A cache that cannot be
+    # read or written only costs time, its errors are reported once and
+    # otherwise ignored.
+    def __init__ (self: 'AnalysisCache', path: str) -> None:
+        self.path = path
+        self.__local = threading.local ()
+        self.__failed = False
+
+    def __connection (self: 'AnalysisCache') -> sqlite3.Connection:
+        if getattr (self.__local, "pid", None) != os.getpid ():
+            directory = os.path.dirname (self.path)
+            if directory:
+                os.makedirs (directory, exist_ok = True)
+
+            connection = sqlite3.connect (self.path, timeout = BUSY_TIMEOUT,
+                                          isolation_level = None)
+            connection.execute ("PRAGMA journal_mode = WAL")
+            connection.execute ("PRAGMA synchronous = NORMAL")
+            connection.executescript (SCHEMA)
+            self.__local.connection = connection
+            self.__local.pid = os.getpid ()
+
+        return self.__local.connection
+
+    def __report (self: 'AnalysisCache', error: Exception) -> None:
+        if not self.__failed:
+            self.__failed = True
+            print ("Analysis cache '{}' is not available: {}".format (self.path, error))
+
+    def __digests (self: 'AnalysisCache', connection: sqlite3.Connection, paths: List[str],
+                   compute: bool) -> Dict[str, str]:
+        # a file whose size and modification time did not change since it was
+        # hashed keeps its digest, without reading it again
+        stats = {} # type: Dict[str, Tuple[int, int]]
+        for path in paths:
+            try:
+                stat = os.stat (path)
+            except OSError:
+                continue
+            stats[os.path.abspath (path)] = (stat.st_size, stat.st_mtime_ns)
+
+        known = {} # type: Dict[str, str]
+        for chunk in _chunks (list (stats)):
+            for path, size, mtime, digest in connection.execute (
+                    "SELECT path, size, mtime, digest FROM files WHERE path IN ({})".format (
+                        _placeholders (len (chunk))), chunk):
+                if stats[path] == (size, mtime):
+                    known[path] = digest
+
+        if compute:
+            hashed = [(path, stats[path][0], stats[path][1], file_digest (path))
+                      for path in stats if path not in known]
+            if hashed:
+                with connection:
+                    connection.execute ("BEGIN IMMEDIATE")
+                    connection.executemany ("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                            hashed)
+                known.update ((path, digest) for path, _, _, digest in hashed)
+
+        return {path: known[os.path.abspath (path)]
+                for path in paths if os.path.abspath (path) in known}
+
+    def digests (self: 'AnalysisCache', paths: Iterable[str],
+                 compute: bool = True) -> Dict[str, str]:
+        # compute = False only returns the digests known from earlier runs
+        try:
+            return self.__digests (self.__connection (), list (paths), compute)
+        except (sqlite3.Error, OSError) as e:
+            self.__report (e)
+            return {}
+
+    def get_many (self: 'AnalysisCache', paths: Iterable[str], kind: str,
+                  compute: bool = True) -> Dict[str, numpy.ndarray]:
+        # one query per BATCH_SIZE files instead of one per file
+        with tracing.span ("analysis cache read", kind = kind):
+            try:
+                connection = self.__connection ()
+                digests = self.__digests (connection, list (paths), compute)
+                values = {} # type: Dict[str, bytes]
+
+                for chunk in _chunks (sorted (set (digests.values ()))):
+                    values.update (connection.execute (
+                        "SELECT digest, value FROM analyses "
+                        "WHERE kind = ? AND version = ? AND digest IN ({})".format (
+                            _placeholders (len (chunk))), [kind, VERSION] + chunk
+                    ))
+
+                return {path: _decode (values[digest])
+                        for path, digest in digests.items () if digest in values}
+            except (sqlite3.Error, OSError, ValueError) as e:
+                self.__report (e)
+                return {}
+
+    def get (self: 'AnalysisCache', path: str, kind: str) -> numpy.ndarray:
+        return self.get_many ([path], kind).get (path)
+
+    def put (self: 'AnalysisCache', path: str, values: Dict[str, numpy.ndarray]) -> None:
+        # the results of several kinds for one file, in a single transaction
+        with tracing.span ("analysis cache write"):
+            try:
+                connection = self.__connection ()
+                digest = self.__digests (connection, [path], True).get (path)
+                if digest is None:
+                    return
+
+                with connection:
+                    connection.execute ("BEGIN IMMEDIATE")
+                    connection.executemany (
+                        "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)",
+                        [(digest, kind, VERSION, _encode (value))
+                         for kind, value in values.items ()]
+                    )
+            except (sqlite3.Error, OSError) as e:
+                self.__report (e)
+
+def cached_fits (path: str, size: int, method: str, weights: Callable[[], numpy.ndarray],
+                 cache: AnalysisCache = None) -> Dict[str, fitting.Fit]:
+    # the fits of every template to the hue weights (see histogram.hue_weights,
+    # divided by the pixel count) of a preview of the given size and method;
+    # the weights are only computed when the cache does not know the fits
+    key = fits_kind (method, size)
+    value = cache.get (path, key) if cache is not None else None
+    if value is not None:
+        return decode_fits (value)
+
+    values = weights ()
+    fits = fitting.fit_templates (values)
+
+    if cache is not None:
+        cache.put (path, {kind (WEIGHTS, method, size): values, key: encode_fits (fits)})
+
+    return fits
+
+def preview_weights (image: Image.Image) -> numpy.ndarray:
+    return histogram.hue_weights (image) / (image.size[0] * image.size[1])
+
+def preview_fits (path: str, size: int, preview: Callable[[], Image.Image],
+                  cache: AnalysisCache = None) -> Dict[str, fitting.Fit]:
+    # fits of a tiling.StripReader preview, which is only made when the
+    # cache does not know the fits
+    return cached_fits (path, size, REDUCED, lambda: preview_weights (preview ()), cache)
+
+def default_path () -> str:
+    cache_home = os.environ.get ("XDG_CACHE_HOME") or os.path.join (
+        os.path.expanduser ("~"), ".cache"
+    )
+    return os.path.join (cache_home, "color-harmonization", "analysis.sqlite")
+
+def open_cache (path: str = None) -> AnalysisCache:
+    # None when the cache is switched off with COLOR_HARMONIZATION_ANALYSIS_CACHE=0
+    if path is None:
+        path = os.environ.get (ENV_VARIABLE) or default_path ()
+
+    if path == "0":
+        return None
+
+    return AnalysisCache (path)
+
+# no connection is opened before the first lookup
+default_cache = open_cache ()
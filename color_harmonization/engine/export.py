@@ -0,0 +1,164 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import os
+import threading
+
+from PIL import Image
+from typing import Any, Callable, Dict, List, NamedTuple
+from color_harmonization import tracing
+from color_harmonization.engine import jobs, lut3d, tiling
+
+DEFAULT_QUALITY = 90
+
+Format = NamedTuple ('Format', [('name', str), ('extensions', List[str]), ('quality', bool),
+                                ('streamed', bool)])
+
+FORMATS = [
+    Format ("JPEG", [".jpg", ".jpeg"], True, False),
+    Format ("PNG", [".png"], False, True),
+    Format ("WebP", [".webp"], True, False),
+    Format ("TIFF", [".tif", ".tiff"], False, True),
+    # the transform itself as a 3D LUT, for tools that apply it to other footage
+    Format ("Cube LUT", [".cube"], False, False)
+] # type: List[Format]
+
+CUBE = FORMATS[-1]
+
+def format_by_name (name: str) -> Format:
+    for fmt in FORMATS:
+        if fmt.name == name:
+            return fmt
+
+    raise KeyError (name)
+
+def format_for_path (path: str, default: Format = FORMATS[1]) -> Format:
+    extension = os.path.splitext (path)[1].lower ()
+
+    for fmt in FORMATS:
+        if extension in fmt.extensions:
+            return fmt
+
+    return default
+
+def with_extension (path: str, fmt: Format) -> str:
+    root, extension = os.path.splitext (path)
+
+    if extension.lower () in fmt.extensions:
+        return path
+
+    return root + fmt.extensions[0]
+
+class ExportJob:
+    # Writes the full resolution result of a HarmonizationJob. Streamed
+    # formats are written strip by strip from the result array, the Pillow
+    # encoders get a view of it, so the image is never held twice. The Cube
+    # LUT format writes the fitted transform instead of the image.
+    def __init__ (self: 'ExportJob', job: jobs.HarmonizationJob, path: str,
+                  fmt: Format = None, quality: int = DEFAULT_QUALITY,
+                  progress: Callable[['ExportJob', float], None] = None,
+                  done: Callable[['ExportJob'], None] = None,
+                  memory_limit: int = tiling.DEFAULT_MEMORY_LIMIT) -> None:
+        self.result = job.result
+        self.fit = job.fit
+        self.mode = job.mode
+        self.info = job.info
+        self.path = path
+        self.format = fmt or format_for_path (path)
+        self.quality = quality
+        self.memory_limit = memory_limit
+        self.error = None # type: Exception
+        self.__progress = progress
+        self.__done = done
+        self.__cancelled = threading.Event ()
+
+    @property
+    def cancelled (self: 'ExportJob') -> bool:
+        return self.__cancelled.is_set ()
+
+    def cancel (self: 'ExportJob') -> None:
+        self.__cancelled.set ()
+
+    def __report (self: 'ExportJob', fraction: float) -> None:
+        if self.__progress is not None:
+            self.__progress (self, fraction)
+
+    def __write_strips (self: 'ExportJob') -> None:
+        height, width = self.result.shape[:2]
+        channels = len (self.mode)
+        rows = tiling.rows_per_strip (width, self.memory_limit)
+        writer = tiling.TiffStripWriter if self.format.name == "TIFF" else tiling.PngStripWriter
+
+        with writer (self.path, (width, height), self.mode, self.info) as out:
+            for top in range (0, height, rows):
+                if self.cancelled:
+                    raise jobs.JobCancelled ()
+
+                out.write (top, self.result[top:top + rows, :, :channels])
+                self.__report (min (top + rows, height) / height)
+
+    def __write_cube (self: 'ExportJob') -> None:
+        lut = lut3d.sample_template (self.fit.template, self.fit.rotation)
+        lut3d.write_cube (self.path, lut, lut3d.cube_title (self.fit.template, self.fit.rotation))
+        self.__report (1.0)
+
+    def __save (self: 'ExportJob') -> None:
+        height, width = self.result.shape[:2]
+        # JPEG has no alpha, it reads the RGBX view and skips the fourth byte
+        mode = "RGBX" if self.format.name == "JPEG" else jobs.buffer_mode (self.mode)
+        image = Image.frombuffer (mode, (width, height), self.result, "raw", mode, 0, 1)
+        params = {} # type: Dict[str, Any]
+
+        for key in ("icc_profile", "exif"):
+            if self.info.get (key):
+                params[key] = self.info[key]
+
+        if self.format.quality:
+            params["quality"] = self.quality
+
+        try:
+            image.save (self.path, self.format.name.upper (), **params)
+        except BaseException:
+            if os.path.exists (self.path):
+                os.remove (self.path)
+            raise
+
+        self.__report (1.0)
+
+    @tracing.traced ("export")
+    def run (self: 'ExportJob') -> None:
+        try:
+            self.__report (0.0)
+
+            if self.format == CUBE:
+                self.__write_cube ()
+            elif self.format.streamed:
+                self.__write_strips ()
+            else:
+                self.__save ()
+        except jobs.JobCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+
+        if self.__done is not None:
+            self.__done (self)
+
+    def start (self: 'ExportJob') -> None:
+        # not a daemon, quitting the application waits for the file to be complete
+        threading.Thread (target = self.run).start ()
@@ -0,0 +1,109 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import functools
+import numpy
+
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+from color_harmonization.engine import templates
+
+# Rotations are evaluated on a grid four times finer than the hue bins of the
+# histogram. PIL stores hue as 255 * h, so the center of bin b lies at
+# (b + 0.5) / 255 which is exactly grid point 4 * b + 2.
+SUBDIVISIONS = 4
+RESOLUTION = SUBDIVISIONS * 255
+COST_TOLERANCE = 1e-9
+
+Fit = NamedTuple ('Fit', [('template', str), ('rotation', float), ('cost', float)])
+
+def template_distance (template: Tuple[List[float], List[float]],
+                       resolution: int = RESOLUTION) -> numpy.ndarray:
+    hue = numpy.arange (resolution) / resolution
+    distance = numpy.full (resolution, numpy.inf)
+
+    for width, center in zip (templates.sector_widths (template),
+                              templates.sector_centers (template, 0.0)):
+        arc = numpy.abs ((hue - center + 0.5) % 1.0 - 0.5)
+        distance = numpy.minimum (distance, numpy.maximum (arc - width / 2, 0.0))
+
+    return distance
+
+@functools.lru_cache (maxsize = 4)
+def _template_spectra (names: Tuple[str, ...]) -> numpy.ndarray:
+    distances = numpy.stack ([
+        template_distance (templates.TEMPLATES[name]) for name in names
+    ])
+    return numpy.conj (numpy.fft.rfft (distances, axis = -1))
+
+def rotation_costs (weights: numpy.ndarray,
+                    names: Iterable[str] = templates.NAMES) -> Dict[str, numpy.ndarray]:
+    names = tuple (names)
+    weights = numpy.asarray (weights, dtype = numpy.float64)
+
+    spread = numpy.zeros (RESOLUTION)
+    numpy.add.at (spread, (SUBDIVISIONS * numpy.arange (len (weights)) + SUBDIVISIONS // 2) % RESOLUTION,
+                  weights)
+
+    # cost[j] = sum_k spread[k] * distance[k - j], a circular correlation
+    costs = numpy.fft.irfft (numpy.fft.rfft (spread) * _template_spectra (names),
+                             n = RESOLUTION, axis = -1)
+    return dict (zip (names, costs))
+
+def fit_templates (weights: numpy.ndarray,
+                   names: Iterable[str] = templates.NAMES) -> Dict[str, Fit]:
+    fits = {}
+
+    for name, costs in rotation_costs (weights, names).items ():
+        idx = int (numpy.argmin (costs))
+        fits[name] = Fit (name, idx / RESOLUTION, max (float (costs[idx]), 0.0))
+
+    return fits
+
+def choose_fit (fits: Dict[str, Fit], names: Iterable[str] = templates.NAMES) -> Fit:
+    names = [name for name in names if name in fits]
+    lowest = min (fits[name].cost for name in names)
+
+    # ties (e.g. several templates covering every hue) go to the earlier name
+    return next (fits[name] for name in names if fits[name].cost <= lowest + COST_TOLERANCE)
+
+def best_fit (weights: numpy.ndarray, names: Iterable[str] = templates.NAMES) -> Fit:
+    names = list (names)
+    return choose_fit (fit_templates (weights, names), names)
+
+@functools.lru_cache (maxsize = None)
+def _distance (name: str) -> numpy.ndarray:
+    return template_distance (templates.TEMPLATES[name])
+
+def local_costs (weights: numpy.ndarray, name: str, rotations: numpy.ndarray) -> numpy.ndarray:
+    # the costs of rotation_costs for a few grid rotations, computed directly
+    weights = numpy.asarray (weights, dtype = numpy.float64)
+    positions = SUBDIVISIONS * numpy.arange (len (weights)) + SUBDIVISIONS // 2
+    offsets = (positions - numpy.asarray (rotations)[:, numpy.newaxis]) % RESOLUTION
+    return _distance (name)[offsets] @ weights
+
+def track_fit (weights: numpy.ndarray, previous: Fit, max_step: float) -> Fit:
+    # the best rotation of the previous template at most max_step away from
+    # the previous rotation; ties keep the rotation closest to the previous one
+    steps = max (1, int (round (max_step * RESOLUTION)))
+    offsets = numpy.arange (1, steps + 1)
+    offsets = numpy.concatenate (([0], numpy.stack ((-offsets, offsets), axis = -1).ravel ()))
+    rotations = (int (round (previous.rotation * RESOLUTION)) + offsets) % RESOLUTION
+
+    costs = local_costs (weights, previous.template, rotations)
+    idx = int (numpy.argmin (costs))
+    return Fit (previous.template, int (rotations[idx]) / RESOLUTION, max (float (costs[idx]), 0.0))
@@ -0,0 +1,316 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import collections
+import os
+import queue
+import re
+import threading
+import numpy
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from PIL import Image, ImageSequence
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Set, \
+    Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import fitting, harmonization, histogram, lut3d, templates, \
+    tiling
+
+# Frames are analysed at this size; the histogram of a frame is smoothed with
+# an exponential moving average over about DEFAULT_WINDOW frames.
+ANALYSIS_SIZE = 256
+DEFAULT_WINDOW = 8
+# The rotation follows the smoothed histogram by at most this much per frame;
+# every REFIT_INTERVAL frames a full fit replaces the tracked one if it is
+# clearly better.
+MAX_ROTATION_STEP = 2 / 360
+REFIT_INTERVAL = 12
+SWITCH_MARGIN = 0.1
+
+PREFETCH = 4
+# milliseconds per frame of frame directories written as an animation
+DEFAULT_DURATION = 40
+
+ANIMATION_EXTENSIONS = (".gif", ".png", ".apng", ".webp")
+FRAME_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".ppm", ".tif", ".tiff", ".webp")
+
+Frame = NamedTuple ('Frame', [('index', int), ('image', Image.Image), ('duration', float),
+                              ('name', str)])
+
+def _natural_key (name: str) -> List[Any]:
+    # frame_2.png sorts before frame_10.png
+    return [int (part) if part.isdigit () else part.lower ()
+            for part in re.split (r'(\d+)', name)]
+
+def frame_paths (directory: str) -> List[str]:
+    names = [
+        name for name in os.listdir (directory)
+        if os.path.splitext (name)[1].lower () in FRAME_EXTENSIONS
+    ]
+    return [os.path.join (directory, name) for name in sorted (names, key = _natural_key)]
+
+def read_frames (path: str) -> Iterator[Frame]:
+    # a numbered frame directory or the frames of an animated image; every
+    # frame has the mode of the first one
+    mode = None # type: str
+
+    if os.path.isdir (path):
+        for index, frame_path in enumerate (frame_paths (path)):
+            with tracing.span ("decode", path = frame_path), Image.open (frame_path) as f:
+                mode = mode or ("RGBA" if tiling.has_alpha (f) else "RGB")
+                yield Frame (index, f.convert (mode), f.info.get ("duration", DEFAULT_DURATION),
+                             os.path.basename (frame_path))
+        return
+
+    with Image.open (path) as f:
+        for index, frame in enumerate (ImageSequence.Iterator (f)):
+            with tracing.span ("decode", index = index):
+                mode = mode or ("RGBA" if tiling.has_alpha (frame) else "RGB")
+                image = frame.convert (mode)
+            yield Frame (index, image, frame.info.get ("duration", DEFAULT_DURATION), None)
+
+def prefetch (frames: Iterable[Frame], count: int = PREFETCH) -> Iterator[Frame]:
+    # decodes up to count frames ahead on a thread of its own
+    done = object ()
+    stopped = threading.Event ()
+    pending = queue.Queue (count) # type: queue.Queue
+
+    def put (item: Any) -> bool:
+        while not stopped.is_set ():
+            try:
+                pending.put (item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def decode () -> None:
+        try:
+            for frame in frames:
+                if not put (frame):
+                    return
+            put (done)
+        except BaseException as e:
+            put (e)
+
+    threading.Thread (target = decode, daemon = True).start ()
+
+    try:
+        while True:
+            item = pending.get ()
+            if item is done:
+                return
+            if isinstance (item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set ()
+
+class FitTracker:
+    def __init__ (self: 'FitTracker', template: str = "auto", window: int = DEFAULT_WINDOW,
+                  max_step: float = MAX_ROTATION_STEP,
+                  refit_interval: int = REFIT_INTERVAL) -> None:
+        self.template = template
+        self.max_step = max_step
+        self.refit_interval = refit_interval
+        self.weights = None # type: numpy.ndarray
+        self.fit = None # type: fitting.Fit
+        self.__alpha = 2 / (max (1, window) + 1)
+        self.__since_refit = 0
+
+    def __full_fit (self: 'FitTracker') -> fitting.Fit:
+        if self.template == "auto":
+            return fitting.best_fit (self.weights)
+
+        return fitting.fit_templates (self.weights, [self.template])[self.template]
+
+    def update (self: 'FitTracker', weights: numpy.ndarray) -> fitting.Fit:
+        # weights as histogram.hue_weights divided by the pixel count
+        if self.weights is None:
+            self.weights = numpy.array (weights, dtype = numpy.float64)
+        else:
+            self.weights += self.__alpha * (weights - self.weights)
+
+        if self.fit is None:
+            self.fit = self.__full_fit ()
+            return self.fit
+
+        fit = fitting.track_fit (self.weights, self.fit, self.max_step)
+        self.__since_refit += 1
+
+        # a cut or a fast pan can leave the tracked rotation behind, a full fit
+        # that is clearly better replaces it even though the template jumps
+        if self.__since_refit >= self.refit_interval:
+            self.__since_refit = 0
+            best = self.__full_fit ()
+            if best.cost < fit.cost * (1 - SWITCH_MARGIN) - fitting.COST_TOLERANCE:
+                fit = best
+
+        self.fit = fit
+        return fit
+
+class FrameDirectoryWriter:
+    # every frame is written as soon as it is harmonized; frames of a
+    # directory keep their name, and their file type unless an extension
+    # is given
+    def __init__ (self: 'FrameDirectoryWriter', directory: str, extension: str = None) -> None:
+        os.makedirs (directory, exist_ok = True)
+        self.directory = directory
+        self.extension = extension
+        self.__names = set () # type: Set[str]
+        self.__lock = threading.Lock ()
+
+    def write (self: 'FrameDirectoryWriter', frame: Frame, result: numpy.ndarray) -> None:
+        if frame.name is None:
+            name = "frame-{:05d}{}".format (frame.index, self.extension or ".png")
+        elif self.extension is not None:
+            name = os.path.splitext (frame.name)[0] + self.extension
+        else:
+            name = frame.name
+
+        with self.__lock:
+            # frame.jpg and frame.png written as .png would overwrite each other
+            if name in self.__names:
+                raise ValueError ("two frames would both be written to {}".format (name))
+            self.__names.add (name)
+
+        Image.fromarray (result).save (os.path.join (self.directory, name))
+
+    def close (self: 'FrameDirectoryWriter') -> None:
+        pass
+
+class AnimationWriter:
+    # Pillow encodes an animation as a whole, so the frames are kept until
+    # close; frame directories do not hold any frames back
+    def __init__ (self: 'AnimationWriter', path: str, loop: int = 0) -> None:
+        self.path = path
+        self.loop = loop
+        self.__frames = {} # type: Dict[int, Tuple[Image.Image, float]]
+        self.__lock = threading.Lock ()
+
+    def write (self: 'AnimationWriter', frame: Frame, result: numpy.ndarray) -> None:
+        with self.__lock:
+            self.__frames[frame.index] = (Image.fromarray (result), frame.duration)
+
+    def close (self: 'AnimationWriter') -> None:
+        frames = [self.__frames[index] for index in sorted (self.__frames)]
+        self.__frames.clear ()
+
+        if not frames:
+            return
+
+        images = [image for image, _ in frames]
+        images[0].save (self.path, save_all = True, append_images = images[1:],
+                        duration = [duration for _, duration in frames], loop = self.loop)
+
+def is_animation (output: str) -> bool:
+    return os.path.splitext (output)[1].lower () in ANIMATION_EXTENSIONS
+
+def open_writer (output: str, loop: int = 0, extension: str = None) -> Any:
+    if is_animation (output):
+        return AnimationWriter (output, loop)
+
+    return FrameDirectoryWriter (output, extension)
+
+class _Transform:
+    # the hue table, or the planes of a 3D lut, of one fit
+    def __init__ (self: '_Transform', fit: fitting.Fit, lut_size: int) -> None:
+        sectors = templates.TEMPLATES[fit.template]
+        self.fit = fit
+        self.widths = templates.sector_widths (sectors)
+        self.centers = templates.sector_centers (sectors, fit.rotation)
+        self.table = harmonization.hue_table (self.widths, self.centers)
+        self.lut = None # type: numpy.ndarray
+        self.lut_planes = None # type: numpy.ndarray
+
+        if lut_size > 0:
+            self.lut = lut3d.sample (self.widths, self.centers, lut_size)
+            self.lut_planes = lut3d.planes (self.lut)
+
+    def apply (self: '_Transform', pixels: numpy.ndarray, out: numpy.ndarray) -> None:
+        if self.lut_planes is not None:
+            lut3d.apply (pixels, self.lut, out, self.lut_planes)
+        else:
+            harmonization.harmonize (pixels, self.widths, self.centers, None, out, self.table)
+
+def frame_weights (image: Image.Image, analysis_size: int = ANALYSIS_SIZE) -> numpy.ndarray:
+    preview = image
+    factor = max (1, max (image.size) // analysis_size)
+    if factor > 1:
+        preview = image.reduce (factor)
+
+    return histogram.hue_weights (preview, workers = 1) / (preview.size[0] * preview.size[1])
+
+def _harmonize_frame (frame: Frame, transform: _Transform, rows: int, writer: Any) -> None:
+    with tracing.span ("frame", index = frame.index):
+        pixels = numpy.asarray (frame.image)
+        result = numpy.empty_like (pixels)
+
+        for top in range (0, pixels.shape[0], rows):
+            transform.apply (pixels[top:top + rows], result[top:top + rows])
+
+        writer.write (frame, result)
+
+def harmonize_frames (frames: Iterable[Frame], writer: Any, template: str = "auto",
+                      window: int = DEFAULT_WINDOW, max_step: float = MAX_ROTATION_STEP,
+                      analysis_size: int = ANALYSIS_SIZE, lut_size: int = 0,
+                      workers: int = None,
+                      memory_limit: int = tiling.DEFAULT_MEMORY_LIMIT,
+                      progress: Callable[[Frame, fitting.Fit], None] = None) -> int:
+    # Frames are decoded ahead, analysed in order on this thread and
+    # harmonized by a pool of workers, which hand them to the writer as they
+    # finish. Returns the number of frames.
+    workers = workers or os.cpu_count () or 1
+    tracker = FitTracker (template, window, max_step)
+    transform = None # type: _Transform
+    pending = collections.deque () # type: Deque[Tuple[Frame, fitting.Fit, Future]]
+    count = 0
+
+    def finish () -> None:
+        frame, fit, future = pending.popleft ()
+        future.result ()
+        if progress is not None:
+            progress (frame, fit)
+
+    with ThreadPoolExecutor (workers) as pool:
+        try:
+            for frame in prefetch (frames):
+                with tracing.span ("frame analysis", index = frame.index):
+                    fit = tracker.update (frame_weights (frame.image, analysis_size))
+
+                    # a rotation that did not move keeps its table or lut
+                    if transform is None or transform.fit[:2] != fit[:2]:
+                        transform = _Transform (fit, lut_size)
+
+                rows = tiling.rows_per_strip (frame.image.size[0], memory_limit // workers)
+                pending.append ((frame, fit, pool.submit (
+                    _harmonize_frame, frame, transform, rows, writer
+                )))
+                count += 1
+
+                while len (pending) > workers or (pending and pending[0][2].done ()):
+                    finish ()
+
+            while pending:
+                finish ()
+        finally:
+            for _, _, future in pending:
+                future.cancel ()
+
+    return count
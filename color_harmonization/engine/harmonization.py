@@ -0,0 +1,156 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import numpy
+
+from typing import Any, Tuple
+from color_harmonization import tracing
+
+# A numpy port of gui/glsl/fragment_shader.fsh. Every function mirrors the
+# shader function of the same name and computes in float32 like the GPU, so
+# the result matches the GL output up to rounding of the 8 bit framebuffer.
+# The hue pull (gauss, shift_hue) is evaluated once per table entry on the
+# CPU, both harmonize and the shader choose the sector of a pixel and look
+# the new hue up in the row of that sector.
+
+PI = numpy.float32 (3.14159265359)
+
+# For fixed sectors the pulled hue only depends on the old hue, so harmonize
+# and the shader look it up in a table instead of evaluating gauss per pixel.
+HUE_TABLE_SIZE = 4096
+
+def gauss (x: numpy.ndarray, s: numpy.ndarray) -> numpy.ndarray:
+    tmp = numpy.float32 (-0.5) * x / s
+    return 1 / (numpy.sqrt (2 * PI) * s) * numpy.exp (tmp * tmp)
+
+def rgb_to_hsv (rgb: numpy.ndarray) -> numpy.ndarray:
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    max_value = numpy.maximum (r, numpy.maximum (g, b))
+    min_value = numpy.minimum (r, numpy.minimum (g, b))
+    dif = max_value - min_value
+    add = max_value + min_value
+
+    out = numpy.empty_like (rgb[..., :3])
+    out[..., 0] = numpy.select (
+        [min_value == max_value, r == max_value, g == max_value],
+        [0.0,
+         numpy.mod ((60 * (g - b) / dif) + 360, 360),
+         (60 * (b - r) / dif) + 120],
+        (60 * (r - g) / dif) + 240
+    ) / 360
+    out[..., 2] = 0.5 * add
+    out[..., 1] = numpy.select (
+        [out[..., 2] == 0, out[..., 2] <= 0.5],
+        [0.0, dif / add],
+        dif / (2 - add)
+    )
+    return out
+
+def hue_to_rgb (p: numpy.ndarray, q: numpy.ndarray, h: numpy.ndarray) -> numpy.ndarray:
+    h = numpy.where (h < 0, h + 1, numpy.where (h > 1, h - 1, h))
+    return numpy.select (
+        [h * 6 < 1, h * 2 < 1, h * 3 < 2],
+        [p + (q - p) * h * 6, q, p + (q - p) * (numpy.float32 (2 / 3) - h) * 6],
+        p
+    )
+
+def hsv_to_rgb (hsv: numpy.ndarray) -> numpy.ndarray:
+    h, s, l = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    q = numpy.where (l <= 0.5, l * (1 + s), l + s - (l * s))
+    p = 2 * l - q
+
+    out = numpy.empty_like (hsv[..., :3])
+    out[..., 0] = hue_to_rgb (p, q, h + numpy.float32 (1 / 3))
+    out[..., 1] = hue_to_rgb (p, q, h)
+    out[..., 2] = hue_to_rgb (p, q, h - numpy.float32 (1 / 3))
+    return out
+
+def shift_hue (hue: numpy.ndarray, width: numpy.ndarray, center: numpy.ndarray) -> numpy.ndarray:
+    w_over_2 = width / 2
+    return center + w_over_2 * (1 - gauss (numpy.abs (hue - center), w_over_2))
+
+def nearest_sector (hue: numpy.ndarray, widths: numpy.ndarray,
+                    centers: numpy.ndarray) -> numpy.ndarray:
+    arc = numpy.abs ((hue[..., numpy.newaxis] - centers + 0.5) % 1.0 - 0.5)
+    return numpy.argmin (arc - widths / 2, axis = -1).astype (numpy.uint8)
+
+def sector_arrays (widths: numpy.ndarray,
+                   centers: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    return (numpy.asarray (widths, dtype = numpy.float32),
+            numpy.asarray (centers, dtype = numpy.float32))
+
+def hue_table (widths: numpy.ndarray, centers: numpy.ndarray,
+               size: int = HUE_TABLE_SIZE) -> numpy.ndarray:
+    # (sectors, size, 2): entry j of row i holds the hue j / (size - 1)
+    # pulled into sector i and the slope to the next entry. Far from narrow
+    # sectors the pull overflows to inf like in shift_hue; bins touching such
+    # an entry keep their first entry instead of interpolating.
+    widths, centers = sector_arrays (widths, centers)
+    hue = numpy.linspace (0, 1, size, dtype = numpy.float32)
+
+    with numpy.errstate (all = 'ignore'):
+        pulled = shift_hue (hue, widths[:, numpy.newaxis], centers[:, numpy.newaxis])
+        slope = numpy.diff (pulled, append = pulled[:, -1:])
+
+    slope[~numpy.isfinite (slope)] = 0
+    return numpy.stack ((pulled, slope), axis = -1)
+
+def lookup_hue (hue: numpy.ndarray, table: numpy.ndarray, sector: Any) -> numpy.ndarray:
+    # linear interpolation within the row of the sector as a single gather of
+    # (value, slope) pairs; rows are never blended, so hues next to the
+    # border between two sectors keep the pull of their own sector
+    size = table.shape[1]
+    position = hue * numpy.float32 (size - 1)
+    idx = numpy.clip (position, 0, size - 1).astype (numpy.intp)
+    entry = table[sector, idx]
+    return entry[..., 0] + (position - idx) * entry[..., 1]
+
+def transform (color: numpy.ndarray, widths: numpy.ndarray, centers: numpy.ndarray,
+               table: numpy.ndarray = None, sector_index: numpy.ndarray = None) -> numpy.ndarray:
+    # float RGB in [0, 1] to harmonized float RGB in [0, 1]; without a sector
+    # index every pixel takes its nearest sector
+    if table is None:
+        table = hue_table (widths, centers)
+
+    with numpy.errstate (all = 'ignore'):
+        with tracing.span ("hsv conversion"):
+            hsv = rgb_to_hsv (color)
+
+        if sector_index is None:
+            sector_index = nearest_sector (hsv[..., 0], *sector_arrays (widths, centers))
+
+        hsv[..., 0] = lookup_hue (hsv[..., 0], table, sector_index)
+        return numpy.clip (numpy.nan_to_num (hsv_to_rgb (hsv)), 0, 1)
+
+@tracing.traced ("harmonization")
+def harmonize (pixels: numpy.ndarray, widths: numpy.ndarray, centers: numpy.ndarray,
+               sector_index: numpy.ndarray = None, out: numpy.ndarray = None,
+               table: numpy.ndarray = None) -> numpy.ndarray:
+    # callers harmonizing many strips with the same sectors pass the table
+    color = transform (pixels[..., :3].astype (numpy.float32) / 255, widths, centers, table,
+                       None if sector_index is None else sector_index.astype (numpy.intp))
+
+    if out is None:
+        out = numpy.empty_like (pixels, dtype = numpy.uint8)
+
+    out[..., :3] = numpy.rint (color * 255)
+
+    if pixels.shape[-1] > 3:
+        out[..., 3:] = pixels[..., 3:]
+
+    return out
@@ -0,0 +1,96 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import functools
+import numpy
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from typing import Tuple
+from color_harmonization import tracing
+
+BINS = 256
+SCALE = 2**14
+LOG_SCALE = numpy.log2 (BINS * SCALE)
+
+# Images with more pixels than this are split into strips of CHUNK_ROWS rows
+# which are converted and counted in parallel. Pillow releases the GIL while
+# converting to HSV, so a thread pool is enough to use all cores.
+PARALLEL_THRESHOLD = 4 * 1024 * 1024
+CHUNK_ROWS = 256
+
+@functools.lru_cache (maxsize = None)
+def hue_lookup_table () -> numpy.ndarray:
+    # Pillow's hue of a color only depends on which channel is the largest,
+    # which one is the smallest, the spread between them and the distance of
+    # the middle channel to the largest. The table holds Pillow's hue for all
+    # of these, so that a shader can reproduce the CPU histogram bin by bin.
+    # Row (case * BINS + spread) and column (largest - middle) hold the hue,
+    # case is 2 * largest channel + 1 if the smallest one is the later of the
+    # other two channels.
+    spread = numpy.arange (BINS)[:, None]
+    middle = numpy.clip (spread - numpy.arange (BINS)[None, :], 0, None)
+    table = numpy.zeros ((6, BINS, BINS), dtype = numpy.uint8)
+
+    for largest in range (3):
+        others = [channel for channel in range (3) if channel != largest]
+
+        for later_is_smallest in range (2):
+            color = numpy.zeros ((BINS, BINS, 3), dtype = numpy.uint8)
+            color[..., largest] = spread
+            color[..., others[1 - later_is_smallest]] = middle
+            hsv = numpy.asarray (Image.fromarray (color, "RGB").convert ("HSV"))
+            table[2 * largest + later_is_smallest] = hsv[..., 0]
+
+    return table.reshape (6 * BINS, BINS)
+
+def weighted_hue_histogram (hsv: numpy.ndarray) -> numpy.ndarray:
+    return numpy.bincount (
+        hsv[..., 0].ravel (), weights = hsv[..., 1].ravel (), minlength = BINS
+    )
+
+def log_scale (weights: numpy.ndarray, pixel_count: int) -> numpy.ndarray:
+    return numpy.log2 (weights / pixel_count * SCALE + 1) / LOG_SCALE
+
+def _hsv (image: Image.Image) -> numpy.ndarray:
+    with tracing.span ("hsv conversion"):
+        return numpy.asarray (image.convert ("HSV"))
+
+def _strip_weights (image: Image.Image, box: Tuple[int, int, int, int]) -> numpy.ndarray:
+    return weighted_hue_histogram (_hsv (image.crop (box)))
+
+@tracing.traced ("histogram")
+def hue_weights (image: Image.Image, workers: int = None) -> numpy.ndarray:
+    width, height = image.size
+
+    if width * height < PARALLEL_THRESHOLD or workers == 1:
+        return weighted_hue_histogram (_hsv (image))
+
+    image.load ()
+    boxes = [
+        (0, y, width, min (y + CHUNK_ROWS, height)) for y in range (0, height, CHUNK_ROWS)
+    ]
+
+    with ThreadPoolExecutor (workers) as pool:
+        return sum (pool.map (lambda box: _strip_weights (image, box), boxes))
+
+def compute_histogram (image: Image.Image, workers: int = None) -> numpy.ndarray:
+    return log_scale (hue_weights (image, workers), image.size[0] * image.size[1])
+
+def linear_scale (hist: numpy.ndarray) -> numpy.ndarray:
+    return (numpy.exp2 (numpy.asarray (hist) * LOG_SCALE) - 1) / SCALE
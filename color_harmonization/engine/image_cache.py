@@ -0,0 +1,255 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import collections
+import os
+import threading
+import numpy
+
+from concurrent.futures import Future
+from PIL import Image
+from typing import Callable, Dict, List, Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import analysis_cache, histogram, superpixels, tiling
+
+DEFAULT_BYTE_BUDGET = 256 * 1024 * 1024
+MAX_LEVEL_SIZE = 2048
+MIN_LEVEL_SIZE = 64
+
+def file_key (path: str) -> Tuple[str, int, int]:
+    # a file edited on disk gets a new key, like in the analysis cache
+    stat = os.stat (path)
+    return os.path.abspath (path), stat.st_mtime_ns, stat.st_size
+
+class ImagePyramid:
+    def __init__ (self: 'ImagePyramid', base: Image.Image) -> None:
+        self.levels = [base] # type: List[Image.Image]
+        while max (self.levels[-1].size) >= 2 * MIN_LEVEL_SIZE:
+            self.levels.append (self.levels[-1].reduce (2))
+
+        self.__views = {} # type: Dict[int, Image.Image]
+        self.__histograms = {} # type: Dict[int, numpy.ndarray]
+        self.__superpixels = {} # type: Dict[int, superpixels.SuperpixelGraph]
+        self.__lock = threading.Lock ()
+        self.nbytes = sum (ImagePyramid.image_bytes (level) for level in self.levels)
+        # called without the lock whenever views or superpixels grow nbytes
+        self.on_resize = None # type: Callable[[], None]
+
+    @staticmethod
+    def image_bytes (image: Image.Image) -> int:
+        return image.size[0] * image.size[1] * len (image.getbands ())
+
+    def __resized (self: 'ImagePyramid') -> None:
+        if self.on_resize is not None:
+            self.on_resize ()
+
+    def view (self: 'ImagePyramid', size: int) -> Image.Image:
+        with self.__lock:
+            if size in self.__views:
+                return self.__views[size]
+
+            # the smallest level that is still at least as large as the view
+            level = self.levels[0]
+            for candidate in self.levels:
+                if max (candidate.size) >= size:
+                    level = candidate
+
+            view = level
+            if max (level.size) > size:
+                with tracing.span ("thumbnail", size = size):
+                    view = level.copy ()
+                    view.thumbnail ((size, size))
+                self.nbytes += ImagePyramid.image_bytes (view)
+
+            self.__views[size] = view
+
+        if view is not level:
+            self.__resized ()
+        return view
+
+    def histogram (self: 'ImagePyramid', size: int) -> numpy.ndarray:
+        view = self.view (size)
+
+        with self.__lock:
+            if size not in self.__histograms:
+                self.__histograms[size] = histogram.compute_histogram (view)
+            return self.__histograms[size]
+
+    def superpixels (self: 'ImagePyramid', size: int) -> superpixels.SuperpixelGraph:
+        view = self.view (size)
+
+        with self.__lock:
+            if size in self.__superpixels:
+                return self.__superpixels[size]
+
+        # segmenting takes a while, views are not blocked meanwhile
+        graph = superpixels.SuperpixelGraph (view)
+
+        with self.__lock:
+            if size in self.__superpixels:
+                return self.__superpixels[size]
+
+            self.__superpixels[size] = graph
+            self.nbytes += graph.nbytes
+
+        self.__resized ()
+        return graph
+
+class ImageCache:
+    def __init__ (self: 'ImageCache', byte_budget: int = DEFAULT_BYTE_BUDGET,
+                  max_size: int = MAX_LEVEL_SIZE) -> None:
+        self.max_size = max_size
+        self.__byte_budget = byte_budget
+        self.__entries = collections.OrderedDict () # type: collections.OrderedDict
+        self.__loading = {} # type: Dict[Tuple[str, int, int], Future]
+        self.__lock = threading.Lock ()
+
+    @property
+    def byte_budget (self: 'ImageCache') -> int:
+        return self.__byte_budget
+
+    @byte_budget.setter
+    def byte_budget (self: 'ImageCache', value: int) -> None:
+        with self.__lock:
+            self.__byte_budget = value
+            self.__evict ()
+
+    @property
+    def nbytes (self: 'ImageCache') -> int:
+        with self.__lock:
+            return sum (pyramid.nbytes for pyramid in self.__entries.values ())
+
+    def __evict (self: 'ImageCache') -> None:
+        total = sum (pyramid.nbytes for pyramid in self.__entries.values ())
+
+        # the most recently used pyramid stays, even if it alone exceeds the budget
+        while total > self.__byte_budget and len (self.__entries) > 1:
+            _, pyramid = self.__entries.popitem (last = False)
+            total -= pyramid.nbytes
+
+    def __rebalance (self: 'ImageCache') -> None:
+        with self.__lock:
+            self.__evict ()
+
+    def __decode (self: 'ImageCache', path: str) -> ImagePyramid:
+        with tracing.span ("decode", path = path), Image.open (path) as f:
+            f.thumbnail ((self.max_size, self.max_size))
+            pyramid = ImagePyramid (f.convert ("RGBA" if tiling.has_alpha (f) else "RGB"))
+
+        pyramid.on_resize = self.__rebalance
+        return pyramid
+
+    def __drop (self: 'ImageCache', path: str) -> None:
+        for key in [key for key in self.__entries if key[0] == path]:
+            del self.__entries[key]
+
+    def pyramid (self: 'ImageCache', path: str) -> ImagePyramid:
+        key = file_key (path)
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end (key)
+                return self.__entries[key]
+
+            # concurrent requests for the same file wait for a single decode
+            future = self.__loading.get (key)
+            owner = future is None
+            if owner:
+                future = self.__loading[key] = Future ()
+
+        if not owner:
+            return future.result ()
+
+        try:
+            pyramid = self.__decode (path)
+        except BaseException as e:
+            with self.__lock:
+                del self.__loading[key]
+            future.set_exception (e)
+            raise
+
+        with self.__lock:
+            del self.__loading[key]
+            # an earlier version of the file is never asked for again
+            self.__drop (key[0])
+            self.__entries[key] = pyramid
+            self.__evict ()
+        future.set_result (pyramid)
+        return pyramid
+
+    def cached (self: 'ImageCache', path: str) -> ImagePyramid:
+        try:
+            key = file_key (path)
+        except OSError:
+            return None
+
+        with self.__lock:
+            return self.__entries.get (key)
+
+    def get (self: 'ImageCache', path: str, size: int) -> Image.Image:
+        return self.pyramid (path).view (size)
+
+    def histogram (self: 'ImageCache', path: str, size: int) -> numpy.ndarray:
+        # images analysed in an earlier session are not analysed again
+        hist = stored_histogram (path, size)
+
+        if hist is None:
+            hist = self.pyramid (path).histogram (size)
+            store_histogram (path, size, hist)
+
+        return hist
+
+    def superpixels (self: 'ImageCache', path: str, size: int) -> superpixels.SuperpixelGraph:
+        return self.pyramid (path).superpixels (size)
+
+    def invalidate (self: 'ImageCache', path: str) -> None:
+        with self.__lock:
+            self.__drop (os.path.abspath (path))
+
+    def clear (self: 'ImageCache') -> None:
+        with self.__lock:
+            self.__entries.clear ()
+
+def stored_histogram (path: str, size: int) -> numpy.ndarray:
+    # None unless the persistent analysis cache knows the file
+    if analysis_cache.default_cache is None:
+        return None
+
+    key = analysis_cache.kind (analysis_cache.HISTOGRAM, size)
+    return analysis_cache.default_cache.get (path, key)
+
+def store_histogram (path: str, size: int, hist: numpy.ndarray) -> None:
+    if analysis_cache.default_cache is not None:
+        analysis_cache.default_cache.put (
+            path, {analysis_cache.kind (analysis_cache.HISTOGRAM, size): hist}
+        )
+
+default_cache = ImageCache (tiling.parse_size (
+    os.environ.get ("COLOR_HARMONIZATION_CACHE_BUDGET", str (DEFAULT_BYTE_BUDGET))
+))
+
+def load_thumbnail (path: str, size: int, cache: ImageCache = default_cache) -> Image.Image:
+    # small previews are cut from an already decoded pyramid, otherwise they
+    # are decoded on their own at reduced scale without filling the cache
+    pyramid = cache.cached (path)
+    if pyramid is not None:
+        return pyramid.view (size)
+
+    with tracing.span ("thumbnail", path = path, size = size), Image.open (path) as f:
+        f.thumbnail ((size, size))
+        return f.convert ("RGBA" if tiling.has_alpha (f) else "RGB")
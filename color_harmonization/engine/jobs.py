@@ -0,0 +1,222 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import os
+import threading
+import numpy
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from PIL import Image
+from typing import Any, Callable, Dict, List, Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import analysis_cache, fitting, harmonization, image_cache, \
+    sector_assignment, templates, tiling
+
+ANALYSIS_SIZE = analysis_cache.ANALYSIS_SIZE
+
+# share of the progress bar spent on analysing and fitting, the rest follows
+# the rows that are harmonized
+ANALYSIS_SHARE = 0.05
+
+class JobCancelled (Exception):
+    pass
+
+def buffer_mode (mode: str) -> str:
+    # results always have four channels, which Pillow can wrap without a copy
+    return "RGBA" if mode == "RGBA" else "RGBX"
+
+def _harmonize_strip (strip: numpy.ndarray, widths: numpy.ndarray, centers: numpy.ndarray,
+                      table: numpy.ndarray, out: numpy.ndarray,
+                      sector_index: numpy.ndarray = None) -> None:
+    harmonization.harmonize (strip, widths, centers, sector_index, out, table)
+
+    if strip.shape[-1] == 3:
+        out[..., 3] = 255
+
+def graph_cut_map (path: str, widths: numpy.ndarray, centers: numpy.ndarray,
+                   check: Callable[[], None]) -> numpy.ndarray:
+    # the sector map of the graph cut on the superpixels of a preview; the
+    # preview of the assistant and the job share it through the analysis cache
+    persistent = analysis_cache.default_cache
+    key = analysis_cache.sector_map_kind (ANALYSIS_SIZE, widths, centers)
+    sector_map = persistent.get (path, key) if persistent is not None else None
+
+    if sector_map is None:
+        graph = image_cache.default_cache.superpixels (path, ANALYSIS_SIZE)
+        check ()
+        sector_map = sector_assignment.sector_map (
+            graph, sector_assignment.graph_cut (graph, widths, centers)
+        )
+        if persistent is not None:
+            persistent.put (path, {key: sector_map})
+
+    return sector_map
+
+class HarmonizationJob:
+    def __init__ (self: 'HarmonizationJob', path: str, template: str = "auto",
+                  hue_rotation: float = None,
+                  sector_chooser: str = sector_assignment.NEAREST,
+                  progress: Callable[['HarmonizationJob', float], None] = None,
+                  done: Callable[['HarmonizationJob'], None] = None,
+                  memory_limit: int = tiling.DEFAULT_MEMORY_LIMIT,
+                  workers: int = None) -> None:
+        self.path = path
+        self.template = template
+        self.hue_rotation = hue_rotation
+        self.sector_chooser = sector_chooser
+        self.memory_limit = memory_limit
+        self.workers = workers or os.cpu_count () or 1
+        self.fit = None # type: fitting.Fit
+        # (height, width, 4) uint8, the fourth channel is padding for RGB sources
+        self.result = None # type: numpy.ndarray
+        self.mode = None # type: str
+        self.info = {} # type: Dict[str, Any]
+        self.error = None # type: Exception
+        self.__progress = progress
+        self.__done = done
+        self.__cancelled = threading.Event ()
+        self.__reported = -1.0
+
+    @property
+    def cancelled (self: 'HarmonizationJob') -> bool:
+        return self.__cancelled.is_set ()
+
+    def cancel (self: 'HarmonizationJob') -> None:
+        self.__cancelled.set ()
+
+    def __check (self: 'HarmonizationJob') -> None:
+        if self.__cancelled.is_set ():
+            raise JobCancelled ()
+
+    def __report (self: 'HarmonizationJob', fraction: float) -> None:
+        # only whole percents are passed on, so the GUI is not flooded
+        if self.__progress is not None and (fraction - self.__reported >= 0.01 or fraction >= 1):
+            self.__reported = fraction
+            self.__progress (self, fraction)
+
+    def __analyse (self: 'HarmonizationJob', reader: tiling.StripReader) -> fitting.Fit:
+        if self.template != "auto" and self.hue_rotation is not None:
+            return fitting.Fit (self.template, self.hue_rotation, float ("nan"))
+
+        fits = analysis_cache.preview_fits (
+            self.path, ANALYSIS_SIZE, lambda: reader.preview (ANALYSIS_SIZE, self.memory_limit),
+            analysis_cache.default_cache
+        )
+        return analysis_cache.choose_fit (fits, self.template)
+
+    def __sector_map (self: 'HarmonizationJob', widths: numpy.ndarray,
+                      centers: numpy.ndarray) -> numpy.ndarray:
+        # the graph cut runs on the superpixels of a preview, its map is
+        # scaled up to the strips; without it every pixel takes its nearest sector
+        if self.sector_chooser != sector_assignment.GRAPH_CUT or len (widths) != 2:
+            return None
+
+        return graph_cut_map (self.path, widths, centers, self.__check)
+
+    def __harmonize (self: 'HarmonizationJob', reader: tiling.StripReader) -> None:
+        width, height = reader.size
+        sectors = templates.TEMPLATES[self.fit.template]
+        widths = templates.sector_widths (sectors)
+        centers = templates.sector_centers (sectors, self.fit.rotation)
+        sector_map = self.__sector_map (widths, centers)
+        table = harmonization.hue_table (widths, centers)
+
+        # every worker holds one strip, so the strips share the memory limit
+        rows = tiling.rows_per_strip (width, self.memory_limit // self.workers)
+        self.result = numpy.empty ((height, width, 4), dtype = numpy.uint8)
+        pending = [] # type: List[Tuple[int, Future]]
+        finished = 0
+
+        with ThreadPoolExecutor (self.workers) as pool:
+            try:
+                for top, strip in reader.strips (rows):
+                    self.__check ()
+                    out = self.result[top:top + strip.shape[0]]
+                    index = None
+                    if sector_map is not None:
+                        index = sector_assignment.scale_rows (
+                            sector_map, reader.size, top, top + strip.shape[0]
+                        )
+                    pending.append ((strip.shape[0], pool.submit (
+                        _harmonize_strip, strip, widths, centers, table, out, index
+                    )))
+
+                    while len (pending) >= self.workers or (pending and pending[0][1].done ()):
+                        count, future = pending.pop (0)
+                        future.result ()
+                        finished += count
+                        self.__report (ANALYSIS_SHARE + (1 - ANALYSIS_SHARE) * finished / height)
+
+                for count, future in pending:
+                    self.__check ()
+                    future.result ()
+                    finished += count
+                    self.__report (ANALYSIS_SHARE + (1 - ANALYSIS_SHARE) * finished / height)
+            finally:
+                for _, future in pending:
+                    future.cancel ()
+
+    def run (self: 'HarmonizationJob') -> None:
+        try:
+            with tiling.StripReader (self.path) as reader:
+                self.mode = reader.mode
+                self.info = reader.info
+                self.__report (0.0)
+                with tracing.span ("analysis", path = self.path):
+                    self.fit = self.__analyse (reader)
+                self.__check ()
+                self.__report (ANALYSIS_SHARE)
+                with tracing.span ("harmonization job", path = self.path):
+                    self.__harmonize (reader)
+        except JobCancelled:
+            self.result = None
+        except Exception as e:
+            self.result = None
+            self.error = e
+
+        if self.__done is not None:
+            self.__done (self)
+
+    def image (self: 'HarmonizationJob') -> Image.Image:
+        height, width = self.result.shape[:2]
+        mode = buffer_mode (self.mode)
+        return Image.frombuffer (mode, (width, height), self.result, "raw", mode, 0, 1)
+
+class JobScheduler:
+    def __init__ (self: 'JobScheduler') -> None:
+        self.__job = None # type: HarmonizationJob
+        self.__lock = threading.Lock ()
+
+    @property
+    def current (self: 'JobScheduler') -> HarmonizationJob:
+        return self.__job
+
+    def run (self: 'JobScheduler', job: HarmonizationJob) -> None:
+        # a new job replaces the running one, which stops at its next strip
+        with self.__lock:
+            if self.__job is not None:
+                self.__job.cancel ()
+            self.__job = job
+
+        threading.Thread (target = job.run, daemon = True).start ()
+
+    def cancel (self: 'JobScheduler') -> None:
+        with self.__lock:
+            if self.__job is not None:
+                self.__job.cancel ()
+            self.__job = None
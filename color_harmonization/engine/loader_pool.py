@@ -0,0 +1,180 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from typing import Any, Callable, Dict, List
+
+VISIBLE = 0
+HIDDEN = 1
+PREFETCH = 2
+
+DEFAULT_WORKERS = 2
+# graph cuts take seconds, they get workers of their own so that image loads
+# never queue behind them
+ANALYSIS_WORKERS = 1
+WAIT_SAMPLES = 100
+
+class LoadCancelled (Exception):
+    pass
+
+class LoaderPool:
+    def __init__ (self: 'LoaderPool', workers: int = DEFAULT_WORKERS) -> None:
+        self.__workers = workers
+        self.__threads = [] # type: List[threading.Thread]
+        self.__queue = [] # type: List[tuple]
+        self.__sequence = itertools.count ()
+        # owners with outstanding requests only, an owner is forgotten once
+        # its last request was delivered or dropped
+        self.__generations = {} # type: Dict[Any, int]
+        self.__outstanding = {} # type: Dict[Any, int]
+        # owner -> [lock, deliveries waiting for it], results of one owner
+        # are delivered one at a time
+        self.__deliveries = {} # type: Dict[Any, list]
+        self.__lock = threading.Lock ()
+        self.__available = threading.Condition (self.__lock)
+        self.__waits = collections.deque (maxlen = WAIT_SAMPLES) # type: collections.deque
+        self.__running = 0
+        self.__completed = 0
+        self.__superseded = 0
+
+    def submit (self: 'LoaderPool', owner: Any, function: Callable[[Callable[[], bool]], Any],
+                callback: Callable[[Any], None], priority: int = HIDDEN) -> int:
+        # A request supersedes every older request of the same owner: queued
+        # ones are dropped, running ones can poll is_cancelled and their
+        # results are never delivered.
+        with self.__lock:
+            token = self.__generations.get (owner, 0) + 1
+            self.__generations[owner] = token
+            self.__outstanding[owner] = self.__outstanding.get (owner, 0) + 1
+            heapq.heappush (self.__queue, (priority, next (self.__sequence), time.monotonic (),
+                                           owner, token, function, callback))
+
+            if len (self.__threads) < self.__workers:
+                thread = threading.Thread (target = self.__work, daemon = True)
+                self.__threads.append (thread)
+                thread.start ()
+
+            self.__available.notify ()
+
+        return token
+
+    def cancel (self: 'LoaderPool', owner: Any) -> None:
+        with self.__lock:
+            if owner in self.__generations:
+                self.__generations[owner] += 1
+
+    def is_current (self: 'LoaderPool', owner: Any, token: int) -> bool:
+        with self.__lock:
+            return self.__generations.get (owner) == token
+
+    def __release (self: 'LoaderPool', owner: Any) -> None:
+        # called with the lock held when a request of the owner is done
+        self.__outstanding[owner] -= 1
+        if self.__outstanding[owner] == 0:
+            del self.__outstanding[owner]
+            del self.__generations[owner]
+
+    def __work (self: 'LoaderPool') -> None:
+        while True:
+            with self.__lock:
+                while not self.__queue:
+                    self.__available.wait ()
+
+                _, _, queued, owner, token, function, callback = heapq.heappop (self.__queue)
+
+                if self.__generations.get (owner) != token:
+                    self.__superseded += 1
+                    self.__release (owner)
+                    continue
+
+                self.__waits.append (time.monotonic () - queued)
+                self.__running += 1
+
+            try:
+                result = function (lambda: not self.is_current (owner, token))
+            except LoadCancelled:
+                result = None
+                token = None
+            except Exception as e:
+                print ("Loading failed: {}".format (e))
+                result = None
+                token = None
+
+            with self.__lock:
+                self.__running -= 1
+
+                if token is None or self.__generations.get (owner) != token:
+                    self.__superseded += 1
+                    self.__release (owner)
+                    continue
+
+                delivery = self.__deliveries.setdefault (owner, [threading.Lock (), 0])
+                delivery[1] += 1
+
+            # Callbacks run without the pool lock, they may take locks of
+            # their own that other workers hold while they call is_cancelled.
+            # The token is checked again under the lock of the owner, so no
+            # older result is delivered after a newer one.
+            with delivery[0]:
+                delivered = self.is_current (owner, token)
+                if delivered:
+                    try:
+                        callback (result)
+                    except Exception as e:
+                        print ("Delivering a loaded result failed: {}".format (e))
+
+            with self.__lock:
+                if delivered:
+                    self.__completed += 1
+                else:
+                    self.__superseded += 1
+
+                delivery[1] -= 1
+                if delivery[1] == 0:
+                    del self.__deliveries[owner]
+
+                self.__release (owner)
+
+    def __queued (self: 'LoaderPool') -> int:
+        # superseded requests stay in the heap until a worker pops them
+        return sum (1 for entry in self.__queue if self.__generations.get (entry[3]) == entry[4])
+
+    @property
+    def queue_depth (self: 'LoaderPool') -> int:
+        with self.__lock:
+            return self.__queued ()
+
+    def stats (self: 'LoaderPool') -> Dict[str, float]:
+        with self.__lock:
+            waits = list (self.__waits)
+            return {
+                "queue_depth": self.__queued (),
+                "running": self.__running,
+                "completed": self.__completed,
+                "superseded": self.__superseded,
+                "average_wait": sum (waits) / len (waits) if waits else 0.0,
+                "max_wait": max (waits) if waits else 0.0
+            }
+
+default_pool = LoaderPool ()
+analysis_pool = LoaderPool (ANALYSIS_WORKERS)
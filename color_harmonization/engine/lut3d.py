@@ -0,0 +1,112 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import os
+import numpy
+
+from typing import Tuple
+from color_harmonization import tracing
+from color_harmonization.engine import harmonization, templates
+
+# Grid sizes of the usual .cube files. The hue pull is steep next to narrow
+# sectors and jumps between sectors, 65 follows it more closely than 33.
+SIZES = (17, 33, 65)
+DEFAULT_SIZE = 33
+
+def grid (size: int) -> numpy.ndarray:
+    # (blue, green, red, 3) float RGB, red changes fastest like in .cube files
+    levels = numpy.linspace (0, 1, size, dtype = numpy.float32)
+    b, g, r = numpy.meshgrid (levels, levels, levels, indexing = "ij")
+    return numpy.stack ((r, g, b), axis = -1)
+
+def sample (widths: numpy.ndarray, centers: numpy.ndarray,
+            size: int = DEFAULT_SIZE) -> numpy.ndarray:
+    # every pixel takes its nearest sector; a graph cut sector map depends on
+    # the position of a pixel, which a colour lookup cannot express
+    return harmonization.transform (grid (size), widths, centers)
+
+def sample_template (template: str, rotation: float, size: int = DEFAULT_SIZE) -> numpy.ndarray:
+    sectors = templates.TEMPLATES[template]
+    return sample (templates.sector_widths (sectors),
+                   templates.sector_centers (sectors, rotation), size)
+
+def cube_title (template: str, rotation: float) -> str:
+    return "{} rotated by {:.1f} degrees".format (template, rotation * 360)
+
+def write_cube (path: str, lut: numpy.ndarray, title: str = None) -> None:
+    size = lut.shape[0]
+
+    try:
+        with open (path, "w") as f:
+            if title is not None:
+                f.write ('TITLE "{}"\n'.format (title.replace ('"', "'")))
+            f.write ("LUT_3D_SIZE {}\n".format (size))
+            f.write ("DOMAIN_MIN 0.0 0.0 0.0\n")
+            f.write ("DOMAIN_MAX 1.0 1.0 1.0\n")
+            numpy.savetxt (f, lut.reshape (-1, 3), fmt = "%.6f")
+    except BaseException:
+        if os.path.exists (path):
+            os.remove (path)
+        raise
+
+def _axis (size: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # lower grid index and weight of the upper one for every 8 bit level
+    position = numpy.arange (256, dtype = numpy.float32) * numpy.float32 ((size - 1) / 255)
+    lower = numpy.minimum (position.astype (numpy.intp), size - 2)
+    return lower, (position - lower).astype (numpy.float32)[:, numpy.newaxis]
+
+def planes (lut: numpy.ndarray) -> numpy.ndarray:
+    # (blue, 256 * 256, 3): the grid interpolated along red and green for
+    # every 8 bit level, so apply only interpolates between two blue planes.
+    # It takes size * 768 KiB and is meant to be reused for all strips.
+    size = lut.shape[0]
+    lut = numpy.asarray (lut, dtype = numpy.float32)
+    lower, weight = _axis (size)
+
+    red = lut[:, :, lower] + weight * (lut[:, :, lower + 1] - lut[:, :, lower])
+    weight = weight[:, numpy.newaxis]
+    green = red[:, lower] + weight * (red[:, lower + 1] - red[:, lower])
+    return numpy.ascontiguousarray (green).reshape (size, 256 * 256, 3)
+
+@tracing.traced ("lut apply")
+def apply (pixels: numpy.ndarray, lut: numpy.ndarray, out: numpy.ndarray = None,
+           lut_planes: numpy.ndarray = None) -> numpy.ndarray:
+    # trilinear interpolation of an 8 bit RGB(A) image, the alpha is copied;
+    # callers applying the same lut to many strips pass its planes
+    if lut_planes is None:
+        lut_planes = planes (lut)
+
+    flat = lut_planes.reshape (-1, 3)
+    lower, weight = _axis (lut_planes.shape[0])
+    b = pixels[..., 2]
+    idx = lower[b] * (256 * 256) + (pixels[..., 1].astype (numpy.intp) << 8) + pixels[..., 0]
+
+    low = numpy.take (flat, idx, axis = 0)
+    high = numpy.take (flat, idx + 256 * 256, axis = 0)
+    low += weight[b] * (high - low)
+
+    if out is None:
+        out = numpy.empty_like (pixels, dtype = numpy.uint8)
+
+    out[..., :3] = numpy.rint (numpy.clip (low, 0, 1, out = low) * 255)
+
+    if pixels.shape[-1] > 3:
+        out[..., 3:] = pixels[..., 3:]
+
+    return out
@@ -0,0 +1,167 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import collections
+import numpy
+
+from typing import List
+
+# Capacities below this are treated as saturated, so that float rounding
+# cannot keep an augmenting path alive forever.
+EPSILON = 1e-9
+
+class Graph:
+    # An s-t graph with Dinic's max-flow algorithm. The interface follows the
+    # usual graph-cut libraries: nodes are numbered from 0, add_tedge connects
+    # a node to the source and to the sink, and get_segment tells on which side
+    # of the minimum cut a node ended up (0 source, 1 sink). add_edges and
+    # add_tedges take numpy arrays and add many edges at once.
+    def __init__ (self: 'Graph', nodes: int) -> None:
+        self.nodes = nodes
+        self.source = nodes
+        self.sink = nodes + 1
+        self.__arcs = None # type: List[List[int]]
+        self.__tail = [] # type: List[int]
+        self.__head = [] # type: List[int]
+        self.__capacity = [] # type: List[float]
+        self.__flow_offset = 0.0
+        self.__source_side = None # type: List[bool]
+
+    def __add_arcs (self: 'Graph', u: numpy.ndarray, v: numpy.ndarray,
+                    capacity: numpy.ndarray, reverse_capacity: numpy.ndarray) -> None:
+        # arcs are stored in pairs, arc ^ 1 is the reverse of arc; the arcs
+        # of every node are collected once maxflow starts
+        ends = numpy.stack ((u, v), axis = 1).astype (numpy.intp)
+        capacities = numpy.stack ((capacity, reverse_capacity), axis = 1)
+
+        self.__tail.extend (ends.ravel ().tolist ())
+        self.__head.extend (ends[:, ::-1].ravel ().tolist ())
+        self.__capacity.extend (capacities.astype (numpy.float64).ravel ().tolist ())
+
+    def add_edges (self: 'Graph', u: numpy.ndarray, v: numpy.ndarray,
+                   capacity: numpy.ndarray, reverse_capacity: numpy.ndarray) -> None:
+        self.__add_arcs (numpy.asarray (u), numpy.asarray (v),
+                         numpy.asarray (capacity), numpy.asarray (reverse_capacity))
+
+    def add_edge (self: 'Graph', u: int, v: int, capacity: float,
+                  reverse_capacity: float) -> None:
+        self.add_edges ([u], [v], [capacity], [reverse_capacity])
+
+    def add_tedges (self: 'Graph', nodes: numpy.ndarray, source_capacity: numpy.ndarray,
+                    sink_capacity: numpy.ndarray) -> None:
+        # the common part is cut whichever side a node ends up on, it only
+        # adds to the flow
+        nodes = numpy.asarray (nodes)
+        source_capacity = numpy.asarray (source_capacity, dtype = numpy.float64)
+        sink_capacity = numpy.asarray (sink_capacity, dtype = numpy.float64)
+        common = numpy.minimum (source_capacity, sink_capacity)
+        self.__flow_offset += float (common.sum ())
+
+        source_capacity = source_capacity - common
+        sink_capacity = sink_capacity - common
+        linked = source_capacity > 0
+        self.__add_arcs (numpy.full (linked.sum (), self.source), nodes[linked],
+                         source_capacity[linked], numpy.zeros (linked.sum ()))
+        linked = sink_capacity > 0
+        self.__add_arcs (nodes[linked], numpy.full (linked.sum (), self.sink),
+                         sink_capacity[linked], numpy.zeros (linked.sum ()))
+
+    def add_tedge (self: 'Graph', node: int, source_capacity: float,
+                   sink_capacity: float) -> None:
+        self.add_tedges ([node], [source_capacity], [sink_capacity])
+
+    def __collect_arcs (self: 'Graph') -> None:
+        # the arcs leaving every node in the order they were added
+        tail = numpy.asarray (self.__tail, dtype = numpy.intp)
+        order = numpy.argsort (tail, kind = 'stable')
+        bounds = numpy.cumsum (numpy.bincount (tail, minlength = self.nodes + 2))[:-1]
+        self.__arcs = [arcs.tolist () for arcs in numpy.split (order, bounds)]
+
+    def __levels (self: 'Graph') -> List[int]:
+        level = [-1] * (self.nodes + 2)
+        level[self.source] = 0
+        queue = collections.deque ([self.source])
+
+        while queue:
+            u = queue.popleft ()
+            for arc in self.__arcs[u]:
+                v = self.__head[arc]
+                if level[v] < 0 and self.__capacity[arc] > EPSILON:
+                    level[v] = level[u] + 1
+                    queue.append (v)
+
+        return level
+
+    def __blocking_flow (self: 'Graph', level: List[int]) -> float:
+        head = self.__head
+        capacity = self.__capacity
+        arcs = self.__arcs
+        current = [0] * (self.nodes + 2)
+        total = 0.0
+
+        while True:
+            # depth first search for one augmenting path in the level graph
+            path = [] # type: List[int]
+            u = self.source
+
+            while u != self.sink:
+                while current[u] < len (arcs[u]):
+                    arc = arcs[u][current[u]]
+                    v = head[arc]
+                    if capacity[arc] > EPSILON and level[v] == level[u] + 1:
+                        break
+                    current[u] += 1
+                else:
+                    # dead end, retreat and never enter this node again
+                    if u == self.source:
+                        return total
+                    level[u] = -1
+                    arc = path.pop ()
+                    u = head[arc ^ 1]
+                    current[u] += 1
+                    continue
+
+                path.append (arc)
+                u = v
+
+            flow = min (capacity[arc] for arc in path)
+            for arc in path:
+                capacity[arc] -= flow
+                capacity[arc ^ 1] += flow
+            total += flow
+
+    def maxflow (self: 'Graph') -> float:
+        self.__collect_arcs ()
+        flow = self.__flow_offset
+
+        while True:
+            level = self.__levels ()
+            if level[self.sink] < 0:
+                break
+            flow += self.__blocking_flow (level)
+
+        level = self.__levels ()
+        self.__source_side = [value >= 0 for value in level]
+        return flow
+
+    def get_segment (self: 'Graph', node: int) -> int:
+        return 0 if self.__source_side[node] else 1
+
+    def get_segments (self: 'Graph') -> numpy.ndarray:
+        # get_segment of every node
+        return numpy.where (self.__source_side[:self.nodes], 0, 1).astype (numpy.uint8)
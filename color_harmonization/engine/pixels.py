@@ -0,0 +1,40 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import numpy
+
+from PIL import Image
+
+TEXTURE_MODES = ("RGB", "RGBA")
+
+def texture_data (image: Image.Image) -> numpy.ndarray:
+    # numpy.asarray copies the pixel buffer once through the array interface,
+    # without creating Python objects per pixel.
+    if image.mode not in TEXTURE_MODES:
+        image = image.convert ("RGBA")
+
+    return numpy.ascontiguousarray (numpy.asarray (image), dtype = numpy.uint8)
+
+def unpack_alignment (data: numpy.ndarray) -> int:
+    row_bytes = data.strides[0]
+
+    for alignment in (8, 4, 2):
+        if row_bytes % alignment == 0:
+            return alignment
+
+    return 1
@@ -0,0 +1,69 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import functools
+import numpy
+
+from typing import Tuple
+from color_harmonization import tracing
+
+@functools.lru_cache (maxsize = 8)
+def ring_geometry (size: int) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    center = size / 2
+    dy, dx = numpy.mgrid[0:size, 0:size].astype (numpy.float64)
+    dy = -(dy - center)
+    dx -= center
+
+    dist = dx * dx + dy * dy
+    angle = numpy.arctan2 (dy, dx)
+    angle[angle < 0] += 2 * numpy.pi
+
+    hue_idx = ((angle + 2 * numpy.pi / 3) / (2 * numpy.pi) * 255).astype (numpy.intp) % 256
+
+    # vectorized colorsys.hsv_to_rgb (hue, 1.0, 1.0)
+    hue = angle / (2 * numpy.pi) * 6.0
+    sextant = hue.astype (numpy.intp)
+    f = hue - sextant
+    one = numpy.ones_like (f)
+    zero = numpy.zeros_like (f)
+    q = 1.0 - f
+    sextant %= 6
+    r = numpy.choose (sextant, [one, q, zero, zero, f, one])
+    g = numpy.choose (sextant, [f, one, one, q, zero, zero])
+    b = numpy.choose (sextant, [zero, zero, f, one, one, q])
+    rgb = numpy.floor (numpy.stack ((r, g, b), axis = -1) * 255 + 0.5).astype (numpy.uint8)
+
+    for array in (dist, hue_idx, rgb):
+        array.setflags (write = False)
+
+    return dist, hue_idx, rgb
+
+@tracing.traced ("ring rasterization")
+def rasterize_ring (size: int, outer: float, inner: float,
+                    hist: numpy.ndarray) -> numpy.ndarray:
+    dist, hue_idx, rgb = ring_geometry (size)
+    hist = numpy.asarray (hist, dtype = numpy.float64)
+
+    limit = ((inner - 1) ** 2) * (1 - hist[255 - hue_idx])
+    visible = (dist >= limit) & (dist <= (outer + 1) ** 2)
+
+    buf = numpy.zeros ((size, size, 4), dtype = numpy.uint8)
+    buf[..., :3] = rgb
+    buf[..., 3] = 255
+    buf *= visible[..., numpy.newaxis]
+    return buf
@@ -0,0 +1,84 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import numpy
+
+from typing import Tuple
+from color_harmonization.engine import histogram, maxflow
+from color_harmonization.engine.superpixels import SuperpixelGraph
+
+# Sector assignment of Cohen-Or et al. on a superpixel graph: the data term
+# is the saturation weighted distance of the hues of a superpixel to the
+# border of a sector, the smoothness term between neighbouring superpixels
+# grows with their common border and their saturation and falls with their
+# hue distance, so regions of similar hue end up in the same sector.
+DEFAULT_SMOOTHNESS = 0.01
+MIN_HUE_DISTANCE = 0.01
+
+NEAREST = "nearest"
+GRAPH_CUT = "graph-cut"
+CHOOSERS = [NEAREST, GRAPH_CUT]
+
+def sector_distances (widths: numpy.ndarray, centers: numpy.ndarray) -> numpy.ndarray:
+    # (BINS, sectors) distance of every histogram bin to the border of every sector
+    hue = (numpy.arange (histogram.BINS) + 0.5) / 255
+    arc = numpy.abs ((hue[:, numpy.newaxis] - numpy.asarray (centers) + 0.5) % 1.0 - 0.5)
+    return numpy.maximum (arc - numpy.asarray (widths) / 2, 0.0)
+
+def data_costs (graph: SuperpixelGraph, widths: numpy.ndarray,
+                centers: numpy.ndarray) -> numpy.ndarray:
+    return graph.hue_weights @ sector_distances (widths, centers)
+
+def edge_weights (graph: SuperpixelGraph, smoothness: float = DEFAULT_SMOOTHNESS) -> numpy.ndarray:
+    a, b = graph.edges[:, 0], graph.edges[:, 1]
+    distance = numpy.abs ((graph.hue[a] - graph.hue[b] + 0.5) % 1.0 - 0.5)
+    saturation = numpy.maximum (graph.saturation[a], graph.saturation[b])
+    return smoothness * graph.border * saturation / numpy.maximum (distance, MIN_HUE_DISTANCE)
+
+def graph_cut (graph: SuperpixelGraph, widths: numpy.ndarray, centers: numpy.ndarray,
+               smoothness: float = DEFAULT_SMOOTHNESS) -> numpy.ndarray:
+    # sector index per superpixel, templates with a single sector need no cut
+    if len (widths) != 2:
+        return numpy.zeros (graph.count, dtype = numpy.uint8)
+
+    costs = data_costs (graph, widths, centers)
+    weights = edge_weights (graph, smoothness)
+    cut = maxflow.Graph (graph.count)
+
+    # a superpixel on the sink side belongs to sector 1 and cuts its source link
+    cut.add_tedges (numpy.arange (graph.count), costs[:, 1], costs[:, 0])
+    cut.add_edges (graph.edges[:, 0], graph.edges[:, 1], weights, weights)
+
+    cut.maxflow ()
+    return cut.get_segments ()
+
+def sector_map (graph: SuperpixelGraph, assignment: numpy.ndarray) -> numpy.ndarray:
+    # sector index per pixel of the image the superpixels were built from
+    return assignment[graph.labels]
+
+def scale_rows (sector_map: numpy.ndarray, size: Tuple[int, int],
+                top: int, bottom: int) -> numpy.ndarray:
+    # rows top to bottom of the map scaled to an image of the given size,
+    # with nearest neighbour sampling
+    width, height = size
+    map_height, map_width = sector_map.shape
+    rows = numpy.minimum ((numpy.arange (top, bottom) + 0.5) * map_height / height,
+                          map_height - 1).astype (numpy.intp)
+    columns = numpy.minimum ((numpy.arange (width) + 0.5) * map_width / width,
+                             map_width - 1).astype (numpy.intp)
+    return sector_map[rows[:, numpy.newaxis], columns[numpy.newaxis, :]]
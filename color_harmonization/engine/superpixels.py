@@ -0,0 +1,144 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import numpy
+
+from PIL import Image
+from typing import Tuple
+from color_harmonization.engine import histogram
+
+# SLIC superpixels (Achanta et al.), vectorized over the whole image: every
+# pixel only competes for the clusters of its own and the eight neighbouring
+# grid cells, which are compared one offset at a time.
+DEFAULT_SEGMENTS = 1024
+DEFAULT_COMPACTNESS = 10.0
+DEFAULT_ITERATIONS = 5
+
+def rgb_to_lab (rgb: numpy.ndarray) -> numpy.ndarray:
+    # sRGB with D65 white to CIE L*a*b*
+    color = rgb[..., :3].astype (numpy.float32) / 255
+    color = numpy.where (color > 0.04045, ((color + 0.055) / 1.055) ** 2.4, color / 12.92)
+    xyz = color @ numpy.array ([[0.4124, 0.2126, 0.0193],
+                                [0.3576, 0.7152, 0.1192],
+                                [0.1805, 0.0722, 0.9505]], dtype = numpy.float32)
+    xyz /= numpy.array ([0.95047, 1.0, 1.08883], dtype = numpy.float32)
+    f = numpy.where (xyz > 0.008856, numpy.cbrt (xyz), 7.787 * xyz + 16 / 116)
+
+    lab = numpy.empty_like (xyz)
+    lab[..., 0] = 116 * f[..., 1] - 16
+    lab[..., 1] = 500 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200 * (f[..., 1] - f[..., 2])
+    return lab
+
+def slic (rgb: numpy.ndarray, segments: int = DEFAULT_SEGMENTS,
+          compactness: float = DEFAULT_COMPACTNESS,
+          iterations: int = DEFAULT_ITERATIONS) -> Tuple[numpy.ndarray, int]:
+    height, width = rgb.shape[:2]
+    lab = rgb_to_lab (rgb).reshape (-1, 3)
+    step = max (1.0, (height * width / segments) ** 0.5)
+    grid_h = max (1, int (round (height / step)))
+    grid_w = max (1, int (round (width / step)))
+
+    y, x = numpy.mgrid[:height, :width]
+    y = y.ravel ().astype (numpy.float32)
+    x = x.ravel ().astype (numpy.float32)
+    cell_y = numpy.minimum ((y * grid_h / height).astype (numpy.int32), grid_h - 1)
+    cell_x = numpy.minimum ((x * grid_w / width).astype (numpy.int32), grid_w - 1)
+
+    center_y = ((numpy.arange (grid_h) + 0.5) * height / grid_h).astype (numpy.int32)
+    center_x = ((numpy.arange (grid_w) + 0.5) * width / grid_w).astype (numpy.int32)
+    first = (center_y[:, None] * width + center_x[None, :]).ravel ()
+    centers = numpy.column_stack ([lab[first], y[first], x[first]])
+
+    spatial = numpy.float32 ((compactness / step) ** 2)
+    features = numpy.column_stack ([lab, y, x])
+    labels = numpy.zeros (height * width, dtype = numpy.int32)
+    best = numpy.empty (height * width, dtype = numpy.float32)
+
+    for _ in range (iterations):
+        best.fill (numpy.inf)
+
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                neighbour_y = cell_y + dy
+                neighbour_x = cell_x + dx
+                valid = ((neighbour_y >= 0) & (neighbour_y < grid_h) &
+                         (neighbour_x >= 0) & (neighbour_x < grid_w))
+                cluster = numpy.where (valid, neighbour_y * grid_w + neighbour_x, 0)
+                delta = features - centers[cluster]
+                delta *= delta
+                distance = delta[:, 0] + delta[:, 1] + delta[:, 2] + spatial * (delta[:, 3] + delta[:, 4])
+                closer = valid & (distance < best)
+                best[closer] = distance[closer]
+                labels[closer] = cluster[closer]
+
+        count = numpy.bincount (labels, minlength = len (centers)).astype (numpy.float32)
+        filled = count > 0
+
+        for channel in range (features.shape[1]):
+            sums = numpy.bincount (labels, weights = features[:, channel], minlength = len (centers))
+            centers[filled, channel] = sums[filled] / count[filled]
+
+    # clusters which lost all their pixels are dropped, labels become 0..count - 1
+    used, labels = numpy.unique (labels, return_inverse = True)
+    return labels.reshape (height, width).astype (numpy.int32), len (used)
+
+class SuperpixelGraph:
+    # Superpixels of an image together with what the sector assignment needs
+    # of them: a saturation weighted hue histogram per superpixel and the
+    # adjacency between superpixels with the length of their common border.
+    def __init__ (self: 'SuperpixelGraph', image: Image.Image,
+                  segments: int = DEFAULT_SEGMENTS) -> None:
+        rgb = numpy.asarray (image.convert ("RGB"))
+        self.labels, self.count = slic (rgb, segments)
+        self.size = image.size
+
+        hsv = numpy.asarray (image.convert ("HSV"))
+        saturation = hsv[..., 1].ravel () / 255
+        flat = self.labels.ravel ()
+
+        self.pixels = numpy.bincount (flat, minlength = self.count)
+        self.hue_weights = numpy.bincount (
+            flat * histogram.BINS + hsv[..., 0].ravel (), weights = saturation,
+            minlength = self.count * histogram.BINS
+        ).reshape (self.count, histogram.BINS)
+        self.saturation = self.hue_weights.sum (axis = 1) / numpy.maximum (self.pixels, 1)
+
+        angle = 2 * numpy.pi * (numpy.arange (histogram.BINS) + 0.5) / 255
+        mean = self.hue_weights @ numpy.cos (angle) + 1j * (self.hue_weights @ numpy.sin (angle))
+        self.hue = (numpy.angle (mean) / (2 * numpy.pi)) % 1.0
+
+        self.edges, self.border = self.__adjacency ()
+
+    def __adjacency (self: 'SuperpixelGraph') -> Tuple[numpy.ndarray, numpy.ndarray]:
+        pairs = []
+
+        for a, b in ((self.labels[:, :-1], self.labels[:, 1:]),
+                     (self.labels[:-1, :], self.labels[1:, :])):
+            differ = a != b
+            low = numpy.minimum (a[differ], b[differ]).astype (numpy.int64)
+            high = numpy.maximum (a[differ], b[differ]).astype (numpy.int64)
+            pairs.append (low * self.count + high)
+
+        keys, border = numpy.unique (numpy.concatenate (pairs), return_counts = True)
+        edges = numpy.column_stack ([keys // self.count, keys % self.count])
+        return edges, border
+
+    @property
+    def nbytes (self: 'SuperpixelGraph') -> int:
+        return self.labels.nbytes + self.hue_weights.nbytes + self.edges.nbytes
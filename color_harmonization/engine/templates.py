@@ -0,0 +1,50 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import numpy
+
+from typing import Dict, List, Tuple
+
+# Harmonic templates as (sector widths, sector offsets), both as fractions of
+# the hue circle. The offset of a sector is relative to the previous one.
+TEMPLATES = {
+    "i-type": ([0.05], [0.]),
+    "V-type": ([0.26], [0.]),
+    "L-type": ([0.05, 0.22], [0., 0.25]),
+    "I-type": ([0.05, 0.05], [0., 0.5]),
+    "T-type": ([0.5], [0.]),
+    "Y-type": ([0.26, 0.05], [0., 0.5]),
+    "X-type": ([0.26, 0.26], [0., 0.5])
+} # type: Dict[str, Tuple[List[float], List[float]]]
+
+NAMES = ["i-type", "V-type", "L-type", "I-type", "T-type", "Y-type", "X-type"]
+
+# The hue wheel shows hue 2/3 at the angle the HueSatWheelWidget calls rotation 0.
+WHEEL_HUE_OFFSET = 2 / 3
+
+def sector_widths (template: Tuple[List[float], List[float]]) -> numpy.ndarray:
+    return numpy.array (template[0], dtype = numpy.float64)
+
+def sector_centers (template: Tuple[List[float], List[float]], hue_rotation: float) -> numpy.ndarray:
+    return (hue_rotation + numpy.cumsum (template[1])) % 1.0
+
+def rotation_to_hue (rotation: float) -> float:
+    return (rotation / (2 * numpy.pi) + WHEEL_HUE_OFFSET) % 1.0
+
+def hue_to_rotation (hue_rotation: float) -> float:
+    return (hue_rotation - WHEEL_HUE_OFFSET) * 2 * numpy.pi
@@ -0,0 +1,432 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import abc
+import math
+import os
+import shutil
+import struct
+import uuid
+import zlib
+import numpy
+
+from PIL import Image
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+from color_harmonization.engine import harmonization, lut3d
+
+# Peak memory of a strip per pixel: harmonization.harmonize allocates about
+# 64 bytes of temporaries, plus the input and the output strip.
+WORKING_BYTES_PER_PIXEL = 80
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Uncompressed sources with these raw layouts are read strip by strip straight
+# from the file. Everything else is decoded by Pillow as a whole first.
+RAW_BYTES_PER_PIXEL = {
+    "L": 1, "LA": 2, "RGB": 3, "BGR": 3, "RGBA": 4, "BGRA": 4, "RGBX": 4, "BGRX": 4
+}
+STREAMABLE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX")
+
+def rows_per_strip (width: int, memory_limit: int = DEFAULT_MEMORY_LIMIT) -> int:
+    return max (1, memory_limit // (width * WORKING_BYTES_PER_PIXEL))
+
+def parse_size (value: str) -> int:
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    value = value.strip ().upper ().rstrip ("B")
+
+    if value and value[-1] in units:
+        return int (float (value[:-1]) * units[value[-1]])
+
+    return int (value)
+
+def has_alpha (image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+class StripReader:
+    def __init__ (self: 'StripReader', path: str) -> None:
+        self.path = path
+        self.__image = Image.open (path)
+        self.size = self.__image.size # type: Tuple[int, int]
+        self.info = dict (self.__image.info) # type: Dict[str, Any]
+        self.mode = "RGBA" if has_alpha (self.__image) else "RGB"
+        self.__raw = self.__raw_layout ()
+
+        if self.__raw is None:
+            self.__image.load ()
+
+    def __raw_layout (self: 'StripReader') -> Tuple[int, str, int, int]:
+        image = self.__image
+        if image.mode not in STREAMABLE_MODES or not image.tile:
+            return None
+
+        layout = None
+        for codec, extents, offset, args in image.tile:
+            if isinstance (args, str):
+                args = (args,)
+
+            rawmode = args[0]
+            stride = args[1] if len (args) > 1 else 0
+            ystep = args[2] if len (args) > 2 else 1
+
+            if codec != "raw" or rawmode not in RAW_BYTES_PER_PIXEL or ystep not in (1, -1) or \
+               extents[0] != 0 or extents[2] != image.size[0]:
+                return None
+
+            if stride <= 0:
+                stride = image.size[0] * RAW_BYTES_PER_PIXEL[rawmode]
+
+            # strips are only read directly if they are stored back to back
+            if layout is None:
+                if extents[1] != 0:
+                    return None
+                layout = (offset, rawmode, stride, ystep)
+            elif (rawmode, stride, ystep) != layout[1:] or ystep != 1 or \
+                 offset != layout[0] + extents[1] * stride:
+                return None
+
+        return layout
+
+    def read (self: 'StripReader', top: int, bottom: int) -> numpy.ndarray:
+        width, height = self.size
+
+        if self.__raw is None:
+            strip = self.__image.crop ((0, top, width, bottom))
+        else:
+            offset, rawmode, stride, ystep = self.__raw
+            first = top if ystep == 1 else height - bottom
+            self.__image.fp.seek (offset + first * stride)
+            data = self.__image.fp.read ((bottom - top) * stride)
+            strip = Image.frombuffer (self.__image.mode, (width, bottom - top), data,
+                                      "raw", rawmode, stride, ystep)
+
+        return numpy.asarray (strip.convert (self.mode))
+
+    def strips (self: 'StripReader', rows: int) -> Iterator[Tuple[int, numpy.ndarray]]:
+        for top in range (0, self.size[1], rows):
+            yield top, self.read (top, min (top + rows, self.size[1]))
+
+    def preview (self: 'StripReader', max_size: int,
+                 memory_limit: int = DEFAULT_MEMORY_LIMIT) -> Image.Image:
+        factor = max (1, math.ceil (max (self.size) / max_size))
+
+        # strips that are a multiple of the reduction factor high reduce to
+        # exactly the rows Image.reduce would produce for the whole image
+        rows = max (1, rows_per_strip (self.size[0], memory_limit) // factor) * factor
+        parts = [
+            Image.fromarray (strip).reduce (factor) for _, strip in self.strips (rows)
+        ]
+
+        preview = Image.new (self.mode, (parts[0].size[0], sum (p.size[1] for p in parts)))
+        top = 0
+        for part in parts:
+            preview.paste (part, (0, top))
+            top += part.size[1]
+
+        return preview
+
+    def close (self: 'StripReader') -> None:
+        self.__image.close ()
+
+    def __enter__ (self: 'StripReader') -> 'StripReader':
+        return self
+
+    def __exit__ (self: 'StripReader', *args: Any) -> None:
+        self.close ()
+
+class StripWriter (metaclass = abc.ABCMeta):
+    def __init__ (self: 'StripWriter', path: str, size: Tuple[int, int], mode: str,
+                  info: Dict[str, Any] = None) -> None:
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.info = info or {}
+
+        # Strips go to a temporary file next to the destination, which
+        # replaces the destination in close. An aborted write leaves an
+        # existing file alone, even when it is still being read. The file
+        # is created like a plain open would, so a new image gets the
+        # permissions of the umask without the umask being touched.
+        directory, name = os.path.split (os.path.abspath (path))
+        self.temporary_path = os.path.join (directory, ".{}.{}{}".format (
+            name, uuid.uuid4 ().hex, os.path.splitext (name)[1]
+        ))
+        os.close (os.open (self.temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+
+    @abc.abstractmethod
+    def write (self: 'StripWriter', top: int, strip: numpy.ndarray) -> None:
+        pass
+
+    def close (self: 'StripWriter') -> None:
+        if os.path.exists (self.path):
+            shutil.copymode (self.path, self.temporary_path)
+
+        os.replace (self.temporary_path, self.path)
+
+    def abort (self: 'StripWriter') -> None:
+        if os.path.exists (self.temporary_path):
+            os.remove (self.temporary_path)
+
+    def __enter__ (self: 'StripWriter') -> 'StripWriter':
+        return self
+
+    def __exit__ (self: 'StripWriter', exc_type: Any, *args: Any) -> None:
+        if exc_type is None:
+            try:
+                self.close ()
+            except BaseException:
+                self.abort ()
+                raise
+        else:
+            self.abort ()
+
+class BufferedStripWriter (StripWriter):
+    # Pillow encoders need the whole image, so strips are collected into one
+    # uint8 buffer which is handed to Pillow without another copy.
+    def __init__ (self: 'BufferedStripWriter', *args: Any, **kwargs: Any) -> None:
+        super ().__init__ (*args, **kwargs)
+        width, height = self.size
+        self.__buffer = numpy.empty ((height, width, len (self.mode)), dtype = numpy.uint8)
+
+    def write (self: 'BufferedStripWriter', top: int, strip: numpy.ndarray) -> None:
+        self.__buffer[top:top + strip.shape[0]] = strip
+
+    def close (self: 'BufferedStripWriter') -> None:
+        image = Image.frombuffer (self.mode, self.size, self.__buffer, "raw", self.mode, 0, 1)
+        params = {}
+        for key in ("icc_profile", "exif"):
+            if self.info.get (key):
+                params[key] = self.info[key]
+        image.save (self.temporary_path, **params)
+        super ().close ()
+
+class TiffStripWriter (StripWriter):
+    # Writes an uncompressed baseline TIFF strip by strip. The IFD is written
+    # after the last strip, when all strip offsets are known.
+    TAG_TYPES = {"ASCII": (2, "B"), "SHORT": (3, "H"), "LONG": (4, "I"), "UNDEFINED": (7, "B")}
+    # descriptive Exif tags that live in the main IFD of a TIFF file
+    EXIF_TEXT_TAGS = (270, 271, 272, 305, 306, 315, 33432)
+    EXIF_ORIENTATION = 274
+
+    def __init__ (self: 'TiffStripWriter', *args: Any, **kwargs: Any) -> None:
+        super ().__init__ (*args, **kwargs)
+        width, height = self.size
+
+        if width * height * len (self.mode) >= 2**32:
+            super ().abort ()
+            raise ValueError ("{}: image too large for a classic TIFF file".format (self.path))
+
+        self.__file = open (self.temporary_path, "wb") # type: BinaryIO
+        self.__file.write (struct.pack ("<2sHI", b"II", 42, 0))
+        self.__offsets = [] # type: List[int]
+        self.__counts = [] # type: List[int]
+        self.__rows = 0
+        self.__rows_per_strip = height
+
+    def write (self: 'TiffStripWriter', top: int, strip: numpy.ndarray) -> None:
+        if top != self.__rows:
+            raise ValueError ("strips have to be written in order")
+
+        if top == 0:
+            self.__rows_per_strip = strip.shape[0]
+
+        data = numpy.ascontiguousarray (strip, dtype = numpy.uint8)
+        self.__offsets.append (self.__file.tell ())
+        self.__counts.append (data.nbytes)
+        self.__file.write (memoryview (data).cast ("B"))
+        self.__rows += strip.shape[0]
+
+    def __write_array (self: 'TiffStripWriter', fmt: str, values: List[int]) -> int:
+        if self.__file.tell () % 2:
+            self.__file.write (b"\0")
+        offset = self.__file.tell ()
+        self.__file.write (struct.pack ("<{}{}".format (len (values), fmt), *values))
+        return offset
+
+    def __exif_entries (self: 'TiffStripWriter') -> List[Tuple[int, str, List[int]]]:
+        if not self.info.get ("exif"):
+            return []
+
+        exif = Image.Exif ()
+        exif.load (self.info["exif"])
+        entries = []
+
+        for tag in TiffStripWriter.EXIF_TEXT_TAGS:
+            value = exif.get (tag)
+            if isinstance (value, str):
+                entries.append ((tag, "ASCII", list (value.encode ("utf-8", "replace") + b"\0")))
+
+        orientation = exif.get (TiffStripWriter.EXIF_ORIENTATION)
+        if isinstance (orientation, int):
+            entries.append ((TiffStripWriter.EXIF_ORIENTATION, "SHORT", [orientation]))
+
+        return entries
+
+    def close (self: 'TiffStripWriter') -> None:
+        width, height = self.size
+        samples = len (self.mode)
+        entries = [
+            (256, "LONG", [width]),
+            (257, "LONG", [height]),
+            (258, "SHORT", [8] * samples),
+            (259, "SHORT", [1]),
+            (262, "SHORT", [2]),
+            (273, "LONG", self.__offsets),
+            (277, "SHORT", [samples]),
+            (278, "LONG", [self.__rows_per_strip]),
+            (279, "LONG", self.__counts),
+            (284, "SHORT", [1])
+        ]
+        if samples == 4:
+            entries.append ((338, "SHORT", [2]))
+
+        icc = self.info.get ("icc_profile")
+        if icc:
+            entries.append ((34675, "UNDEFINED", list (icc)))
+
+        entries.extend (self.__exif_entries ())
+
+        ifd = []
+        for tag, kind, values in sorted (entries):
+            code, fmt = TiffStripWriter.TAG_TYPES[kind]
+            size = struct.calcsize (fmt) * len (values)
+
+            if size <= 4:
+                value = struct.pack ("<{}{}".format (len (values), fmt), *values).ljust (4, b"\0")
+            else:
+                value = struct.pack ("<I", self.__write_array (fmt, values))
+
+            ifd.append (struct.pack ("<HHI", tag, code, len (values)) + value)
+
+        if self.__file.tell () % 2:
+            self.__file.write (b"\0")
+        ifd_offset = self.__file.tell ()
+        self.__file.write (struct.pack ("<H", len (ifd)) + b"".join (ifd) + struct.pack ("<I", 0))
+        self.__file.seek (4)
+        self.__file.write (struct.pack ("<I", ifd_offset))
+        self.__file.close ()
+        super ().close ()
+
+    def abort (self: 'TiffStripWriter') -> None:
+        self.__file.close ()
+        super ().abort ()
+
+class PngStripWriter (StripWriter):
+    # Writes a PNG strip by strip. Every row uses the Sub filter, which numpy
+    # computes for a whole strip at once, and the deflate stream is flushed
+    # into IDAT chunks while the strips arrive.
+    SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    COLOR_TYPES = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+    CHUNK_SIZE = 1 << 20
+
+    def __init__ (self: 'PngStripWriter', *args: Any, compress_level: int = 6,
+                  **kwargs: Any) -> None:
+        super ().__init__ (*args, **kwargs)
+        width, height = self.size
+
+        self.__file = open (self.temporary_path, "wb") # type: BinaryIO
+        self.__file.write (PngStripWriter.SIGNATURE)
+        self.__chunk (b"IHDR", struct.pack (
+            ">IIBBBBB", width, height, 8, PngStripWriter.COLOR_TYPES[self.mode], 0, 0, 0
+        ))
+
+        icc = self.info.get ("icc_profile")
+        if icc:
+            self.__chunk (b"iCCP", b"ICC Profile\0\0" + zlib.compress (icc))
+
+        exif = self.info.get ("exif")
+        if exif:
+            # Pillow keeps the APP1 header of JPEG files, PNG stores the bare TIFF data
+            if exif.startswith (b"Exif\0\0"):
+                exif = exif[6:]
+            self.__chunk (b"eXIf", exif)
+
+        self.__compressor = zlib.compressobj (compress_level)
+        self.__pending = [] # type: List[bytes]
+        self.__pending_size = 0
+        self.__rows = 0
+
+    def __chunk (self: 'PngStripWriter', kind: bytes, data: bytes) -> None:
+        self.__file.write (struct.pack (">I", len (data)) + kind)
+        self.__file.write (data)
+        self.__file.write (struct.pack (">I", zlib.crc32 (data, zlib.crc32 (kind))))
+
+    def __flush (self: 'PngStripWriter', data: bytes, force: bool = False) -> None:
+        if data:
+            self.__pending.append (data)
+            self.__pending_size += len (data)
+
+        if self.__pending_size >= PngStripWriter.CHUNK_SIZE or (force and self.__pending):
+            self.__chunk (b"IDAT", b"".join (self.__pending))
+            self.__pending = []
+            self.__pending_size = 0
+
+    def write (self: 'PngStripWriter', top: int, strip: numpy.ndarray) -> None:
+        if top != self.__rows:
+            raise ValueError ("strips have to be written in order")
+
+        rows = strip.shape[0]
+        samples = len (self.mode)
+        data = numpy.ascontiguousarray (strip, dtype = numpy.uint8).reshape (rows, -1)
+        filtered = numpy.empty ((rows, data.shape[1] + 1), dtype = numpy.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:samples + 1] = data[:, :samples]
+        numpy.subtract (data[:, samples:], data[:, :-samples], out = filtered[:, samples + 1:])
+
+        self.__flush (self.__compressor.compress (memoryview (filtered).cast ("B")))
+        self.__rows += rows
+
+    def close (self: 'PngStripWriter') -> None:
+        self.__flush (self.__compressor.flush (), True)
+        self.__chunk (b"IEND", b"")
+        self.__file.close ()
+        super ().close ()
+
+    def abort (self: 'PngStripWriter') -> None:
+        self.__file.close ()
+        super ().abort ()
+
+def open_writer (path: str, size: Tuple[int, int], mode: str,
+                 info: Dict[str, Any] = None) -> StripWriter:
+    extension = os.path.splitext (path)[1].lower ()
+
+    if extension in (".tif", ".tiff"):
+        return TiffStripWriter (path, size, mode, info)
+
+    if extension == ".png" and mode in PngStripWriter.COLOR_TYPES:
+        return PngStripWriter (path, size, mode, info)
+
+    return BufferedStripWriter (path, size, mode, info)
+
+def harmonize_file (reader: StripReader, destination: str, widths: numpy.ndarray,
+                    centers: numpy.ndarray,
+                    memory_limit: int = DEFAULT_MEMORY_LIMIT,
+                    lut: numpy.ndarray = None) -> None:
+    # with a 3D lut (see lut3d.sample) the strips are harmonized by lookup
+    if os.path.exists (destination) and os.path.samefile (reader.path, destination):
+        raise ValueError ("{}: the destination is the source image".format (destination))
+
+    rows = rows_per_strip (reader.size[0], memory_limit)
+    table = harmonization.hue_table (widths, centers)
+    lut_planes = lut3d.planes (lut) if lut is not None else None
+
+    with open_writer (destination, reader.size, reader.mode, reader.info) as writer:
+        for top, strip in reader.strips (rows):
+            if lut_planes is not None:
+                writer.write (top, lut3d.apply (strip, lut, lut_planes = lut_planes))
+            else:
+                writer.write (top, harmonization.harmonize (strip, widths, centers,
+                                                            table = table))
@@ -16,51 +16,45 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 '''
 
-import glob
 import os
-import locale
 import warnings
-import gettext
-from gi.repository import Gtk, GdkPixbuf, GLib
-from typing import List, Any, cast
+from gi.repository import Gtk, GLib
+from typing import Callable, List, Any, Tuple, TYPE_CHECKING
+from color_harmonization import startup
 from color_harmonization.handler import Handler
-from color_harmonization.gui.gl_image import GLImage
-from color_harmonization.gui.hue_sat_wheel_widget import HueSatWheelWidget
-from color_harmonization.gui.gl_quad_renderer import GLQuadRenderer
+from color_harmonization.gui import resources
 
-LOCALE_PATH = 'color_harmonization/gui/locale'
+# numpy, Pillow, PyOpenGL and cairo are imported once the window is shown,
+# by the pages that need them
+if TYPE_CHECKING:
+    import numpy
+    from color_harmonization.engine import export, jobs
+    from color_harmonization.gui.hue_sat_wheel_widget import HueSatWheelWidget
+
+UNKNOWN_IMAGE = os.path.join (resources.PACKAGE_PATH, "icon", "unknown.png")
 _ = lambda s: s
 
 class Assistant:
     def __init__ (self: 'Assistant', handler: Handler) -> None:
-        langs = GLib.get_language_names ()
-
-        try:
-            locale.bindtextdomain ('color_harmonization', LOCALE_PATH)
-            trans = gettext.translation (
-                'color_harmonization', LOCALE_PATH, langs
-            )
+        with startup.phase ("resources"):
+            resources.register ()
+            resources.add_icons ()
 
+        with startup.phase ("translations"):
             global _
-            _ = trans.gettext
-        except FileNotFoundError:
-            pass
+            _ = resources.translation (GLib.get_language_names ()).gettext
 
-        self.__load_icons ("color_harmonization/gui/icon")
-        self.__builder = Gtk.Builder () # type: Gtk.Builder
-        self.__builder.set_translation_domain ("color_harmonization")
-        warnings.filterwarnings ('ignore')
-        self.__builder.add_objects_from_file (
-            "color_harmonization/gui/color-harmonization.glade",
-            ("color-harmonization-assistant", "sector-chooser-list-store", "image-filefilter")
-        )
-        warnings.filterwarnings ('default')
-        self.__builder.connect_signals (handler)
+        with startup.phase ("builder"):
+            self.__builder = self.__create_builder (
+                ("color-harmonization-assistant", "sector-chooser-list-store", "image-filefilter")
+            )
+            self.__builder.connect_signals (handler)
+
+        self.__cancel_dialog = None # type: Gtk.MessageDialog
         self.assistant = self.__builder.get_object (
             "color-harmonization-assistant"
         ) # type: Gtk.Assistant
         self.assistant.set_wmclass (self.assistant.props.title, self.assistant.props.title)
-        self.__selected_image_preview_grid = Gtk.Grid ()
         self.__result_image_box = self.__builder.get_object (
             "harmonized-image"
         ) # type: Gtk.Box
@@ -79,31 +73,15 @@ class Assistant:
         self.__choose_image_box = self.__builder.get_object (
             "choose-image-box"
         ) # type: Gtk.Box
-        self.__choose_image_box.pack_start (self.__selected_image_preview_grid, False, True, 0)
-        self.__selected_image_preview_grid.props.column_spacing = 8
-        self.__selected_image_preview_grid.props.row_spacing = 8
-
-        harmonization_types = [
-            "i-type", "V-type", "L-type", "I-type", "T-type", "Y-type", "X-type"
-        ]
-        self.hue_sat_wheels = [] # type: List[HueSatWheelWidget]
-        for htype in harmonization_types:
-            child = HueSatWheelWidget (sector = HueSatWheelWidget.sectors[htype])
-            self.__harmonization_type_stack.add_named (child, htype)
-            self.__harmonization_type_stack.child_set_property (child, "icon-name", htype)
-            self.hue_sat_wheels.append (child)
-
-        self.__unknown_svg = "color_harmonization/gui/icon/unknown.svg"
-        self.__unknown_png = "color_harmonization/gui/icon/unknown.png"
-        self.original_image = GLImage (3, 3)
-        self.harmonized_image = GLImage (3, 3, 512, True)
-        self.__result_image = GLImage (3, 3, 2048)
-        self.__result_image_box.pack_start (self.__result_image, True, True, 0)
-        self.__images_box.pack_start (self.original_image, True, True, 0)
-        self.__images_box.pack_start (self.harmonized_image, True, True, 0)
-        self.input_images = None # type: List[str]
-        self.current_image = None # type: str
-        self.current_image_idx = 0
+
+        self.__pages_built = False
+        self.__histogram = None # type: numpy.ndarray
+        self.__histogram_path = None # type: str
+        self.__sector_chooser = "nearest" # sector_assignment.NEAREST, imported with the pages
+        self.harmonization_result = None # type: jobs.HarmonizationJob
+        self.__input_images = None # type: List[str]
+        self.__current_image = None # type: str
+        self.__current_image_idx = 0
 
         self.back_btn = Gtk.Button.new_with_label (_("Back"))
         self.close_btn = Gtk.Button.new_with_label (_("Close"))
@@ -123,6 +101,72 @@ class Assistant:
         headerbar.pack_end (self.close_btn)
         headerbar.pack_end (self.next_btn)
 
+    def __create_builder (self: 'Assistant', object_ids: Tuple[str, ...]) -> Gtk.Builder:
+        # the glade file is parsed and translated only once, see resources.glade
+        builder = Gtk.Builder () # type: Gtk.Builder
+        warnings.filterwarnings ('ignore')
+        builder.add_objects_from_string (resources.glade (_), object_ids)
+        warnings.filterwarnings ('default')
+        return builder
+
+    def __build_pages (self: 'Assistant') -> None:
+        # the widgets of the pages need numpy, Pillow, PyOpenGL and cairo, so
+        # they are created after the window has been shown for the first time
+        if self.__pages_built:
+            return
+
+        self.__pages_built = True
+
+        with startup.phase ("import page modules"):
+            from color_harmonization.engine import analysis_cache, jobs, templates
+            from color_harmonization.gui.gl_image import GLImage
+            from color_harmonization.gui.thumbnail_grid import ThumbnailGrid
+            from color_harmonization.gui.hue_sat_wheel_widget import HueSatWheelWidget
+
+        with startup.phase ("build pages"):
+            self.__jobs = jobs.JobScheduler ()
+            self.__thumbnail_grid = ThumbnailGrid (3, 3)
+            self.__choose_image_box.pack_start (self.__thumbnail_grid, True, True, 0)
+
+            self.hue_sat_wheels = [] # type: List[HueSatWheelWidget]
+            for htype in templates.NAMES:
+                child = HueSatWheelWidget (sector = HueSatWheelWidget.sectors[htype])
+                self.__harmonization_type_stack.add_named (child, htype)
+                self.__harmonization_type_stack.child_set_property (child, "icon-name", htype)
+                child.connect ("rotation-changed", self.__on_rotation_changed)
+                child.connect ("rotation-finished", self.__on_rotation_finished)
+                self.hue_sat_wheels.append (child)
+
+            self.__harmonization_type_stack.connect (
+                "notify::visible-child", self.__on_template_changed
+            )
+
+            self.original_image = GLImage (3, 3, name = "original")
+            self.harmonized_image = GLImage (3, 3, analysis_cache.ANALYSIS_SIZE, True,
+                                             name = "harmonized")
+            self.harmonized_image.show_frame_time ()
+            self.__result_image = GLImage (3, 3, 2048, name = "result")
+            self.__result_image_box.pack_start (self.__result_image, True, True, 0)
+            self.__images_box.pack_start (self.original_image, True, True, 0)
+            self.__images_box.pack_start (self.harmonized_image, True, True, 0)
+
+            for widget in (self.__thumbnail_grid, self.__harmonization_type_stack,
+                           self.__result_image_box, self.__images_box):
+                widget.show_all ()
+
+            self.input_images = self.__input_images
+
+    def __on_first_frame (self: 'Assistant', clock: Any) -> None:
+        clock.disconnect (self.__first_frame_handler)
+        startup.mark ("first frame")
+
+        def build () -> bool:
+            self.__build_pages ()
+            startup.report ()
+            return False
+
+        GLib.idle_add (build)
+
     def on_assistant_close (self: 'Assistant', button: Gtk.Button) -> None:
         self.assistant.close ()
 
@@ -161,8 +205,12 @@ class Assistant:
         return headerbar
 
     def run (self: 'Assistant') -> int:
-        self.assistant.show_all ()
-        self.disable_assistant_buttons ()
+        with startup.phase ("show window"):
+            self.assistant.show_all ()
+            self.disable_assistant_buttons ()
+
+        clock = self.assistant.get_frame_clock ()
+        self.__first_frame_handler = clock.connect ("after-paint", self.__on_first_frame)
         Gtk.main ()
         return 0
 
@@ -186,65 +234,228 @@ class Assistant:
             self.disable_assistant_buttons ()
 
     def start_harmonization (self: 'Assistant') -> None:
-        self.__cancel_harmonization = False
-        self.timeout_id = GLib.timeout_add (50, self.update_progress, None)
-
-    def update_progress (self: 'Assistant', user_data: Any = None) -> bool:
-        if self.__cancel_harmonization:
+        from color_harmonization.engine import jobs, templates
+        wheel = self.__harmonization_type_stack.get_visible_child () # type: HueSatWheelWidget
+        self.__jobs.run (jobs.HarmonizationJob (
+            self.current_image,
+            self.__harmonization_type_stack.get_visible_child_name (),
+            templates.rotation_to_hue (wheel.rotation),
+            sector_chooser = self.__sector_chooser,
+            progress = self.__on_harmonization_progress,
+            done = self.__on_harmonization_done
+        ))
+
+    def __on_harmonization_progress (self: 'Assistant', job: 'jobs.HarmonizationJob',
+                                     fraction: float) -> None:
+        GLib.idle_add (self.update_progress, job, fraction)
+
+    def __on_harmonization_done (self: 'Assistant', job: 'jobs.HarmonizationJob') -> None:
+        GLib.idle_add (self.finish_harmonization, job)
+
+    def update_progress (self: 'Assistant', job: 'jobs.HarmonizationJob', fraction: float) -> bool:
+        if job is self.__jobs.current:
+            self.__progressbar.set_fraction (fraction)
+
+        return False
+
+    def finish_harmonization (self: 'Assistant', job: 'jobs.HarmonizationJob') -> bool:
+        if job is not self.__jobs.current or job.cancelled:
             return False
 
-        new_value = self.__progressbar.get_fraction () + 0.01
-
-        if new_value > 1:
-            self.assistant.set_page_complete (
-                self.assistant.get_nth_page (self.assistant.get_current_page ()),
-                True
-            )
-            self.assistant.next_page ()
+        if job.error is not None:
+            print ("Harmonization of '{}' failed: {}".format (job.path, job.error))
+            self.assistant.previous_page ()
             return False
 
-        self.__progressbar.set_fraction (new_value)
-        return True
+        self.harmonization_result = job
+        self.__result_image.set_image (job.image ())
+        self.assistant.set_page_complete (
+            self.assistant.get_nth_page (self.assistant.get_current_page ()),
+            True
+        )
+        self.assistant.next_page ()
+        return False
 
     def cancel_harmonization (self: 'Assistant') -> None:
-        builder = Gtk.Builder () # type: Gtk.Builder
-        warnings.filterwarnings ('ignore')
-        builder.add_objects_from_file (
-            "color_harmonization/gui/color-harmonization.glade",
-            ("cancel-messagedialog",)
-        )
-        warnings.filterwarnings ('default')
-        dialog = builder.get_object ("cancel-messagedialog") # type: Gtk.MessageDialog
-        dialog.set_transient_for (self.assistant)
-        response = dialog.run () # type: int
+        if self.__cancel_dialog is None:
+            builder = self.__create_builder (("cancel-messagedialog",))
+            self.__cancel_dialog = builder.get_object ("cancel-messagedialog")
+            self.__cancel_dialog.set_transient_for (self.assistant)
+
+        response = self.__cancel_dialog.run () # type: int
+        self.__cancel_dialog.hide ()
 
         if response == Gtk.ResponseType.YES:
-            self.__cancel_harmonization = True
+            self.__jobs.cancel ()
             self.assistant.previous_page ()
 
-        dialog.destroy ()
+    def set_histogram (self: 'Assistant', hist: 'numpy.ndarray', path: str) -> None:
+        # a histogram of an image that was switched away from arrives late
+        if path != self.current_image:
+            return
+
+        self.__histogram = hist
+        self.__histogram_path = path
 
-    def set_histogram (self: 'Assistant', hist: List[float]) -> None:
         for child in self.hue_sat_wheels:
             child.histogram = hist
 
+    def automatic_configuration (self: 'Assistant') -> None:
+        from color_harmonization.engine import analysis_cache, fitting, histogram, templates
+        # without the histogram of the current image there is nothing to fit,
+        # and nothing that may be cached under its content
+        if self.__histogram is None or self.__histogram_path != self.current_image:
+            return
+
+        # The wheel histogram is built from the analysis size thumbnail of
+        # the image, whose fits are kept for later sessions.
+        fits = analysis_cache.cached_fits (
+            self.current_image, analysis_cache.ANALYSIS_SIZE, analysis_cache.THUMBNAIL,
+            lambda: histogram.linear_scale (self.__histogram),
+            analysis_cache.default_cache if self.current_image is not None else None
+        )
+
+        for htype, child in zip (templates.NAMES, self.hue_sat_wheels):
+            child.rotation = templates.hue_to_rotation (fits[htype].rotation)
+            child.queue_draw ()
+
+        self.__harmonization_type_stack.set_visible_child_name (
+            fitting.choose_fit (fits).template
+        )
+        self.update_sector_map ()
+
+    def set_sector_chooser (self: 'Assistant', chooser: str) -> None:
+        self.__sector_chooser = chooser
+        self.update_sector_map ()
+
+    def __selected_sectors (self: 'Assistant') -> 'Tuple[numpy.ndarray, numpy.ndarray]':
+        from color_harmonization.engine import templates
+        wheel = self.__harmonization_type_stack.get_visible_child () # type: HueSatWheelWidget
+        sectors = templates.TEMPLATES[self.__harmonization_type_stack.get_visible_child_name ()]
+        return (templates.sector_widths (sectors),
+                templates.sector_centers (sectors, templates.rotation_to_hue (wheel.rotation)))
+
+    def __on_rotation_changed (self: 'Assistant', wheel: 'HueSatWheelWidget') -> None:
+        if wheel is self.__harmonization_type_stack.get_visible_child ():
+            self.update_preview_sectors ()
+
+    def __on_rotation_finished (self: 'Assistant', wheel: 'HueSatWheelWidget') -> None:
+        if wheel is self.__harmonization_type_stack.get_visible_child ():
+            self.update_sector_map (False)
+
+    def __on_template_changed (self: 'Assistant', stack: Gtk.Stack, param: Any) -> None:
+        self.update_sector_map ()
+
+    def update_preview_sectors (self: 'Assistant') -> None:
+        from color_harmonization.engine import sector_assignment
+        # follows the wheel live, only the uniforms of the preview change
+        widths, centers = self.__selected_sectors ()
+        self.harmonized_image.set_sectors (
+            widths, centers, self.__sector_chooser == sector_assignment.GRAPH_CUT
+        )
+
+    def update_sector_map (self: 'Assistant', sectors_changed: bool = True) -> None:
+        from color_harmonization.engine import jobs, loader_pool, sector_assignment
+        # the graph cut is computed in the background and replaces the sector
+        # map of the preview when it is done. While the template keeps its
+        # sectors, the previous map stays a good approximation until then.
+        if self.current_image is None:
+            return
+
+        if sectors_changed:
+            self.harmonized_image.discard_sector_map ()
+
+        self.update_preview_sectors ()
+        widths, centers = self.__selected_sectors ()
+
+        if self.__sector_chooser != sector_assignment.GRAPH_CUT or len (widths) != 2:
+            loader_pool.analysis_pool.cancel ((self, "sectors"))
+            return
+
+        path = self.current_image
+
+        def assign (is_cancelled: Callable[[], bool]) -> 'numpy.ndarray':
+            def check () -> None:
+                if is_cancelled ():
+                    raise loader_pool.LoadCancelled ()
+
+            return jobs.graph_cut_map (path, widths, centers, check)
+
+        loader_pool.analysis_pool.submit (
+            (self, "sectors"), assign, self.harmonized_image.set_sector_map,
+            loader_pool.VISIBLE
+        )
+
     def save_image (self: 'Assistant') -> None:
+        from color_harmonization.engine import export
+        if self.harmonization_result is None:
+            return
+
         dialog = Gtk.FileChooserDialog (
             title = _("Choose a filename"), action = Gtk.FileChooserAction.SAVE
         )
         dialog.add_buttons (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
                             Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
         dialog.set_filter (self.__builder.get_object ("image-filefilter"))
+        dialog.set_do_overwrite_confirmation (True)
         dialog.set_transient_for (self.assistant)
+
+        source = self.harmonization_result.path
+        fmt = export.format_for_path (source)
+        root = os.path.splitext (os.path.basename (source))[0]
+        dialog.set_current_folder (os.path.dirname (os.path.abspath (source)))
+        dialog.set_current_name (root + "-harmonized" + fmt.extensions[0])
+
+        format_combo = Gtk.ComboBoxText ()
+        for entry in export.FORMATS:
+            format_combo.append (entry.name, entry.name)
+        format_combo.set_active_id (fmt.name)
+        quality = Gtk.SpinButton.new_with_range (1, 100, 1)
+        quality.set_value (export.DEFAULT_QUALITY)
+        quality.set_sensitive (fmt.quality)
+
+        def on_format_changed (combo: Gtk.ComboBoxText) -> None:
+            selected = export.format_by_name (combo.get_active_id ())
+            quality.set_sensitive (selected.quality)
+            dialog.set_current_name (export.with_extension (dialog.get_current_name (), selected))
+
+        format_combo.connect ("changed", on_format_changed)
+        options = Gtk.Box (orientation = Gtk.Orientation.HORIZONTAL, spacing = 8)
+        options.pack_start (Gtk.Label (label = _("Format")), False, False, 0)
+        options.pack_start (format_combo, False, False, 0)
+        options.pack_start (Gtk.Label (label = _("Quality")), False, False, 0)
+        options.pack_start (quality, False, False, 0)
+        options.show_all ()
+        dialog.set_extra_widget (options)
+
         response = dialog.run ()
 
         if response == Gtk.ResponseType.OK:
             newfile = dialog.get_filename ()
+            fmt = export.format_by_name (format_combo.get_active_id ())
+            level = quality.get_value_as_int ()
 
         dialog.destroy ()
 
         if response == Gtk.ResponseType.OK:
-            print ("File save location is '{}'".format (newfile))
+            self.__save_button.set_sensitive (False)
+            export.ExportJob (
+                self.harmonization_result, export.with_extension (newfile, fmt), fmt, level,
+                done = self.__on_export_done
+            ).start ()
+
+    def __on_export_done (self: 'Assistant', job: 'export.ExportJob') -> None:
+        GLib.idle_add (self.finish_export, job)
+
+    def finish_export (self: 'Assistant', job: 'export.ExportJob') -> bool:
+        self.__save_button.set_sensitive (True)
+
+        if job.error is not None:
+            print ("Saving '{}' failed: {}".format (job.path, job.error))
+        else:
+            print ("Saved harmonized image to '{}'".format (job.path))
+
+        return False
 
     def open_images (self: 'Assistant') -> None:
         dialog = Gtk.FileChooserDialog (
@@ -265,23 +476,9 @@ class Assistant:
 
         if response == Gtk.ResponseType.OK:
             print ("Selected files: {}".format (", ".join (filenames)))
+            self.__build_pages ()
             self.input_images = filenames
 
-    def __load_icons (self: 'Assistant', folder: str, size: int = 16) -> None:
-        icons = {
-            os.path.splitext (os.path.basename (f))[0]: GdkPixbuf.Pixbuf.new_from_file_at_scale (
-                f, size, size, True
-            ) for f in
-            glob.glob ("{}/*.svg".format (folder))
-        }
-        for icon, pixbuf in icons.items ():
-            Gtk.IconTheme.get_default ().add_builtin_icon (icon, size, pixbuf)
-
-    @staticmethod
-    def grid_remove_all (grid: Gtk.Grid) -> None:
-        for child in grid.get_children ():
-            grid.remove (child)
-
     @property
     def input_images (self: 'Assistant') -> List[str]:
         return self.__input_images
@@ -290,20 +487,14 @@ class Assistant:
     def input_images (self: 'Assistant', value: List[str]) -> None:
         self.__input_images = value
 
-        Assistant.grid_remove_all (self.__selected_image_preview_grid)
+        if not self.__pages_built:
+            return
+
         if self.__input_images is None or len (self.__input_images) <= 0:
-            gl_image = GLImage (3, 3, 512, False, 100)
-            self.__selected_image_preview_grid.attach (gl_image, 0, 0, 1, 1)
-            gl_image.set_path (self.__unknown_png)
-            gl_image.show_all ()
+            self.__thumbnail_grid.set_paths ([UNKNOWN_IMAGE])
         else:
             self.__current_image_idx = 0
-            for idx, image in enumerate (self.__input_images):
-                gl_image = GLImage (3, 3, 512, False, 100)
-                self.__selected_image_preview_grid.attach (gl_image, idx % 3, int (idx / 3), 1, 1)
-                gl_image.set_path (image)
-                gl_image.show_all ()
-
+            self.__thumbnail_grid.set_paths (self.__input_images)
             self.update_current_image ()
             self.assistant.set_page_complete (
                 self.assistant.get_nth_page (0),
@@ -325,8 +516,11 @@ class Assistant:
     @current_image.setter
     def current_image (self: 'Assistant', value: str) -> None:
         self.__current_image = value
+        self.__histogram = None
+        self.__histogram_path = None
 
         if value is not None:
             self.__result_image.set_path (value)
             self.original_image.set_path (value)
             self.harmonized_image.set_path (value)
+            self.update_sector_map ()
@@ -0,0 +1,143 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import math
+import os
+import numpy
+
+from OpenGL import GL
+from gi.repository import Gdk
+from color_harmonization.gui import shader_cache
+from color_harmonization.engine import histogram
+
+DEBUG = False
+
+# float32 holds every integer below 2**24 exactly, the points are spread over
+# enough rows that no bin of a row can exceed it
+MAX_EXACT = 2**24
+MAX_ROWS = 256
+
+class GLHistogram:
+    # Builds the saturation weighted hue histogram of an uploaded texture by
+    # scattering one point per texel into a BINS x rows float target.
+    def __init__ (self: 'GLHistogram', context: Gdk.GLContext) -> None:
+        self.program = shader_cache.get_program (
+            context, "histogram", "histogram_vertex_shader.vsh", "histogram_fragment_shader.fsh"
+        )
+
+        if GL.glGetProgramiv (self.program, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+            raise RuntimeError ("histogram program failed to link")
+
+        self.__uniform_texture = GL.glGetUniformLocation (self.program, "Texture")
+        self.__uniform_hue_table = GL.glGetUniformLocation (self.program, "HueTable")
+        self.__uniform_rows = GL.glGetUniformLocation (self.program, "Rows")
+
+        # points are generated from gl_VertexID, the core profile still wants a vertex array
+        self.__vertex_array = GL.glGenVertexArrays (1)
+
+        table = histogram.hue_lookup_table ()
+        self.__hue_table = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__hue_table)
+        GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_R8UI, table.shape[1], table.shape[0], 0,
+                         GL.GL_RED_INTEGER, GL.GL_UNSIGNED_BYTE, table)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+
+        self.__target = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__target)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_R32F, histogram.BINS, MAX_ROWS, 0,
+                         GL.GL_RED, GL.GL_FLOAT, None)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
+
+        previous = GL.glGetIntegerv (GL.GL_FRAMEBUFFER_BINDING)
+        self.__framebuffer = GL.glGenFramebuffers (1)
+        GL.glBindFramebuffer (GL.GL_FRAMEBUFFER, self.__framebuffer)
+        GL.glFramebufferTexture2D (GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+                                   GL.GL_TEXTURE_2D, self.__target, 0)
+        status = GL.glCheckFramebufferStatus (GL.GL_FRAMEBUFFER)
+        GL.glBindFramebuffer (GL.GL_FRAMEBUFFER, previous)
+
+        if status != GL.GL_FRAMEBUFFER_COMPLETE:
+            self.delete ()
+            raise RuntimeError ("float render targets are not supported")
+
+    def weights (self: 'GLHistogram', texture: int, width: int, height: int) -> numpy.ndarray:
+        # same result as histogram.hue_weights of the texture's image
+        count = width * height
+        rows = min (MAX_ROWS, max (1, math.ceil (count * 255 / MAX_EXACT)))
+
+        framebuffer = GL.glGetIntegerv (GL.GL_FRAMEBUFFER_BINDING)
+        vertex_array = GL.glGetIntegerv (GL.GL_VERTEX_ARRAY_BINDING)
+        viewport = GL.glGetIntegerv (GL.GL_VIEWPORT)
+        blend = GL.glIsEnabled (GL.GL_BLEND)
+
+        GL.glBindFramebuffer (GL.GL_FRAMEBUFFER, self.__framebuffer)
+        GL.glViewport (0, 0, histogram.BINS, rows)
+        GL.glClearColor (0, 0, 0, 0)
+        GL.glClear (GL.GL_COLOR_BUFFER_BIT)
+        GL.glEnable (GL.GL_BLEND)
+        GL.glBlendEquation (GL.GL_FUNC_ADD)
+        GL.glBlendFunc (GL.GL_ONE, GL.GL_ONE)
+
+        GL.glUseProgram (self.program)
+        GL.glActiveTexture (GL.GL_TEXTURE0)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, texture)
+        GL.glActiveTexture (GL.GL_TEXTURE1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__hue_table)
+        GL.glUniform1i (self.__uniform_texture, 0)
+        GL.glUniform1i (self.__uniform_hue_table, 1)
+        GL.glUniform1i (self.__uniform_rows, rows)
+
+        GL.glBindVertexArray (self.__vertex_array)
+        GL.glDrawArrays (GL.GL_POINTS, 0, count)
+
+        GL.glPixelStorei (GL.GL_PACK_ALIGNMENT, 4)
+        data = GL.glReadPixels (0, 0, histogram.BINS, rows, GL.GL_RED, GL.GL_FLOAT)
+        sums = numpy.frombuffer (data, dtype = numpy.float32).reshape (rows, histogram.BINS)
+
+        GL.glBindVertexArray (vertex_array)
+        GL.glBindFramebuffer (GL.GL_FRAMEBUFFER, framebuffer)
+        GL.glViewport (*viewport)
+        if not blend:
+            GL.glDisable (GL.GL_BLEND)
+
+        if DEBUG:
+            print ("GPU histogram of {}x{} texels in {} rows".format (width, height, rows))
+
+        return sums.sum (axis = 0, dtype = numpy.float64)
+
+    def delete (self: 'GLHistogram') -> None:
+        GL.glDeleteFramebuffers (1, [self.__framebuffer])
+        GL.glDeleteTextures ([self.__target, self.__hue_table])
+        GL.glDeleteVertexArrays (1, [self.__vertex_array])
+
+def create (context: Gdk.GLContext) -> GLHistogram:
+    # None selects the CPU histogram, either because it was asked for or
+    # because the GL implementation cannot render to float targets
+    if os.environ.get ("COLOR_HARMONIZATION_GPU_HISTOGRAM", "1") == "0":
+        return None
+
+    try:
+        return GLHistogram (context)
+    except (RuntimeError, GL.GLError) as e:
+        if DEBUG:
+            print ("GPU histogram unavailable: {}".format (e))
+        return None
@@ -16,7 +16,10 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 '''
 
+import numpy
+
 from gi.repository import Gtk
+from PIL import Image
 from color_harmonization.gui.gl_quad_renderer import GLQuadRenderer
 from color_harmonization.gui.gl_widget import GLWidget
 from typing import cast, Tuple
@@ -24,9 +27,22 @@ from typing import cast, Tuple
 class GLImage (GLWidget):
     def __init__ (self: 'GLImage', gl_major_version: int, gl_minor_version: int,
                   view_size: int = 512, create_histogram: bool = False,
-                  size: int = 300) -> None:
-        super ().__init__ (GLQuadRenderer (view_size, create_histogram, size),
+                  size: int = 300, name: str = "image") -> None:
+        super ().__init__ (GLQuadRenderer (view_size, create_histogram, size, name),
                            gl_major_version, gl_minor_version)
 
     def set_path (self: 'GLImage', path: str) -> None:
         cast (GLQuadRenderer, self.renderer).load_texture (path)
+
+    def set_image (self: 'GLImage', image: Image.Image) -> None:
+        cast (GLQuadRenderer, self.renderer).load_image (image)
+
+    def set_sectors (self: 'GLImage', widths: numpy.ndarray, centers: numpy.ndarray,
+                     use_sector_map: bool = False) -> None:
+        cast (GLQuadRenderer, self.renderer).set_sectors (widths, centers, use_sector_map)
+
+    def set_sector_map (self: 'GLImage', sector_map: numpy.ndarray) -> None:
+        cast (GLQuadRenderer, self.renderer).set_sector_map (sector_map)
+
+    def discard_sector_map (self: 'GLImage') -> None:
+        cast (GLQuadRenderer, self.renderer).discard_sector_map ()
@@ -16,71 +16,69 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 '''
 
+import functools
 import numpy
-import threading
 import warnings
 
 from OpenGL import GL
 from pyrr import Matrix44
+from gi.repository import GLib
 from PIL import Image
 from color_harmonization.gui.gl_widget import GLWidget, GLRenderer
-from color_harmonization import global_variables
+from color_harmonization.gui.texture_streamer import TextureStreamer
+from color_harmonization.gui.gl_timer import GLTimer
+from color_harmonization.gui import gl_histogram, shader_cache
+from color_harmonization import global_variables, tracing
+from color_harmonization.engine import harmonization, histogram, image_cache, loader_pool, \
+    pixels
+from typing import Any, Callable, Tuple
 
-DEBUG = False
+# sectors of the largest harmonic template
+MAX_SECTORS = 2
 
 class GLQuadRenderer (GLRenderer):
-    scale = 2**14
-    log_scale = numpy.log2 (256 * 2**14)
-
     def __init__ (self: 'GLQuadRenderer', view_size: int = 512,
-                  create_histogram: bool = False, size: int = 300) -> None:
+                  create_histogram: bool = False, size: int = 300,
+                  name: str = "image") -> None:
         super ().__init__ ()
+        self.__name = name
+        self.__timer = GLTimer (name)
         self.__do_harmonization = False
-        self.__new_texture = None # type: Image
+        self.__new_texture = None # type: numpy.ndarray
+        self.__new_sector_map = None # type: numpy.ndarray
+        self.__sector_map_loaded = False
+        self.__use_sector_map = False
+        # sectors the hue table texture was built for, and the ones it is
+        # rebuilt for at the next draw
+        self.__sectors = None # type: Tuple[numpy.ndarray, numpy.ndarray]
+        self.__new_sectors = None # type: Tuple[numpy.ndarray, numpy.ndarray]
+        self.__sector_count = 0
+        self.__sector_widths = numpy.zeros (MAX_SECTORS, dtype = numpy.float32)
+        self.__sector_centers = numpy.zeros (MAX_SECTORS, dtype = numpy.float32)
+        # path of the image whose histogram is built from the uploaded texture
+        self.__new_histogram_path = None # type: str
+        self.__histogram_path = None # type: str
+        self.__gpu_histogram = None # type: gl_histogram.GLHistogram
         self.__view_size = view_size
         self.__loaded = False
         self.__create_histogram = create_histogram
         self.__size = size
+        self.__streamer = TextureStreamer (self.__queue_draw, timer = self.__timer)
 
     def load (self: 'GLQuadRenderer') -> None:
         self.make_current ()
 
         GL.glDisable (GL.GL_CULL_FACE)
 
-        self.program = GL.glCreateProgram ()
-        self.vertex_shader = GL.glCreateShader (GL.GL_VERTEX_SHADER)
-        self.fragment_shader = GL.glCreateShader (GL.GL_FRAGMENT_SHADER)
-
-        vs_file = open ("color_harmonization/gui/glsl/vertex_shader.vsh", 'r')
-        vs_code = vs_file.read ()
-        vs_file.close ()
-        fs_file = open ("color_harmonization/gui/glsl/fragment_shader.fsh", 'r')
-        fs_code = fs_file.read ()
-        fs_file.close ()
-
-        GL.glShaderSource (self.vertex_shader, vs_code)
-        GL.glShaderSource (self.fragment_shader, fs_code)
-
-        GL.glCompileShader (self.vertex_shader)
-
-        if DEBUG:
-            error_log = GL.glGetShaderInfoLog (self.vertex_shader)
-            print ("Vertex shader: {}".format (error_log.decode ()))
-
-        GL.glCompileShader (self.fragment_shader)
-
-        if DEBUG:
-            error_log = GL.glGetShaderInfoLog (self.fragment_shader)
-            print ("Fragment shader: {}".format (error_log.decode ()))
+        if self.__create_histogram:
+            self.__gpu_histogram = gl_histogram.create (self.gl_widget.gl_area.get_context ())
 
-        GL.glAttachShader (self.program, self.vertex_shader)
-        GL.glAttachShader (self.program, self.fragment_shader)
-
-        GL.glLinkProgram (self.program)
-
-        if DEBUG:
-            error_log = GL.glGetProgramInfoLog (self.program)
-            print ("Program link: {}".format (error_log.decode ()))
+        # the program is shared by all GL areas of the window, so uniforms that
+        # differ between renderers are set again before every draw
+        self.program = shader_cache.get_program (
+            self.gl_widget.gl_area.get_context (), "quad",
+            "vertex_shader.vsh", "fragment_shader.fsh"
+        )
 
         self.array_buffer = GL.glGenBuffers (1)
         self.vertex_array = GL.glGenVertexArrays (1)
@@ -107,100 +105,227 @@ class GLQuadRenderer (GLRenderer):
         self.__uniform_world = GL.glGetUniformLocation (self.program, "WorldMatrix")
         self.__uniform_projection = GL.glGetUniformLocation (self.program, "ProjectionMatrix")
         self.__uniform_texture = GL.glGetUniformLocation (self.program, "Texture")
-        self.__uniform_data_texture = GL.glGetUniformLocation (self.program, "DataTexture")
+        self.__uniform_sector_texture = GL.glGetUniformLocation (self.program, "SectorTexture")
+        self.__uniform_sector_widths = GL.glGetUniformLocation (self.program, "SectorWidths")
+        self.__uniform_sector_centers = GL.glGetUniformLocation (self.program, "SectorCenters")
+        self.__uniform_sector_count = GL.glGetUniformLocation (self.program, "SectorCount")
+        self.__uniform_hue_table = GL.glGetUniformLocation (self.program, "HueTable")
+        self.__uniform_use_sector_map = GL.glGetUniformLocation (self.program, "UseSectorMap")
         self.__uniform_do_harmonization = GL.glGetUniformLocation (self.program, "DoHarmonization")
 
         self.__texture = 0
-        self.__data_texture = 0
+        self.__sector_size = (1, 1)
+        self.__sector_texture = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__sector_texture)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_R8UI, 1, 1, 0,
+                         GL.GL_RED_INTEGER, GL.GL_UNSIGNED_BYTE, numpy.zeros (1, dtype = numpy.uint8))
+        GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
+
+        # one row of (value, slope) pairs per sector, see harmonization.hue_table;
+        # read with texelFetch and interpolated in the shader
+        self.__hue_table_texture = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__hue_table_texture)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_RG32F, harmonization.HUE_TABLE_SIZE,
+                         MAX_SECTORS, 0, GL.GL_RG, GL.GL_FLOAT, None)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
 
         GL.glUniformMatrix4fv (self.__uniform_projection, 1, False,
                                Matrix44.orthogonal_projection (0, 1, 0, 1, 0, 1))
         GL.glUniform1i (self.__uniform_do_harmonization, self.__do_harmonization)
 
+    def __queue_draw (self: 'GLQuadRenderer') -> None:
+        self.gl_widget.gl_area.queue_draw ()
+
     def load_texture (self: 'GLQuadRenderer', path: str) -> None:
-        self.__image_loader_thread = threading.Thread (
-            target = self.__image_loader, args = [path]
+        priority = loader_pool.VISIBLE if self.gl_widget.get_mapped () else loader_pool.HIDDEN
+        loader_pool.default_pool.submit (
+            self, functools.partial (self.__image_loader, path), self.__image_loaded, priority
         )
-        self.__image_loader_thread.start ()
 
-    def __image_loader (self: 'GLQuadRenderer', path: str) -> None:
+    def __image_loader (self: 'GLQuadRenderer', path: str,
+                        is_cancelled: Callable[[], bool]) -> Tuple[Any, ...]:
         warnings.filterwarnings ('ignore')
-        with Image.open (path) as f:
-            f.thumbnail ((self.__view_size, self.__view_size))
-            img = f.convert ("RGBA")
+        pyramid = image_cache.default_cache.pyramid (path)
+        img = pyramid.view (self.__view_size)
+        warnings.filterwarnings ('default')
+
+        if is_cancelled ():
+            raise loader_pool.LoadCancelled ()
+
+        if not self.__create_histogram:
+            return img.size, pixels.texture_data (img), path, None, False
+
+        # the GPU builds the histogram once the texture is uploaded, unless
+        # it is known from an earlier session
+        hist = image_cache.stored_histogram (path, self.__view_size)
+        if hist is None and self.__gpu_histogram is not None:
+            return img.size, pixels.texture_data (img), path, None, True
+
+        if hist is None:
+            hist = image_cache.default_cache.histogram (path, self.__view_size)
+        return img.size, pixels.texture_data (img), path, hist, False
+
+    def __cpu_histogram (self: 'GLQuadRenderer', path: str,
+                         is_cancelled: Callable[[], bool]) -> numpy.ndarray:
+        return image_cache.default_cache.histogram (path, self.__view_size)
+
+    def load_image (self: 'GLQuadRenderer', image: Image.Image) -> None:
+        loader_pool.default_pool.submit (
+            self, functools.partial (self.__image_converter, image), self.__image_loaded,
+            loader_pool.VISIBLE
+        )
+
+    def __image_converter (self: 'GLQuadRenderer', image: Image.Image,
+                           is_cancelled: Callable[[], bool]) -> Tuple[Any, ...]:
+        # reduce first, so a full resolution image is never copied as a whole
+        factor = max (1, max (image.size) // self.__view_size)
+        view = image.reduce (factor) if factor > 1 else image.copy ()
+        view.thumbnail ((self.__view_size, self.__view_size))
+        return view.size, pixels.texture_data (view), None, None, False
+
+    def __image_loaded (self: 'GLQuadRenderer', result: Tuple[Any, ...]) -> None:
+        # the histogram is either loaded with the image or built on the GPU
+        # from the uploaded texture; either way it is tagged with its image
+        size, data, path, hist, build_histogram = result
+
+        if hist is not None:
+            global_variables.App.assistant.set_histogram (hist, path)
+
+        self.gl_widget.props.width_request = self.__size
+        self.gl_widget.props.height_request = size[1] / float (size[0]) * self.__size
+        self.__new_histogram_path = path if build_histogram else None
+        self.__new_texture = data
+
+        GLib.idle_add (self.__queue_draw)
+
+    def set_sectors (self: 'GLQuadRenderer', widths: numpy.ndarray, centers: numpy.ndarray,
+                     use_sector_map: bool = False) -> None:
+        # the hue table is rebuilt once per frame at most, however many motion
+        # events arrive in between
+        self.__new_sectors = (numpy.array (widths, dtype = numpy.float32),
+                              numpy.array (centers, dtype = numpy.float32))
+        self.__use_sector_map = use_sector_map
+        self.__do_harmonization = True
+
+        self.__queue_draw ()
+
+    def set_sector_map (self: 'GLQuadRenderer', sector_map: numpy.ndarray) -> None:
+        # one byte per pixel selects the sector, i.e. the row of the hue table
+        self.__new_sector_map = numpy.ascontiguousarray (sector_map, dtype = numpy.uint8)
+
+        GLib.idle_add (self.__queue_draw)
+
+    def discard_sector_map (self: 'GLQuadRenderer') -> None:
+        # the sectors of the map do not match the sectors any more, pixels
+        # take their nearest sector until a new map arrives
+        self.__new_sector_map = None
+        self.__sector_map_loaded = False
+
+    def __upload_sector_map (self: 'GLQuadRenderer') -> None:
+        sector_map = self.__new_sector_map
+        height, width = sector_map.shape
+
+        if (width, height) != (self.__image_width, self.__image_height):
+            return
 
-            if self.__create_histogram:
-                hsv = f.convert ("HSV")
-                h = hsv.getdata (band = 0)
-                s = hsv.getdata (band = 1)
+        self.__new_sector_map = None
 
-                hist = [0.0] * 256
-                for idx, hue in enumerate (h):
-                    hist[hue] += s[idx]
+        GL.glActiveTexture (GL.GL_TEXTURE1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__sector_texture)
+        GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, 1)
 
-                hist = numpy.log2 ([
-                    (val / (hsv.size[0] * hsv.size[1])) * GLQuadRenderer.scale + 1 for val in hist
-                ])
-                hist = [val / GLQuadRenderer.log_scale for val in hist]
+        if self.__sector_size == (width, height):
+            GL.glTexSubImage2D (GL.GL_TEXTURE_2D, 0, 0, 0, width, height,
+                                GL.GL_RED_INTEGER, GL.GL_UNSIGNED_BYTE, sector_map)
+        else:
+            GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_R8UI, width, height, 0,
+                             GL.GL_RED_INTEGER, GL.GL_UNSIGNED_BYTE, sector_map)
+            self.__sector_size = (width, height)
 
-                global_variables.App.assistant.set_histogram (hist)
+        self.__sector_map_loaded = True
 
-            self.__image_width = img.size[0]
-            self.__image_height = img.size[1]
-            self.gl_widget.props.width_request = self.__size
-            self.gl_widget.props.height_request = img.size[1] / float (img.size[0]) * self.__size
-            self.__new_texture = numpy.array (list (img.getdata ()), numpy.uint8)
-            warnings.filterwarnings ('default')
+    def __upload_hue_table (self: 'GLQuadRenderer') -> None:
+        widths, centers = sectors = self.__new_sectors
+        self.__new_sectors = None
 
-        timer = threading.Timer (0.01, self.gl_widget.gl_area.queue_draw)
-        timer.start ()
+        if self.__sectors is not None and all (
+                numpy.array_equal (old, new) for old, new in zip (self.__sectors, sectors)):
+            return
 
-        self.__loaded = True
+        self.__sectors = sectors
+        self.__sector_widths[:] = 0
+        self.__sector_centers[:] = 0
+        self.__sector_widths[:len (widths)] = widths
+        self.__sector_centers[:len (centers)] = centers
+        self.__sector_count = len (widths)
+
+        table = harmonization.hue_table (widths, centers)
+        # templates with a single sector leave the last row unused
+        rows = numpy.concatenate (
+            (table, numpy.repeat (table[-1:], MAX_SECTORS - len (table), axis = 0))
+        )
 
-    def __load_texture (self: 'GLQuadRenderer') -> None:
-        img_data = self.__new_texture
+        GL.glActiveTexture (GL.GL_TEXTURE2)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__hue_table_texture)
+        GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, 4)
+        GL.glTexSubImage2D (GL.GL_TEXTURE_2D, 0, 0, 0, harmonization.HUE_TABLE_SIZE,
+                            MAX_SECTORS, GL.GL_RG, GL.GL_FLOAT,
+                            numpy.ascontiguousarray (rows, dtype = numpy.float32))
+
+    def __histogram_loaded (self: 'GLQuadRenderer', path: str, hist: numpy.ndarray) -> None:
+        global_variables.App.assistant.set_histogram (hist, path)
+
+    def __build_histogram (self: 'GLQuadRenderer', path: str) -> None:
+        if self.__gpu_histogram is not None:
+            try:
+                with tracing.span ("histogram", backend = "gpu"):
+                    weights = self.__gpu_histogram.weights (
+                        self.__texture, self.__image_width, self.__image_height
+                    )
+                hist = histogram.log_scale (weights, self.__image_width * self.__image_height)
+                self.__histogram_loaded (path, hist)
+                loader_pool.default_pool.submit (
+                    (self, "store histogram"),
+                    lambda is_cancelled: image_cache.store_histogram (path, self.__view_size, hist),
+                    lambda result: None, loader_pool.PREFETCH
+                )
+                return
+            except GL.GLError as e:
+                print ("GPU histogram failed, using the CPU: {}".format (e))
+                self.__gpu_histogram = None
+
+        loader_pool.default_pool.submit (
+            (self, "histogram"), functools.partial (self.__cpu_histogram, path),
+            functools.partial (self.__histogram_loaded, path), loader_pool.VISIBLE
+        )
 
+    def __swap_texture (self: 'GLQuadRenderer', texture: int) -> None:
         GL.glActiveTexture (GL.GL_TEXTURE0)
         GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
 
         if self.__texture > 0:
             GL.glDeleteTextures ([self.__texture])
 
-        self.__texture = GL.glGenTextures (1)
-
-        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__texture)
-        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_RGBA,
-                         self.__image_width, self.__image_height, 0,
-                         GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, img_data)
-
-        GL.glGenerateMipmap (GL.GL_TEXTURE_2D)
-
-        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
-        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
-        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        self.__texture = texture
+        self.__image_width, self.__image_height = self.__streamer.size
+        self.__sector_map_loaded = False
+        self.__loaded = True
 
         self.resize (self.gl_widget.width, self.gl_widget.height)
 
         GL.glBindTexture (GL.GL_TEXTURE_2D, self.__texture)
         GL.glUniform1i (self.__uniform_texture, 0)
 
-        GL.glActiveTexture (GL.GL_TEXTURE1)
-        self.__data = numpy.zeros ((self.__image_width * self.__image_height, 4),
-                                   dtype = numpy.float32)
-
-        if self.__data_texture > 0:
-            GL.glDeleteTextures ([self.__data_texture])
-
-        self.__data_texture = GL.glGenTextures (1)
-        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__data_texture)
-        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_RGBA32F,
-                         self.__image_width, self.__image_height, 0,
-                         GL.GL_RGBA, GL.GL_FLOAT, self.__data)
-
-        GL.glGenerateMipmap (GL.GL_TEXTURE_2D)
-        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__data_texture)
-        GL.glUniform1i (self.__uniform_data_texture, 1)
+        if self.__histogram_path is not None:
+            self.__build_histogram (self.__histogram_path)
+            self.__histogram_path = None
 
     def resize (self: 'GLQuadRenderer', width: int, height: int) -> None:
         super ().resize (width, height)
@@ -224,20 +349,56 @@ class GLQuadRenderer (GLRenderer):
         GL.glUniformMatrix4fv (self.__uniform_world, 1, False, self.world)
 
     def render (self: 'GLQuadRenderer') -> None:
-        if not self.__loaded:
-            return
+        self.__timer.collect ()
 
+        with tracing.span ("draw", view = self.__name):
+            self.__render ()
+
+    def __render (self: 'GLQuadRenderer') -> None:
         if self.__new_texture is not None:
-            self.__load_texture ()
+            self.__streamer.start (self.__new_texture)
+            self.__histogram_path = self.__new_histogram_path
             self.__new_texture = None
 
+        if self.__streamer.busy:
+            texture = self.__streamer.step ()
+
+            if texture > 0:
+                self.__swap_texture (texture)
+            elif self.__streamer.needs_redraw:
+                self.gl_widget.gl_area.queue_draw ()
+
+        if not self.__loaded:
+            return
+
+        if self.__new_sector_map is not None:
+            self.__upload_sector_map ()
+
+        if self.__new_sectors is not None:
+            self.__upload_hue_table ()
+
         super ().render ()
 
+        GL.glUseProgram (self.program)
+        GL.glUniformMatrix4fv (self.__uniform_world, 1, False, self.world)
+        GL.glUniform1i (self.__uniform_do_harmonization, self.__do_harmonization)
+
         GL.glActiveTexture (GL.GL_TEXTURE0)
         GL.glBindTexture (GL.GL_TEXTURE_2D, self.__texture)
         GL.glActiveTexture (GL.GL_TEXTURE1)
-        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__data_texture)
-        GL.glDrawArrays (GL.GL_TRIANGLE_STRIP, 0, 4)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__sector_texture)
+        GL.glUniform1i (self.__uniform_sector_texture, 1)
+        GL.glActiveTexture (GL.GL_TEXTURE2)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__hue_table_texture)
+        GL.glUniform1i (self.__uniform_hue_table, 2)
+        GL.glUniform1fv (self.__uniform_sector_widths, MAX_SECTORS, self.__sector_widths)
+        GL.glUniform1fv (self.__uniform_sector_centers, MAX_SECTORS, self.__sector_centers)
+        GL.glUniform1i (self.__uniform_sector_count, self.__sector_count)
+        GL.glUniform1i (self.__uniform_use_sector_map,
+                        self.__use_sector_map and self.__sector_map_loaded)
+
+        with self.__timer.span ("draw"):
+            GL.glDrawArrays (GL.GL_TRIANGLE_STRIP, 0, 4)
 
     def update (self: 'GLQuadRenderer') -> None:
         super ().update ()
@@ -0,0 +1,73 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+from OpenGL import GL
+from typing import Any, List, Tuple
+from color_harmonization import tracing
+
+class _GLSpan:
+    def __init__ (self: '_GLSpan', timer: 'GLTimer', name: str) -> None:
+        self.__timer = timer
+        self.__name = name
+
+    def __enter__ (self: '_GLSpan') -> None:
+        self.__timer.begin (self.__name)
+
+    def __exit__ (self: '_GLSpan', *args: Any) -> None:
+        self.__timer.end ()
+
+class GLTimer:
+    # GL_TIME_ELAPSED queries of one context, read back once the GPU has
+    # finished them, so timing never stalls the pipeline. The queries only
+    # measure durations; a GPU span is placed at the time it was submitted.
+    def __init__ (self: 'GLTimer', label: str) -> None:
+        self.__thread = "GPU " + label
+        self.__free = [] # type: List[int]
+        self.__pending = [] # type: List[Tuple[int, str, float]]
+        self.__active = None # type: Tuple[int, str, float]
+
+    def span (self: 'GLTimer', name: str) -> Any:
+        # must be entered and left with the context current, spans do not nest
+        if not tracing.enabled:
+            return tracing.NULL_SPAN
+
+        return _GLSpan (self, name)
+
+    def begin (self: 'GLTimer', name: str) -> None:
+        query = self.__free.pop () if self.__free else int (GL.glGenQueries (1))
+        GL.glBeginQuery (GL.GL_TIME_ELAPSED, query)
+        self.__active = (query, name, tracing.now ())
+
+    def end (self: 'GLTimer') -> None:
+        GL.glEndQuery (GL.GL_TIME_ELAPSED)
+        self.__pending.append (self.__active)
+        self.__active = None
+
+    def collect (self: 'GLTimer') -> None:
+        # queries complete in submission order
+        while self.__pending:
+            query, name, start = self.__pending[0]
+
+            if not GL.glGetQueryObjectiv (query, GL.GL_QUERY_RESULT_AVAILABLE):
+                break
+
+            elapsed = GL.glGetQueryObjectui64v (query, GL.GL_QUERY_RESULT)
+            tracing.complete (name, "gpu", start, int (elapsed) / 1000, thread = self.__thread)
+            self.__pending.pop (0)
+            self.__free.append (query)
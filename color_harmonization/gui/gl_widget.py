@@ -17,10 +17,17 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 '''
 
 import abc
+import time
 
 from gi.repository import Gtk, Gdk
 from OpenGL import GL
 
+# frames further apart than this belong to different bursts of redraws and
+# are not counted for the frame rate
+FRAME_GAP = 0.5
+# how often the frame time readout is refreshed, in seconds
+READOUT_INTERVAL = 0.25
+
 class GLRenderer (metaclass = abc.ABCMeta):
     @property
     def gl_widget (self: 'GLRenderer') -> 'GLWidget':
@@ -73,8 +80,45 @@ class GLWidget (Gtk.Overlay):
         self.__width = 400
         self.__height = 300
 
+        self.__frame_time_label = None # type: Gtk.Label
+        self.__last_frame = 0.0
+        self.__last_readout = 0.0
+        self.__frame_interval = 0.0
+        self.__render_time = 0.0
+
+    def show_frame_time (self: 'GLWidget') -> None:
+        # an overlay with the frame rate of the latest redraws and the CPU
+        # time spent in the renderer per frame
+        if self.__frame_time_label is not None:
+            return
+
+        self.__frame_time_label = Gtk.Label ()
+        self.__frame_time_label.props.halign = Gtk.Align.START
+        self.__frame_time_label.props.valign = Gtk.Align.START
+        self.__frame_time_label.get_style_context ().add_class ("osd")
+        self.add_overlay (self.__frame_time_label)
+        self.__frame_time_label.show ()
+
     def __handle_render (self: 'GLWidget', gl_area: Gtk.GLArea, context: Gdk.GLContext) -> None:
+        if self.__frame_time_label is None:
+            self.renderer.render ()
+            return
+
+        start = time.perf_counter ()
         self.renderer.render ()
+        end = time.perf_counter ()
+
+        # exponential moving averages over the last few frames
+        self.__render_time += 0.1 * ((end - start) - self.__render_time)
+        if start - self.__last_frame < FRAME_GAP:
+            self.__frame_interval += 0.1 * ((start - self.__last_frame) - self.__frame_interval)
+        self.__last_frame = start
+
+        if end - self.__last_readout >= READOUT_INTERVAL and self.__frame_interval > 0:
+            self.__last_readout = end
+            self.__frame_time_label.set_text ("{:.0f} fps, {:.2f} ms render".format (
+                1 / self.__frame_interval, 1000 * self.__render_time
+            ))
 
     def __handle_realize (self: 'GLWidget', gl_area: Gtk.GLArea) -> None:
         self.renderer.load ()
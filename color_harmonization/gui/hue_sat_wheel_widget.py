@@ -18,15 +18,20 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import math
 import numpy
-import colorsys
+import collections
 import cairocffi
 import cairo
 
-from gi.repository import Gtk, Gdk
-from typing import List, Any
+from gi.repository import Gtk, Gdk, GObject
+from typing import Tuple
+from color_harmonization.engine import ring, templates
 
 DEFAULT_SIZE = 200
 DEFAULT_RING_WIDTH = 10
+RING_SURFACE_CACHE_SIZE = 8
+
+# rendered rings shared by all wheels, keyed by (size, ring width, histogram id, fg color)
+_ring_surfaces = collections.OrderedDict () # type: collections.OrderedDict
 
 def _UNSAFE_pycairo_context_to_cairocffi (pycairo_context):
     # Sanity check. Continuing with another type would probably segfault.
@@ -55,19 +60,16 @@ def _UNSAFE_pycairo_context_to_cairocffi (pycairo_context):
 
 class HueSatWheelWidget (Gtk.Misc):
     __gtype_name__ = "HueSatWheelWidget"
-
-    sectors = {
-        "i-type": ([0.05], [0.]),
-        "V-type": ([0.26], [0.]),
-        "L-type": ([0.05, 0.22], [0., 0.25]),
-        "I-type": ([0.05, 0.05], [0., 0.5]),
-        "T-type": ([0.5], [0.]),
-        "Y-type": ([0.26, 0.05], [0., 0.5]),
-        "X-type": ([0.26, 0.26], [0., 0.5])
+    __gsignals__ = {
+        # emitted for every step of a drag and once when the drag ends
+        "rotation-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "rotation-finished": (GObject.SignalFlags.RUN_FIRST, None, ())
     }
 
+    sectors = templates.TEMPLATES
+
     def __init__ (self: 'HueSatWheelWidget', *args, **kwargs) -> None:
-        self.__hist = [0.0] * 256
+        self.__hist = numpy.zeros (256)
         self.ring_width = kwargs["ring-width"] if "ring-width" in kwargs else DEFAULT_RING_WIDTH
         self.size = kwargs["size"] if "size" in kwargs else DEFAULT_SIZE
         self.sector = kwargs["sector"] if "sector" in kwargs else HueSatWheelWidget.sectors["i-type"]
@@ -81,8 +83,6 @@ class HueSatWheelWidget (Gtk.Misc):
         self.__dragging = False
         self.__first_move = False
         self.__rotation_offset = 0.0
-        self.__temp_size = 0
-        self.__redraw = False
 
         super ().__init__ (*args, **kwargs)
         self.set_size_request (self.size, self.size)
@@ -136,6 +136,7 @@ class HueSatWheelWidget (Gtk.Misc):
             self.rotation = (angle - numpy.pi / 2) + self.__rotation_offset
 
             self.queue_draw ()
+            self.emit ("rotation-changed")
 
         return False
 
@@ -147,61 +148,24 @@ class HueSatWheelWidget (Gtk.Misc):
 
     def on_button_release (self: 'HueSatWheelWidget',
                            widget: 'HueSatWheelWidget', event: Gdk.EventButton) -> bool:
+        moved = self.__dragging and not self.__first_move
         self.__dragging = False
         self.__first_move = False
+
+        if moved:
+            self.emit ("rotation-finished")
+
         return True
 
     def __draw_ring (self: 'HueSatWheelWidget', cr: cairocffi.Context,
                      width: int, height: int, center_x: float, center_y: float,
-                     outer: float, inner: float) -> None:
-        self.__redraw = False
+                     outer: float, inner: float, fg_color: Tuple[float, ...]) -> None:
+        buf = ring.rasterize_ring (width, outer, inner, self.__hist)
         stride = cairocffi.ImageSurface.format_stride_for_width (cairocffi.FORMAT_ARGB32, width)
-        buf = numpy.empty (int (height * stride), dtype = numpy.uint8)
-
-        for y in range (height):
-            idx = y * width * 4
-
-            dy = -(y - center_y)
-
-            for x in range (width):
-                dx = x - center_x
-
-                dist = dx * dx + dy * dy
-
-                angle = math.atan2 (dy, dx)
-
-                if angle < 0:
-                    angle += 2 * numpy.pi
-
-                hue = angle / (2 * numpy.pi)
-
-                hue_idx = int ((angle + 2 * numpy.pi / 3) / (2 * numpy.pi) * 255)
-                hue_idx = hue_idx % 256
-
-                if dist < ((inner - 1) ** 2) * (1 - self.__hist[255 - hue_idx]) or \
-                   dist > ((outer + 1) ** 2):
-                    buf[idx + 0] = 0
-                    buf[idx + 1] = 0
-                    buf[idx + 2] = 0
-                    buf[idx + 3] = 0
-                    idx += 4
-                    continue
-
-                r, g, b = colorsys.hsv_to_rgb (hue, 1.0, 1.0)
-                a = 255
-
-                buf[idx + 0] = int (math.floor (r * 255 + 0.5))
-                buf[idx + 1] = int (math.floor (g * 255 + 0.5))
-                buf[idx + 2] = int (math.floor (b * 255 + 0.5))
-                buf[idx + 3] = a
-                idx += 4
-
         source = cairocffi.ImageSurface.create_for_data (
             memoryview (buf), cairocffi.FORMAT_ARGB32, width, height, stride
         )
 
-        fg_color = self.get_style_context ().get_color (Gtk.StateFlags.NORMAL)
-
         cr.save ()
 
         cr.set_source_rgba (0, 0, 0, 0)
@@ -226,6 +190,28 @@ class HueSatWheelWidget (Gtk.Misc):
 
         cr.restore ()
 
+    def __ring_surface (self: 'HueSatWheelWidget') -> cairocffi.ImageSurface:
+        fg_color = tuple (self.get_style_context ().get_color (Gtk.StateFlags.NORMAL))
+        key = (self.size, self.ring_width, id (self.__hist), fg_color)
+
+        if key in _ring_surfaces:
+            _ring_surfaces.move_to_end (key)
+            return _ring_surfaces[key][1]
+
+        outer = (self.size - 4) / 2.
+        inner = outer - self.ring_width
+
+        surface = cairocffi.ImageSurface (cairocffi.FORMAT_ARGB32, self.size, self.size)
+        self.__draw_ring (cairocffi.Context (surface), self.size, self.size,
+                          self.size / 2, self.size / 2, outer, inner, fg_color)
+
+        # the histogram is kept alive with its surface so that its id stays unique
+        _ring_surfaces[key] = (self.__hist, surface)
+        while len (_ring_surfaces) > RING_SURFACE_CACHE_SIZE:
+            _ring_surfaces.popitem (last = False)
+
+        return surface
+
     def do_draw (self: 'HueSatWheelWidget', pycairo_cr: cairo.Context) -> bool:
         cr = _UNSAFE_pycairo_context_to_cairocffi (pycairo_cr)
 
@@ -234,23 +220,11 @@ class HueSatWheelWidget (Gtk.Misc):
         center_x = width / 2.
         center_y = height / 2.
 
-        if self.size != self.__temp_size or self.__redraw:
-            outer = (self.size - 4) / 2.
-            inner = outer - self.ring_width
-
-            self.surface = cr.get_target ().create_similar (
-                cairocffi.CONTENT_COLOR_ALPHA, self.size, self.size
-            )
-            context = cairocffi.Context (self.surface)
-
-            self.__draw_ring (context, self.size, self.size,
-                              self.size / 2, self.size / 2, outer, inner)
-
-            self.__temp_size = self.size
+        surface = self.__ring_surface ()
 
         cr.save ()
         cr.translate (center_x - self.size / 2, center_y - self.size / 2)
-        cr.set_source_surface (self.surface)
+        cr.set_source_surface (surface)
         cr.paint ()
         cr.restore ()
         self.__draw_sector (cr, center_x, center_y)
@@ -258,11 +232,13 @@ class HueSatWheelWidget (Gtk.Misc):
         return False
 
     @property
-    def histogram (self: 'HueSatWheelWidget') -> List[float]:
+    def histogram (self: 'HueSatWheelWidget') -> numpy.ndarray:
         return self.__hist
 
     @histogram.setter
-    def histogram (self: 'HueSatWheelWidget', value: List[float]) -> None:
-        self.__redraw = True
-        self.queue_draw ()
+    def histogram (self: 'HueSatWheelWidget', value: numpy.ndarray) -> None:
         self.__hist = value
+
+        # hidden stack children get drawn from the shared cache once they are mapped
+        if self.get_mapped ():
+            self.queue_draw ()
@@ -0,0 +1,97 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import gettext
+import io
+import os
+from xml.etree import ElementTree
+from gi.repository import Gio, Gtk
+from typing import Callable, Dict, Iterable
+
+PACKAGE_PATH = os.path.dirname (os.path.abspath (__file__))
+BUNDLE_PATH = os.path.join (PACKAGE_PATH, "color-harmonization.gresource")
+RESOURCE_PREFIX = "/org/color-harmonization"
+ICON_PATH = RESOURCE_PREFIX + "/icons"
+DOMAIN = "color_harmonization"
+
+# attributes of the glade file that only gettext tooling needs
+TRANSLATION_ATTRIBUTES = ("translatable", "context", "comments")
+
+_resource = None # type: Gio.Resource
+_glade = {} # type: Dict[Callable[[str], str], str]
+
+def register () -> None:
+    # the bundle is built by `make resources`; without it every file is read
+    # from the package directory instead
+    global _resource
+
+    if _resource is not None or not os.path.isfile (BUNDLE_PATH):
+        return
+
+    _resource = Gio.Resource.load (BUNDLE_PATH)
+    Gio.resources_register (_resource)
+
+def read_bytes (name: str) -> bytes:
+    if _resource is not None:
+        try:
+            return _resource.lookup_data (
+                RESOURCE_PREFIX + "/" + name, Gio.ResourceLookupFlags.NONE
+            ).get_data ()
+        except Exception:
+            pass
+
+    with open (os.path.join (PACKAGE_PATH, *name.split ("/")), 'rb') as f:
+        return f.read ()
+
+def add_icons () -> None:
+    theme = Gtk.IconTheme.get_default ()
+
+    if _resource is not None:
+        theme.add_resource_path (ICON_PATH)
+    else:
+        theme.append_search_path (os.path.join (PACKAGE_PATH, "icon"))
+
+def translation (languages: Iterable[str]) -> gettext.NullTranslations:
+    for language in languages:
+        try:
+            data = read_bytes ("locale/%s/LC_MESSAGES/%s.mo" % (language, DOMAIN))
+        except OSError:
+            continue
+
+        return gettext.GNUTranslations (io.BytesIO (data))
+
+    return gettext.NullTranslations ()
+
+def glade (translate: Callable[[str], str]) -> str:
+    # Gtk.Builder looks translations up through the process wide text domain,
+    # which does not see the bundle, so the strings are translated here once
+    # and every builder parses the already translated interface
+    if translate not in _glade:
+        root = ElementTree.fromstring (read_bytes ("color-harmonization.glade"))
+
+        for element in root.iter ():
+            if element.get ("translatable") == "yes" and element.text:
+                element.text = translate (element.text)
+
+            for attribute in TRANSLATION_ATTRIBUTES:
+                element.attrib.pop (attribute, None)
+
+        _glade[translate] = ElementTree.tostring (root, encoding = "unicode")
+
+    return _glade[translate]
@@ -0,0 +1,201 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import hashlib
+import os
+import tempfile
+import numpy
+
+from OpenGL import GL
+from gi.repository import Gdk, GLib
+from typing import Any, Dict, Tuple
+from color_harmonization.gui import resources
+
+DEBUG = False
+
+CACHE_PATH = os.path.join (GLib.get_user_cache_dir (), "color-harmonization", "programs")
+
+# Binaries kept per program across drivers, e.g. for machines switching GPUs.
+MAX_DRIVERS = 4
+
+# Programs already linked, per group of contexts sharing their objects.
+_programs = {} # type: Dict[Tuple[Any, str], int]
+_sources = {} # type: Dict[str, str]
+
+def read_source (filename: str) -> str:
+    if filename not in _sources:
+        _sources[filename] = resources.read_bytes ("glsl/" + filename).decode ()
+
+    return _sources[filename]
+
+def share_group (context: Gdk.GLContext) -> Any:
+    # every GLArea context of a window shares with the window's paint
+    # context, so the root of the sharing chain identifies the share group
+    while context.get_shared_context () is not None:
+        context = context.get_shared_context ()
+
+    return context
+
+def driver_key () -> str:
+    digest = hashlib.sha256 ()
+
+    for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION, GL.GL_SHADING_LANGUAGE_VERSION):
+        digest.update (GL.glGetString (name) or b"")
+        digest.update (b"\0")
+
+    return digest.hexdigest ()[:16]
+
+def _compile_shader (kind: int, source: str, label: str) -> int:
+    shader = GL.glCreateShader (kind)
+    GL.glShaderSource (shader, source)
+    GL.glCompileShader (shader)
+
+    if DEBUG:
+        error_log = GL.glGetShaderInfoLog (shader)
+        print ("{}: {}".format (label, error_log.decode ()))
+
+    return shader
+
+def _link_program (vs_code: str, fs_code: str, retrievable: bool) -> int:
+    program = GL.glCreateProgram ()
+    vertex_shader = _compile_shader (GL.GL_VERTEX_SHADER, vs_code, "Vertex shader")
+    fragment_shader = _compile_shader (GL.GL_FRAGMENT_SHADER, fs_code, "Fragment shader")
+
+    GL.glAttachShader (program, vertex_shader)
+    GL.glAttachShader (program, fragment_shader)
+
+    if retrievable:
+        GL.glProgramParameteri (program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+
+    GL.glLinkProgram (program)
+
+    if DEBUG:
+        error_log = GL.glGetProgramInfoLog (program)
+        print ("Program link: {}".format (error_log.decode ()))
+
+    GL.glDetachShader (program, vertex_shader)
+    GL.glDetachShader (program, fragment_shader)
+    GL.glDeleteShader (vertex_shader)
+    GL.glDeleteShader (fragment_shader)
+
+    return program
+
+def binary_supported () -> bool:
+    # contexts without ARB_get_program_binary reject the query
+    try:
+        return GL.glGetIntegerv (GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+    except GL.GLError:
+        return False
+
+def _binary_path (name: str, driver: str, source_key: str) -> str:
+    return os.path.join (CACHE_PATH, "{}-{}-{}.bin".format (name, driver, source_key))
+
+def _remove (path: str) -> None:
+    # other instances of the application prune the same cache
+    try:
+        os.remove (path)
+    except OSError:
+        pass
+
+def _prune_binaries (name: str, driver: str, keep: str) -> None:
+    # older sources for this driver are dead, other drivers' binaries are
+    # only capped so that switching between GPUs keeps both cached
+    entries = []
+    for entry in os.listdir (CACHE_PATH):
+        path = os.path.join (CACHE_PATH, entry)
+        if not entry.startswith (name + "-") or not entry.endswith (".bin") or path == keep:
+            continue
+        if entry.startswith ("{}-{}-".format (name, driver)):
+            _remove (path)
+            continue
+        try:
+            entries.append ((os.path.getmtime (path), path))
+        except OSError:
+            pass
+
+    entries.sort (reverse = True)
+    for _, path in entries[MAX_DRIVERS - 1:]:
+        _remove (path)
+
+def _load_binary (name: str, driver: str, source_key: str) -> int:
+    path = _binary_path (name, driver, source_key)
+
+    try:
+        with open (path, 'rb') as f:
+            data = f.read ()
+    except OSError:
+        return 0
+
+    program = GL.glCreateProgram ()
+    binary_format = int.from_bytes (data[:4], 'little')
+    GL.glProgramBinary (program, binary_format, data[4:], len (data) - 4)
+
+    if GL.glGetProgramiv (program, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+        # the driver rejected its own binary (e.g. after an update), rebuild it
+        GL.glDeleteProgram (program)
+        _remove (path)
+        return 0
+
+    return program
+
+def _store_binary (name: str, driver: str, source_key: str, program: int) -> None:
+    length = GL.glGetProgramiv (program, GL.GL_PROGRAM_BINARY_LENGTH)
+    if length <= 0:
+        return
+
+    binary = numpy.empty (length, dtype = numpy.uint8)
+    written = numpy.zeros (1, dtype = numpy.int32)
+    binary_format = numpy.zeros (1, dtype = numpy.uint32)
+    GL.glGetProgramBinary (program, length, written, binary_format, binary)
+
+    os.makedirs (CACHE_PATH, exist_ok = True)
+    path = _binary_path (name, driver, source_key)
+
+    fd, temp = tempfile.mkstemp (dir = CACHE_PATH)
+    with os.fdopen (fd, 'wb') as f:
+        f.write (int (binary_format[0]).to_bytes (4, 'little'))
+        f.write (binary[:int (written[0])].tobytes ())
+    os.replace (temp, path)
+
+    _prune_binaries (name, driver, path)
+
+def get_program (context: Gdk.GLContext, name: str,
+                 vertex_file: str, fragment_file: str) -> int:
+    vs_code = read_source (vertex_file)
+    fs_code = read_source (fragment_file)
+    group = share_group (context)
+    source_key = hashlib.sha256 ((vs_code + "\0" + fs_code).encode ()).hexdigest ()
+
+    if (group, source_key) in _programs:
+        return _programs[(group, source_key)]
+
+    use_binary = binary_supported ()
+    driver = driver_key ()
+    program = _load_binary (name, driver, source_key) if use_binary else 0
+
+    if program == 0:
+        program = _link_program (vs_code, fs_code, use_binary)
+
+        if use_binary and GL.glGetProgramiv (program, GL.GL_LINK_STATUS) == GL.GL_TRUE:
+            try:
+                _store_binary (name, driver, source_key, program)
+            except OSError:
+                pass
+
+    _programs[(group, source_key)] = program
+    return program
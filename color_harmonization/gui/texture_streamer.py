@@ -0,0 +1,198 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import ctypes
+import threading
+import numpy
+
+from OpenGL import GL
+from gi.repository import GLib
+from typing import Any, Callable
+from color_harmonization import tracing
+from color_harmonization.engine import pixels
+from color_harmonization.gui.gl_timer import GLTimer
+
+# Rows are uploaded from the pixel buffer in slices of about this many bytes per
+# frame, so a large image never stalls a single frame.
+BYTES_PER_FRAME = 4 * 1024 * 1024
+
+IDLE, COPYING, UPLOADING, FENCED = range (4)
+
+class TextureStreamer:
+    def __init__ (self: 'TextureStreamer', redraw: Callable[[], Any],
+                  bytes_per_frame: int = BYTES_PER_FRAME, timer: GLTimer = None) -> None:
+        self.__redraw = redraw
+        self.__timer = timer
+        self.__bytes_per_frame = bytes_per_frame
+        self.__state = IDLE
+        self.__pending = None # type: numpy.ndarray
+        self.__data = None # type: numpy.ndarray
+        self.__buffer = 0
+        self.__texture = 0
+        self.__fence = None # type: Any
+        self.__row = 0
+        self.__copied = threading.Event ()
+
+    @property
+    def busy (self: 'TextureStreamer') -> bool:
+        return self.__state != IDLE or self.__pending is not None
+
+    @property
+    def needs_redraw (self: 'TextureStreamer') -> bool:
+        # while copying, the copy thread queues the next frame itself
+        return self.__state in (UPLOADING, FENCED) or \
+            (self.__pending is not None and self.__state != COPYING)
+
+    @property
+    def size (self: 'TextureStreamer') -> tuple:
+        return self.__data.shape[1], self.__data.shape[0]
+
+    def start (self: 'TextureStreamer', data: numpy.ndarray) -> None:
+        # a newer image supersedes the one in flight at the next step
+        self.__pending = data
+
+    def step (self: 'TextureStreamer') -> int:
+        if self.__pending is not None and self.__state != COPYING:
+            self.__abort ()
+            self.__begin (self.__pending)
+            self.__pending = None
+            return 0
+
+        if self.__state == COPYING:
+            if self.__copied.is_set ():
+                self.__finish_copy ()
+        elif self.__state == UPLOADING:
+            self.__upload_rows ()
+        elif self.__state == FENCED:
+            status = GL.glClientWaitSync (self.__fence, 0, 0)
+
+            if status in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+                return self.__complete ()
+
+        return 0
+
+    def __format (self: 'TextureStreamer') -> int:
+        return GL.GL_RGBA if self.__data.shape[2] == 4 else GL.GL_RGB
+
+    def __begin (self: 'TextureStreamer', data: numpy.ndarray) -> None:
+        self.__data = data
+        self.__row = 0
+        width, height = self.size
+
+        self.__texture = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__texture)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, width, height, 0,
+                         self.__format (), GL.GL_UNSIGNED_BYTE, None)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
+
+        self.__buffer = GL.glGenBuffers (1)
+        GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, self.__buffer)
+        GL.glBufferData (GL.GL_PIXEL_UNPACK_BUFFER, data.nbytes, None, GL.GL_STREAM_DRAW)
+        pointer = GL.glMapBufferRange (GL.GL_PIXEL_UNPACK_BUFFER, 0, data.nbytes,
+                                       GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT)
+        GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        # the mapped buffer is filled off the GL thread, it is only unmapped
+        # again once the copy is done
+        address = int (getattr (pointer, "value", pointer))
+        self.__copied.clear ()
+        self.__state = COPYING
+        threading.Thread (target = self.__copy, args = [address, data]).start ()
+
+    def __copy (self: 'TextureStreamer', address: int, data: numpy.ndarray) -> None:
+        with tracing.span ("texture copy", bytes = data.nbytes):
+            ctypes.memmove (address, data.ctypes.data, data.nbytes)
+        self.__copied.set ()
+        GLib.idle_add (self.__redraw)
+
+    def __finish_copy (self: 'TextureStreamer') -> None:
+        GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, self.__buffer)
+        intact = GL.glUnmapBuffer (GL.GL_PIXEL_UNPACK_BUFFER)
+        GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+        if not intact:
+            # the driver lost the mapped storage, fall back to a direct upload
+            GL.glDeleteBuffers (1, [self.__buffer])
+            self.__buffer = 0
+
+        self.__state = UPLOADING
+
+    def __upload_rows (self: 'TextureStreamer') -> None:
+        width, height = self.size
+        row_bytes = self.__data.strides[0]
+        rows = max (1, self.__bytes_per_frame // row_bytes)
+        rows = min (rows, height - self.__row)
+
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__texture)
+        GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, pixels.unpack_alignment (self.__data))
+
+        if self.__buffer > 0:
+            GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, self.__buffer)
+            source = ctypes.c_void_p (self.__row * row_bytes) # type: Any
+        else:
+            source = self.__data[self.__row:self.__row + rows]
+
+        with tracing.span ("texture upload", rows = rows), self.__gpu_span ("texture upload"):
+            GL.glTexSubImage2D (GL.GL_TEXTURE_2D, 0, 0, self.__row, width, rows,
+                                self.__format (), GL.GL_UNSIGNED_BYTE, source)
+        GL.glBindBuffer (GL.GL_PIXEL_UNPACK_BUFFER, 0)
+        self.__row += rows
+
+        if self.__row >= height:
+            with self.__gpu_span ("mipmap generation"):
+                GL.glGenerateMipmap (GL.GL_TEXTURE_2D)
+            self.__fence = GL.glFenceSync (GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            GL.glFlush ()
+            self.__state = FENCED
+
+        GL.glBindTexture (GL.GL_TEXTURE_2D, 0)
+
+    def __gpu_span (self: 'TextureStreamer', name: str) -> Any:
+        if self.__timer is None:
+            return tracing.NULL_SPAN
+
+        return self.__timer.span (name)
+
+    def __release (self: 'TextureStreamer') -> None:
+        if self.__fence is not None:
+            GL.glDeleteSync (self.__fence)
+            self.__fence = None
+
+        if self.__buffer > 0:
+            GL.glDeleteBuffers (1, [self.__buffer])
+            self.__buffer = 0
+
+    def __complete (self: 'TextureStreamer') -> int:
+        texture = self.__texture
+        self.__release ()
+        self.__texture = 0
+        self.__state = IDLE
+        return texture
+
+    def __abort (self: 'TextureStreamer') -> None:
+        if self.__state == IDLE:
+            return
+
+        self.__release ()
+        GL.glDeleteTextures ([self.__texture])
+        self.__texture = 0
+        self.__state = IDLE
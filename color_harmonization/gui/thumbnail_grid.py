@@ -0,0 +1,305 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import collections
+import functools
+import math
+import threading
+import numpy
+
+from OpenGL import GL
+from gi.repository import Gtk, Gdk, GLib
+from typing import Callable, Dict, List, Set, Tuple
+from color_harmonization.gui.gl_widget import GLWidget, GLRenderer
+from color_harmonization.gui import shader_cache
+from color_harmonization.engine import image_cache, loader_pool, pixels
+
+ATLAS_SIZE = 2048
+CELL_SIZE = 128
+SLOTS_PER_ROW = ATLAS_SIZE // CELL_SIZE
+SLOTS = SLOTS_PER_ROW * SLOTS_PER_ROW
+
+# rows above and below the visible ones that are decoded ahead of scrolling
+MARGIN_ROWS = 2
+
+class ThumbnailGridRenderer (GLRenderer):
+    def __init__ (self: 'ThumbnailGridRenderer', columns: int = 3, size: int = 100,
+                  spacing: int = 8) -> None:
+        super ().__init__ ()
+        self.columns = columns
+        self.size = size
+        self.spacing = spacing
+        self.scroll = 0.0
+        self.__paths = [] # type: List[str]
+        self.__generation = 0
+
+        # atlas slot of every thumbnail index, in least recently drawn order
+        self.__slots = collections.OrderedDict () # type: collections.OrderedDict
+        self.__thumbnail_sizes = {} # type: Dict[int, Tuple[int, int]]
+        self.__requested = set () # type: Set[int]
+        self.__decoded = [] # type: List[Tuple[int, int, numpy.ndarray]]
+        self.__lock = threading.Lock ()
+        self.__atlas = 0
+
+    @property
+    def paths (self: 'ThumbnailGridRenderer') -> List[str]:
+        return self.__paths
+
+    @paths.setter
+    def paths (self: 'ThumbnailGridRenderer', value: List[str]) -> None:
+        with self.__lock:
+            self.__paths = list (value)
+            self.__generation += 1
+            self.__decoded = []
+            self.__requested = set ()
+            self.__slots.clear ()
+            self.__thumbnail_sizes = {}
+
+        self.scroll = 0.0
+
+    @property
+    def row_height (self: 'ThumbnailGridRenderer') -> int:
+        return self.size + self.spacing
+
+    @property
+    def content_height (self: 'ThumbnailGridRenderer') -> int:
+        rows = math.ceil (len (self.__paths) / self.columns)
+        return max (0, rows * self.row_height - self.spacing)
+
+    def load (self: 'ThumbnailGridRenderer') -> None:
+        self.make_current ()
+
+        self.program = shader_cache.get_program (
+            self.gl_widget.gl_area.get_context (), "thumbnail",
+            "thumbnail_vertex_shader.vsh", "thumbnail_fragment_shader.fsh"
+        )
+
+        self.array_buffer = GL.glGenBuffers (1)
+        self.vertex_array = GL.glGenVertexArrays (1)
+        data = numpy.array ([0.0, 0.0, 1.0, 0.0, 0.0, 1.0, 1.0, 1.0], dtype = numpy.float32)
+
+        GL.glBindVertexArray (self.vertex_array)
+        GL.glBindBuffer (GL.GL_ARRAY_BUFFER, self.array_buffer)
+        GL.glBufferData (GL.GL_ARRAY_BUFFER, data.nbytes, data, GL.GL_STATIC_DRAW)
+        GL.glEnableVertexAttribArray (0)
+        GL.glVertexAttribPointer (0, 2, GL.GL_FLOAT, False, 8, GL.ctypes.c_void_p (0))
+
+        self.__uniform_rect = GL.glGetUniformLocation (self.program, "Rect")
+        self.__uniform_tex_rect = GL.glGetUniformLocation (self.program, "TexRect")
+        self.__uniform_view_size = GL.glGetUniformLocation (self.program, "ViewSize")
+        self.__uniform_atlas = GL.glGetUniformLocation (self.program, "Atlas")
+
+        self.__atlas = GL.glGenTextures (1)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__atlas)
+        GL.glTexImage2D (GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, ATLAS_SIZE, ATLAS_SIZE, 0,
+                         GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri (GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+        GL.glEnable (GL.GL_BLEND)
+        GL.glBlendFunc (GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+    def __visible_range (self: 'ThumbnailGridRenderer', margin: int) -> range:
+        first = int (self.scroll // self.row_height) - margin
+        last = int ((self.scroll + self.gl_widget.height) // self.row_height) + margin
+        return range (max (0, first * self.columns),
+                      min (len (self.__paths), (last + 1) * self.columns))
+
+    def __decode (self: 'ThumbnailGridRenderer', generation: int, path: str,
+                  is_cancelled: Callable[[], bool]) -> numpy.ndarray:
+        # is_cancelled takes the lock of the pool, which delivers results to
+        # __decoded_thumbnail; it must not be called with the grid lock held
+        with self.__lock:
+            current = generation == self.__generation
+
+        if not current or is_cancelled ():
+            raise loader_pool.LoadCancelled ()
+
+        try:
+            return pixels.texture_data (image_cache.load_thumbnail (path, CELL_SIZE))
+        except OSError:
+            return numpy.zeros ((1, 1, 4), dtype = numpy.uint8)
+
+    def __decoded_thumbnail (self: 'ThumbnailGridRenderer', generation: int, index: int,
+                             data: numpy.ndarray) -> None:
+        with self.__lock:
+            if generation == self.__generation:
+                self.__decoded.append ((generation, index, data))
+
+        GLib.idle_add (self.gl_widget.gl_area.queue_draw)
+
+    def __request (self: 'ThumbnailGridRenderer', indices: range, priority: int) -> None:
+        with self.__lock:
+            missing = [
+                idx for idx in indices if idx not in self.__slots and idx not in self.__requested
+            ]
+            self.__requested.update (missing)
+            generation = self.__generation
+
+        for idx in missing:
+            loader_pool.default_pool.submit (
+                (self, idx),
+                functools.partial (self.__decode, generation, self.__paths[idx]),
+                functools.partial (self.__decoded_thumbnail, generation, idx),
+                priority
+            )
+
+    def __free_slot (self: 'ThumbnailGridRenderer', visible: range) -> int:
+        used = set (self.__slots.values ())
+        if len (used) < SLOTS:
+            return next (slot for slot in range (SLOTS) if slot not in used)
+
+        for idx in list (self.__slots.keys ()):
+            if idx not in visible:
+                self.__requested.discard (idx)
+                return self.__slots.pop (idx)
+
+        return -1
+
+    def __upload (self: 'ThumbnailGridRenderer', visible: range) -> None:
+        with self.__lock:
+            decoded = [item for item in self.__decoded if item[0] == self.__generation]
+            self.__decoded = []
+
+        GL.glActiveTexture (GL.GL_TEXTURE0)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__atlas)
+
+        for _, idx, data in decoded:
+            if idx not in visible:
+                # scrolled away while decoding, it is requested again when needed
+                with self.__lock:
+                    self.__requested.discard (idx)
+                continue
+
+            slot = self.__free_slot (visible)
+            if slot < 0:
+                break
+
+            height, width = data.shape[:2]
+            GL.glPixelStorei (GL.GL_UNPACK_ALIGNMENT, pixels.unpack_alignment (data))
+            GL.glTexSubImage2D (GL.GL_TEXTURE_2D, 0,
+                                (slot % SLOTS_PER_ROW) * CELL_SIZE,
+                                (slot // SLOTS_PER_ROW) * CELL_SIZE,
+                                width, height,
+                                GL.GL_RGBA if data.shape[2] == 4 else GL.GL_RGB,
+                                GL.GL_UNSIGNED_BYTE, data)
+            self.__slots[idx] = slot
+            self.__thumbnail_sizes[idx] = (width, height)
+
+    def resize (self: 'ThumbnailGridRenderer', width: int, height: int) -> None:
+        super ().resize (width, height)
+
+    def render (self: 'ThumbnailGridRenderer') -> None:
+        super ().render ()
+
+        if not self.__paths:
+            return
+
+        visible = self.__visible_range (0)
+        self.__request (visible, loader_pool.VISIBLE)
+        self.__request (self.__visible_range (MARGIN_ROWS), loader_pool.PREFETCH)
+        self.__upload (self.__visible_range (MARGIN_ROWS))
+
+        GL.glUseProgram (self.program)
+        GL.glBindVertexArray (self.vertex_array)
+        GL.glActiveTexture (GL.GL_TEXTURE0)
+        GL.glBindTexture (GL.GL_TEXTURE_2D, self.__atlas)
+        GL.glUniform1i (self.__uniform_atlas, 0)
+        GL.glUniform2f (self.__uniform_view_size, self.gl_widget.width, self.gl_widget.height)
+
+        for idx in visible:
+            if idx not in self.__slots:
+                continue
+
+            slot = self.__slots[idx]
+            self.__slots.move_to_end (idx)
+            width, height = self.__thumbnail_sizes[idx]
+            scale = self.size / max (width, height)
+
+            x = (idx % self.columns) * (self.size + self.spacing)
+            y = (idx // self.columns) * self.row_height - self.scroll
+            GL.glUniform4f (self.__uniform_rect,
+                            x + (self.size - width * scale) / 2,
+                            y + (self.size - height * scale) / 2,
+                            width * scale, height * scale)
+            GL.glUniform4f (self.__uniform_tex_rect,
+                            (slot % SLOTS_PER_ROW) * CELL_SIZE / ATLAS_SIZE,
+                            (slot // SLOTS_PER_ROW) * CELL_SIZE / ATLAS_SIZE,
+                            width / ATLAS_SIZE, height / ATLAS_SIZE)
+            GL.glDrawArrays (GL.GL_TRIANGLE_STRIP, 0, 4)
+
+    def update (self: 'ThumbnailGridRenderer') -> None:
+        super ().update ()
+
+class ThumbnailGrid (GLWidget):
+    def __init__ (self: 'ThumbnailGrid', gl_major_version: int, gl_minor_version: int,
+                  columns: int = 3, size: int = 100, spacing: int = 8,
+                  visible_rows: int = 3) -> None:
+        super ().__init__ (ThumbnailGridRenderer (columns, size, spacing),
+                           gl_major_version, gl_minor_version)
+
+        self.__renderer = self.renderer # type: ThumbnailGridRenderer
+        self.set_size_request (columns * (size + spacing) - spacing,
+                               visible_rows * (size + spacing) - spacing)
+
+        self.__adjustment = Gtk.Adjustment (0, 0, 0, size / 4, size, 0)
+        self.__adjustment.connect ("value-changed", self.__on_scrolled)
+        scrollbar = Gtk.Scrollbar (orientation = Gtk.Orientation.VERTICAL,
+                                   adjustment = self.__adjustment)
+        scrollbar.props.halign = Gtk.Align.END
+        self.add_overlay (scrollbar)
+
+        self.gl_area.add_events (Gdk.EventMask.SCROLL_MASK | Gdk.EventMask.SMOOTH_SCROLL_MASK)
+        self.gl_area.connect ("scroll-event", self.__on_scroll_event)
+        self.gl_area.connect ("size-allocate", self.__on_size_allocate)
+
+    def set_paths (self: 'ThumbnailGrid', paths: List[str]) -> None:
+        self.__renderer.paths = paths
+        self.__update_adjustment ()
+        self.__adjustment.set_value (0)
+        self.gl_area.queue_draw ()
+
+    def __update_adjustment (self: 'ThumbnailGrid') -> None:
+        self.__adjustment.set_upper (self.__renderer.content_height)
+        self.__adjustment.set_page_size (self.gl_area.get_allocated_height ())
+
+    def __on_size_allocate (self: 'ThumbnailGrid', widget: Gtk.Widget,
+                            allocation: Gdk.Rectangle) -> None:
+        self.__update_adjustment ()
+
+    def __on_scrolled (self: 'ThumbnailGrid', adjustment: Gtk.Adjustment) -> None:
+        self.__renderer.scroll = adjustment.get_value ()
+        self.gl_area.queue_draw ()
+
+    def __on_scroll_event (self: 'ThumbnailGrid', widget: Gtk.Widget,
+                           event: Gdk.EventScroll) -> bool:
+        if event.direction == Gdk.ScrollDirection.SMOOTH:
+            delta = event.delta_y
+        elif event.direction == Gdk.ScrollDirection.UP:
+            delta = -1
+        elif event.direction == Gdk.ScrollDirection.DOWN:
+            delta = 1
+        else:
+            return False
+
+        self.__adjustment.set_value (
+            self.__adjustment.get_value () + delta * self.__adjustment.get_step_increment ()
+        )
+        return True
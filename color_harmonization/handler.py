@@ -45,12 +45,16 @@ class Handler:
 
     def on_automatic_configuration_clicked (self: 'Handler', button: Gtk.Button,
                                             user_data: Any = None) -> None:
-        print ("Automatic configuration clicked")
+        global_variables.App.assistant.automatic_configuration ()
 
     def on_sector_chooser_changed (self: 'Handler', combobox: Gtk.ComboBox,
                                    user_data: Any = None) -> None:
-        value = combobox.get_model ().get (combobox.get_active_iter (), 0)[0]
-        print ("Sector chooser changed to '{}'".format (value))
+        from color_harmonization.engine import sector_assignment
+
+        # the rows of the sector chooser list store follow sector_assignment.CHOOSERS
+        global_variables.App.assistant.set_sector_chooser (
+            sector_assignment.CHOOSERS[combobox.get_active ()]
+        )
 
     def on_harmonize_cancel_clicked (self: 'Handler', button: Gtk.Button,
                                      user_data: Any = None) -> None:
@@ -0,0 +1,112 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import argparse
+import os
+import sys
+import time
+
+from typing import List
+from color_harmonization.engine import fitting, frames, lut3d, templates, tiling
+
+FRAME_FORMATS = sorted ({extension[1:] for extension in frames.FRAME_EXTENSIONS})
+
+def parse_args (argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser (
+        prog = "python3 -m color_harmonization sequence",
+        description = "Harmonize the frames of an animation or a directory of numbered "
+                      "frames without flickering between them."
+    )
+    parser.add_argument ("input", metavar = "SEQUENCE",
+                         help = "animated GIF, APNG or WebP, or a directory of frames")
+    parser.add_argument ("-o", "--output", required = True, metavar = "PATH",
+                         help = "animation ({}) or directory the frames are written to".format (
+                             ", ".join (frames.ANIMATION_EXTENSIONS)))
+    parser.add_argument ("--frame-format", choices = FRAME_FORMATS, metavar = "EXT",
+                         help = "file type of frames written to a directory, one of {}; "
+                                "by default every frame keeps the type of its input".format (
+                                    ", ".join (FRAME_FORMATS)))
+    parser.add_argument ("-t", "--template", default = "auto",
+                         choices = ["auto"] + templates.NAMES,
+                         help = "harmonic template, 'auto' picks the best fitting one")
+    parser.add_argument ("--window", type = int, default = frames.DEFAULT_WINDOW, metavar = "N",
+                         help = "number of frames the histogram is smoothed over")
+    parser.add_argument ("--max-step", type = float,
+                         default = frames.MAX_ROTATION_STEP * 360, metavar = "DEGREES",
+                         help = "largest rotation of the template from one frame to the next")
+    parser.add_argument ("-j", "--jobs", type = int, default = os.cpu_count () or 1,
+                         help = "number of worker threads")
+    parser.add_argument ("--analysis-size", type = int, default = frames.ANALYSIS_SIZE,
+                         help = "size of the preview every frame is analysed on")
+    parser.add_argument ("--lut-size", type = int, default = 0, metavar = "N",
+                         help = "harmonize through an N×N×N 3D LUT instead of per pixel, "
+                                "e.g. {}".format (lut3d.DEFAULT_SIZE))
+    parser.add_argument ("-m", "--memory-limit", type = tiling.parse_size,
+                         default = tiling.DEFAULT_MEMORY_LIMIT, metavar = "SIZE",
+                         help = "memory the workers may use for frame strips, e.g. 512M")
+    parser.add_argument ("-v", "--verbose", action = "store_true",
+                         help = "print the template of every frame")
+    args = parser.parse_args (argv)
+
+    if args.lut_size == 1 or args.lut_size < 0:
+        parser.error ("--lut-size must be 0 or at least 2")
+
+    if args.max_step <= 0:
+        parser.error ("--max-step must be positive")
+
+    if args.frame_format is not None and frames.is_animation (args.output):
+        parser.error ("--frame-format only applies to a directory of frames")
+
+    return args
+
+def run (args: argparse.Namespace) -> int:
+    def progress (frame: frames.Frame, fit: fitting.Fit) -> None:
+        if args.verbose:
+            print ("frame {}: {} rotated by {:.1f}° (cost {:.4f})".format (
+                frame.index, fit.template, fit.rotation * 360, fit.cost
+            ))
+
+    if os.path.exists (args.output) and os.path.samefile (args.input, args.output):
+        print ("{}: error: the output is the input sequence".format (args.input),
+               file = sys.stderr)
+        return 1
+
+    extension = None if args.frame_format is None else "." + args.frame_format
+    writer = frames.open_writer (args.output, extension = extension)
+    start = time.perf_counter ()
+
+    try:
+        count = frames.harmonize_frames (
+            frames.read_frames (args.input), writer, args.template, args.window,
+            args.max_step / 360, args.analysis_size, args.lut_size, max (1, args.jobs),
+            args.memory_limit, progress
+        )
+        writer.close ()
+    except (OSError, ValueError) as e:
+        print ("{}: error: {}".format (args.input, e), file = sys.stderr)
+        return 1
+
+    elapsed = time.perf_counter () - start
+    print ("{} frames in {:.2f} s ({:.1f} frames/s) -> {}".format (
+        count, elapsed, count / elapsed if elapsed > 0 else 0.0, args.output
+    ))
+    return 0
+
+def main (argv: List[str]) -> int:
+    return run (parse_args (argv))
@@ -0,0 +1,61 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import contextlib
+import sys
+import time
+from typing import Iterator, List, TextIO, Tuple
+from color_harmonization import tracing
+
+# Set by `--startup-profile`; timing is skipped entirely otherwise.
+enabled = False
+
+_origin = time.perf_counter ()
+_phases = [] # type: List[Tuple[str, float, float]]
+
+@contextlib.contextmanager
+def phase (name: str) -> Iterator[None]:
+    with tracing.span (name, "startup"):
+        if not enabled:
+            yield
+            return
+
+        start = time.perf_counter ()
+        try:
+            yield
+        finally:
+            _phases.append ((name, start - _origin, time.perf_counter () - start))
+
+def mark (name: str) -> None:
+    if enabled:
+        _phases.append ((name, time.perf_counter () - _origin, 0.0))
+
+def report (stream: TextIO = sys.stderr) -> None:
+    if not enabled:
+        return
+
+    for name, start, duration in _phases:
+        if duration > 0:
+            print ("{:8.1f} ms  {:<24} {:8.1f} ms".format (
+                start * 1000, name, duration * 1000
+            ), file = stream)
+        else:
+            print ("{:8.1f} ms  {}".format (start * 1000, name), file = stream)
+
+    del _phases[:]
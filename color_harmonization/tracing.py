@@ -0,0 +1,164 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, TypeVar
+
+# Traces are written as Chrome trace event JSON, which chrome://tracing and
+# https://ui.perfetto.dev open directly. Set this variable to the output path,
+# or pass `--trace FILE`.
+ENV_VARIABLE = "COLOR_HARMONIZATION_TRACE"
+
+enabled = False
+
+_path = None # type: str
+_pid = os.getpid ()
+_events = [] # type: List[Dict[str, Any]]
+_thread_names = {} # type: Dict[Any, str]
+_lock = threading.Lock ()
+
+F = TypeVar ('F', bound = Callable[..., Any])
+
+class _NullSpan:
+    def __enter__ (self: '_NullSpan') -> None:
+        pass
+
+    def __exit__ (self: '_NullSpan', *args: Any) -> None:
+        pass
+
+NULL_SPAN = _NullSpan ()
+
+class _Span:
+    def __init__ (self: '_Span', name: str, category: str, args: Dict[str, Any]) -> None:
+        self.__name = name
+        self.__category = category
+        self.__args = args
+        self.__start = 0.0
+
+    def __enter__ (self: '_Span') -> None:
+        self.__start = now ()
+
+    def __exit__ (self: '_Span', *args: Any) -> None:
+        complete (self.__name, self.__category, self.__start, now () - self.__start,
+                  args = self.__args)
+
+def now () -> float:
+    # microseconds on the monotonic clock, which worker processes share
+    return time.perf_counter () * 1e6
+
+def enable (path: str) -> None:
+    global enabled, _path, _pid
+
+    if not enabled:
+        atexit.register (_write_at_exit)
+
+    enabled = True
+    _path = path
+    _pid = os.getpid ()
+
+def span (name: str, category: str = "cpu", **args: Any) -> Any:
+    # a shared no-op context manager while tracing is off
+    if not enabled:
+        return NULL_SPAN
+
+    return _Span (name, category, args)
+
+def traced (name: str, category: str = "cpu") -> Callable[[F], F]:
+    def decorate (function: F) -> F:
+        @functools.wraps (function)
+        def wrapper (*args: Any, **kwargs: Any) -> Any:
+            if not enabled:
+                return function (*args, **kwargs)
+
+            with _Span (name, category, {}):
+                return function (*args, **kwargs)
+
+        return wrapper # type: ignore
+    return decorate
+
+def complete (name: str, category: str, start: float, duration: float,
+              thread: str = None, args: Dict[str, Any] = None) -> None:
+    # thread names a timeline of its own, e.g. for GPU timer queries
+    if thread is None:
+        tid = threading.get_ident () # type: Any
+        thread = threading.current_thread ().name
+    else:
+        tid = thread
+
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start,
+        "dur": duration,
+        "pid": os.getpid (),
+        "tid": tid
+    } # type: Dict[str, Any]
+
+    if args:
+        event["args"] = args
+
+    with _lock:
+        _events.append (event)
+        _thread_names.setdefault ((event["pid"], tid), thread)
+
+def drain () -> List[Dict[str, Any]]:
+    # hands the events of a worker process over to the process that writes
+    # forked workers start with a copy of the parent's events, which stay out
+    pid = os.getpid ()
+
+    with _lock:
+        events = [event for event in _events if event["pid"] == pid]
+        events.extend (event for event in _metadata () if event["pid"] == pid)
+        del _events[:]
+        _thread_names.clear ()
+    return events
+
+def extend (events: List[Dict[str, Any]]) -> None:
+    with _lock:
+        _events.extend (events)
+
+def _metadata () -> List[Dict[str, Any]]:
+    return [{
+        "name": "thread_name",
+        "ph": "M",
+        "pid": pid,
+        "tid": tid,
+        "args": {"name": name}
+    } for (pid, tid), name in _thread_names.items ()]
+
+def write (path: str) -> None:
+    with _lock:
+        events = _events + _metadata ()
+
+    with open (path, "w") as f:
+        json.dump ({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def _write_at_exit () -> None:
+    # forked workers inherit the handler, only the enabling process writes
+    if enabled and os.getpid () == _pid and _path is not None:
+        write (_path)
+
+if os.environ.get (ENV_VARIABLE):
+    enable (os.environ[ENV_VARIABLE])
@@ -0,0 +1,77 @@
+'''
+Copyright (C) 2016  David Bögelsack, Fin Christensen
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+
+import unittest
+import numpy
+
+from color_harmonization.engine import harmonization, templates
+
+ROTATIONS = (0.0, 0.1, 0.37, 0.5, 0.81, 0.999)
+
+def exact_harmonize (pixels: numpy.ndarray, widths: numpy.ndarray,
+                     centers: numpy.ndarray) -> numpy.ndarray:
+    # the per pixel mapping the hue table replaces: nearest sector, then
+    # shift_hue evaluated for every pixel
+    widths, centers = harmonization.sector_arrays (widths, centers)
+
+    with numpy.errstate (all = 'ignore'):
+        hsv = harmonization.rgb_to_hsv (pixels.astype (numpy.float32) / 255)
+        sector = harmonization.nearest_sector (hsv[..., 0], widths, centers)
+        hsv[..., 0] = harmonization.shift_hue (hsv[..., 0], widths[sector], centers[sector])
+        color = numpy.clip (numpy.nan_to_num (harmonization.hsv_to_rgb (hsv)), 0, 1)
+
+    return numpy.rint (color * 255).astype (numpy.uint8)
+
+def sample_colors () -> numpy.ndarray:
+    # a coarse grid of the RGB cube plus every gray level
+    levels = numpy.arange (0, 256, 5, dtype = numpy.uint8)
+    grid = numpy.stack (numpy.meshgrid (levels, levels, levels, indexing = "ij"), axis = -1)
+    grays = numpy.repeat (numpy.arange (256, dtype = numpy.uint8)[:, numpy.newaxis], 3, axis = 1)
+    return numpy.concatenate ((grid.reshape (-1, 3), grays))
+
+class HueTableTest (unittest.TestCase):
+    def test_matches_exact_mapping (self: 'HueTableTest') -> None:
+        pixels = sample_colors ()
+
+        for name in templates.NAMES:
+            for rotation in ROTATIONS:
+                with self.subTest (template = name, rotation = rotation):
+                    sectors = templates.TEMPLATES[name]
+                    widths = templates.sector_widths (sectors)
+                    centers = templates.sector_centers (sectors, rotation)
+
+                    expected = exact_harmonize (pixels, widths, centers).astype (int)
+                    result = harmonization.harmonize (pixels, widths, centers)
+                    self.assertLessEqual (numpy.abs (result - expected).max (), 1)
+
+    def test_sector_index_selects_row (self: 'HueTableTest') -> None:
+        pixels = sample_colors ()
+        sectors = templates.TEMPLATES["X-type"]
+        widths = templates.sector_widths (sectors)
+        centers = templates.sector_centers (sectors, 0.25)
+
+        for sector in range (len (widths)):
+            index = numpy.full (len (pixels), sector, dtype = numpy.uint8)
+            expected = exact_harmonize (pixels, widths[sector:sector + 1],
+                                        centers[sector:sector + 1]).astype (int)
+            result = harmonization.harmonize (pixels, widths, centers, index)
+            self.assertLessEqual (numpy.abs (result - expected).max (), 1)
+
+if __name__ == '__main__':
+    unittest.main ()